@@ -4,16 +4,22 @@ import streamlit as st
 import luana_engine
 from luana_engine import interpreter
 import os
+import json
+from luana_engine import tracing
 from luana_engine.utils import load_dotenv, plot_files
+from luana_engine.dashboard_snapshot import get_snapshot_builder
+from luana_engine.kpi_engine import NOT_AVAILABLE
+from luana_engine.question_prefetch import SAMPLE_QUESTIONS, get_question_prefetcher
+from luana_engine.question_cache import get_question_cache
+from luana_engine.socrata_ingest import sync_in_background
 from sodapy import Socrata
-import pandas as pd
 import plotly.io as pio
-import json
 
 load_dotenv()
-
-
-metric_prompt_template = """and it's delta over last time period in percentage, return a json obeject of schema: {"value": "", "delta": ""}, no explaination, return the json object directly in your response."""
+# reuse completions for repeated dashboard prompts on the same data
+os.environ.setdefault("COMPLETION_CACHE", "on")
+# answer questions asked before in other words from the stored answers
+os.environ.setdefault("QUESTION_CACHE", "on")
 
 
 # set color palette
@@ -82,20 +88,33 @@ if check_password():
         if data == "Company Finance":
             os.environ["data"] = ".data/finance.csv"
             st.markdown("Sample questions you can ask about Company Finance:")
-            st.markdown("1. What is the total revenue in September?")
-            st.markdown("2. Show me the revenue month over month")
-            st.markdown("3. Show me July cost breakdown by category")
-            st.markdown("4. Give me a trend on consulting fees")
-            st.markdown("5. Show me my P&L month over month")
-            st.markdown("6. Show me my profit margin month over month")
-            st.markdown("7. Export the data for me")
+            for idx, question in enumerate(SAMPLE_QUESTIONS[os.environ["data"]]):
+                st.markdown(f"{idx + 1}. {question}")
 
         elif data == "SanFrancisco City Budget":
             os.environ["data"] = ".data/sf_budget.csv"
+            # downloaded from socrata in the background, refreshed with the rows changed since once an hour.
+            # Unauthenticated client only works with public data sets. Note 'None'
+            # in place of application token, and no username or password
+            sync_in_background(
+                lambda: Socrata("data.sfgov.org", None), "xdgd-c79v", os.environ["data"]
+            )
             st.markdown("Sample questions you can ask about City Budget")
-            st.markdown("1. show me the total budget year over year")
-            st.markdown("2. what contributed to the budget decrease in year 2021?")
-            st.markdown("3. give me a budget breakdown in 2021")
+            for idx, question in enumerate(SAMPLE_QUESTIONS[os.environ["data"]]):
+                st.markdown(f"{idx + 1}. {question}")
+
+        if os.environ.get("DEBUG_MODE", False):
+            # record where the time of each answer goes, open the file in chrome://tracing
+            if st.checkbox("Record traces", value=tracing.is_enabled()):
+                tracing.enable()
+                st.download_button(
+                    "Download trace",
+                    json.dumps(tracing.chrome_trace(), default=str),
+                    "trace.json",
+                    "application/json",
+                )
+            else:
+                tracing.disable()
 
 
     st.title("Your Finance Dashboard")
@@ -105,105 +124,44 @@ if check_password():
     if "agent" not in st.session_state:
         st.session_state["agent"] = interpreter.Interpreter()
         st.session_state["agent"].use_azure = False #os.environ['USE_AZURE']
-
-
-    # download data from socrata
-    @st.cache_data
-    def download_data():
-        if not os.path.exists(".data/sf_budget.csv"):
-            # Unauthenticated client only works with public data sets. Note 'None'
-            # in place of application token, and no username or password:
-            client = Socrata("data.sfgov.org", None)
-            results = client.get("xdgd-c79v", limit=2000)
-            # Convert to pandas DataFrame
-            results_df = pd.DataFrame.from_records(results)
-            # store df to file
-            results_df.to_csv(".data/sf_budget.csv", index=False)
-
-
-    download_data()
-
-
-    @st.cache_resource
-    def get_metrics():
-        all_metrics_data = {}
-        all_files = []
-        messages, _ = st.session_state["agent"].chat(
-            "Analyze the data and come up with 1-4 key metrics you can calculate to show value, and delta over last time period. "
-            + "Tell me the metric names directly in one sentence, comma seperated, without any explanation, ",
-            return_messages=True,
-            show_thinking=False,
-        )
-        print("messages inside metrics", messages)
-        metrics = messages[-1]["content"].split(",")
-        num_metrics = len(metrics)
-
-        if num_metrics > 0:
-            for i in range(num_metrics):
-                metrics[i] = metrics[i].strip()
-                existing_files = os.listdir(".output/")
-                print("existing files are", existing_files)
-                print("trying to find file", metrics[i] + ".json")
-                if metrics[i] + ".json" in existing_files:
-                    print("found file", metrics[i] + ".json")
-                    all_files.append(".output/" + metrics[i] + ".json")
-                    # read json file as string
-                    print('trying to read', ".output/" + metrics[i] + ".json")
-                    with open(".output/" + metrics[i] + ".json", "r") as f:
-                        metric_data = json.load(f)
-                        print(metric_data)
-                        y_values = metric_data['data'][0]['y']
-                        last_value = y_values[-1]
-                        second_last_value = y_values[-2]
-                        delta = (last_value - second_last_value) / second_last_value * 100
-                        delta = "{:.2f}".format(delta)
-                        last_value = "{:.2f}".format(last_value)
-                        all_metrics_data[metrics[i]] = {"value": last_value, "delta": delta}
-                else:
-                    files = st.session_state["agent"].chat(
-                        f"now plot the metric {metrics[i]} over time, save the plot as {metrics[i]}.json using plotly",
-                        return_messages=False,
-                        plot=False,
-                        show_thinking=False,
-                    )
-                    if len(files) > 0:
-                        all_files.extend(files)
-                    messages, _ = st.session_state["agent"].chat(
-                        "now calculate the value of " + metrics[i] + metric_prompt_template,
-                        return_messages=True,
-                        show_thinking=False,
-                    )
-                    # parse last message as json object
-                    start_pos = messages[-1]["content"].find("{")
-                    end_pos = messages[-1]["content"].rfind("}") + 1
-
-                    # Extract the JSON object string
-                    json_str = messages[-1]["content"][start_pos:end_pos]
-
-                    # Parse the JSON object string to a Python dictionary
-                    metric_data = json.loads(json_str)
-                    value = metric_data["value"]
-                    value = "{:.2f}".format(value)
-                    delta = metric_data["delta"]
-                    # convert delta to show 2 decimal places
-                    delta = "{:.2f}".format(delta)
-                    all_metrics_data[metrics[i]] = {"value": value, "delta": delta}
-        else:
-            print("No metrics found")
-
-        return all_metrics_data, num_metrics, all_files
-
-
-    all_metrics_data, num_metrics, all_files = get_metrics()
-    metric_coponents = st.columns(num_metrics)
-    i = 0
-    for key, value in all_metrics_data.items():
-        metric_coponents[i].metric(
-            label=key,
-            value=value["value"],
-            delta=value["delta"] + "%",
-        )
-        i += 1
+        # sample questions answered in the background are served without running the agent
+        st.session_state["agent"].prefetcher = get_question_prefetcher()
+        st.session_state["agent"].question_cache = get_question_cache()
+
+
+    # dashboards are built in the background and served from their last snapshot,
+    # only the very first build of a dataset is waited for
+    data_path = os.environ.get("data", ".data/finance.csv")
+    if not os.path.exists(data_path):
+        st.info("The data is being downloaded, reload the page in a minute.")
+        st.stop()
+    snapshot, pending_build = get_snapshot_builder().get(data_path)
+    if snapshot is None:
+        with st.spinner("Building your dashboard for the first time..."):
+            try:
+                snapshot = pending_build.result()
+            except Exception as e:
+                st.error(f"Could not build the dashboard: {e}")
+                st.stop()
+    elif pending_build is not None:
+        st.caption("The data changed, an updated dashboard is being built in the background.")
+
+    # answer the sample questions of the selected data while the user reads the dashboard
+    prefetcher = get_question_prefetcher()
+    if prefetcher is not None:
+        prefetcher.prefetch(data_path, SAMPLE_QUESTIONS.get(data_path, []))
+
+    all_metrics_data = snapshot["tiles"]
+    if all_metrics_data:
+        metric_coponents = st.columns(len(all_metrics_data))
+        for idx, (metric, result) in enumerate(all_metrics_data.items()):
+            metric_coponents[idx].metric(
+                label=metric,
+                value=result["value"],
+                delta=result["delta"] + "%" if result["delta"] != NOT_AVAILABLE else None,
+            )
+    # plots of the metrics, answers to questions are appended to it
+    all_files = list(snapshot["files"])
 
     dashboard1, dashboard2 = st.columns(2, gap="large")
     # plot file alternatively in dashboard 1 and 2
@@ -220,25 +178,7 @@ if check_password():
         idx += 1
 
 
-    @st.cache_resource
-    def get_summary():
-        # append key metrics into string
-        metric_summary = ""
-        for metric_name in all_metrics_data:
-            metric = all_metrics_data[metric_name]
-            # each metric contains name, value and delta, append all fields
-            metric_summary += metric_name + " current value is " + metric["value"] + " delta over last period is " + metric["delta"] + "\n"
-
-        messages, _ = st.session_state["agent"].chat(
-            "Based on the key metrics, generate a executive summary and recommendations in 2-3 sentences: " + metric_summary,
-            return_messages=True,
-            plot=False,
-            show_thinking=False,
-        )
-        return messages[-1]["content"].replace("$", "\$")
-
-
-    summary = get_summary()
+    summary = snapshot["summary"].replace("$", "\$")
     st.title("**Executive Summary:**")
     st.markdown(summary)
     st.markdown("**Got questions? Ask here:**")
@@ -257,6 +197,9 @@ if check_password():
     if prompt := st.chat_input("Question about your financial data?"):
         st.chat_message("user", avatar="🙋‍♂️").markdown(prompt)
         with st.chat_message("assitant", avatar="📈"):
+            # interrupts the running code and stops the answer, the click reaches the
+            # app with the next streamed update
+            st.button("Stop", on_click=st.session_state["agent"].cancel, key="stop_answer")
             messages, files = st.session_state["agent"].chat(
                 prompt,
                 return_messages=True,
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+# Answers are stored here, one directory per dataset, content hash and question
+ANSWER_DIR = os.environ.get("ANSWER_DIR", ".cache/answers")
+# Bump this when the stored answers change so old ones are not served
+ANSWER_VERSION = 1
+
+
+def normalize_question(question):
+    """Lowercases a question and drops punctuation and repeated whitespace."""
+    return " ".join(re.sub(r"[^\w&%$/.-]+", " ", question.lower()).strip(" .").split())
+
+
+def question_key(question):
+    return hashlib.sha256(normalize_question(question).encode()).hexdigest()[:16]
+
+
+class AnswerStore:
+    """
+    Stores answers to questions about a dataset, with the files they produced.
+
+    Answers are keyed on the dataset's content hash, so an answer is only served
+    for the data it was computed from. Every answer is written to a temporary
+    directory and renamed into place, readers never see a partial answer.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+
+    def dataset_dir(self, data_path):
+        name = os.path.splitext(os.path.basename(data_path))[0]
+        return os.path.join(self.root or ANSWER_DIR, name)
+
+    def version_dir(self, data_path, digest):
+        return os.path.join(self.dataset_dir(data_path), f"{digest}-v{ANSWER_VERSION}")
+
+    def answer_dir(self, data_path, digest, question):
+        return os.path.join(self.version_dir(data_path, digest), question_key(question))
+
+    def load(self, directory):
+        try:
+            with open(os.path.join(directory, "answer.json")) as f:
+                answer = json.load(f)
+        except (OSError, ValueError):
+            return None
+        answer["files"] = [os.path.join(directory, "files", file) for file in answer["files"]]
+        return answer
+
+    def get(self, data_path, digest, question):
+        """Returns the stored answer to a question, None if there is none."""
+        return self.load(self.answer_dir(data_path, digest, question))
+
+    def answers(self, data_path, digest):
+        """Returns all answers stored for a version of a dataset."""
+        directory = self.version_dir(data_path, digest)
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            return []
+        answers = []
+        for name in names:
+            if not name.endswith(".tmp"):
+                answer = self.load(os.path.join(directory, name))
+                if answer is not None:
+                    answers.append(answer)
+        return answers
+
+    def put(self, data_path, digest, question, answer, files=(), source="chat"):
+        """Stores the answer to a question and copies the files it produced."""
+        directory = self.answer_dir(data_path, digest, question)
+        tmp_directory = f"{directory}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_directory)
+        try:
+            # The files are kept apart from answer.json, an output can have any name
+            files_directory = os.path.join(tmp_directory, "files")
+            os.makedirs(files_directory)
+            names = []
+            for file in files:
+                if os.path.isfile(file):
+                    names.append(os.path.basename(shutil.copy(file, files_directory)))
+            with open(os.path.join(tmp_directory, "answer.json"), "w") as f:
+                json.dump(
+                    {
+                        "version": ANSWER_VERSION,
+                        "question": question,
+                        "answer": answer,
+                        "files": names,
+                        "source": source,
+                        "created_at": time.time(),
+                    },
+                    f,
+                )
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp_directory, directory)
+        except BaseException:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+        return self.load(directory)
+
+    def prune(self, data_path, digest):
+        """Removes the answers stored for other versions of a dataset."""
+        keep = os.path.basename(self.version_dir(data_path, digest))
+        try:
+            names = os.listdir(self.dataset_dir(data_path))
+        except OSError:
+            return
+        for name in names:
+            if name != keep:
+                shutil.rmtree(os.path.join(self.dataset_dir(data_path), name), ignore_errors=True)
@@ -4,11 +4,27 @@ import tempfile
 import threading
 import traceback
 import platform
-import time
 import ast
 import sys
 import os
 import re
+import uuid
+import shutil
+import signal
+
+from .file_tracker import OUTPUT_DIR_VARIABLE, FileTracker, new_output_dir
+from .kernel_manager import process_rss
+from .pipe_multiplexer import OutputBuffer, get_multiplexer
+from .execution_limits import (
+    EXECUTION_CPU_TIMEOUT,
+    EXECUTION_TIMEOUT,
+    INTERRUPT_GRACE,
+    limit_memory,
+    process_cpu_time,
+    stopped_message,
+    wait_for_completion,
+)
+from . import tracing
 
 
 def run_html(html_content):
@@ -29,6 +45,7 @@ language_map = {
         # in interactive, quiet, and unbuffered mode
         "start_cmd": sys.executable + " -i -q -u",
         "print_cmd": 'print("{}")',
+        "error_print_cmd": 'print("{}", file=__import__("sys").stderr)',
     },
     "shell": {
         # On Windows, the shell start command is `cmd.exe`
@@ -37,13 +54,19 @@ language_map = {
         if platform.system() == "Windows"
         else os.environ.get("SHELL", "bash"),
         "print_cmd": 'echo "{}"',
+        "error_print_cmd": 'echo "{}" >&2',
+    },
+    "javascript": {
+        "start_cmd": "node -i",
+        "print_cmd": 'console.log("{}")',
+        "error_print_cmd": 'console.error("{}")',
     },
-    "javascript": {"start_cmd": "node -i", "print_cmd": 'console.log("{}")'},
     "applescript": {
         # Starts from shell, whatever the user's preference (defaults to '/bin/zsh')
         # (We'll prepend "osascript -e" every time, not once at the start, so we want an empty shell)
         "start_cmd": os.environ.get("SHELL", "/bin/zsh"),
         "print_cmd": 'log "{}"',
+        "error_print_cmd": 'echo "{}" >&2',
     },
     "html": {
         "open_subrocess": False,
@@ -71,13 +94,30 @@ class CodeInterpreter:
         self.active_line = None
         self.debug_mode = debug_mode
         self.output = ""
+        self.output_buffer = OutputBuffer()
         self.code = ""
+        # Artifacts are only looked for in the kernel's own directory
+        self.output_dir = new_output_dir()
+        self.file_tracker = FileTracker([self.output_dir])
+        self.done = threading.Event()
+        # Unique marker printed on stdout and stderr after each run's code
+        self.end_marker = None
+        self.pending_markers = set()
+        # Set to the process once its output was closed
+        self.closed_proc = None
+        self.timeout = EXECUTION_TIMEOUT
+        self.cpu_timeout = EXECUTION_CPU_TIMEOUT
+        self.interrupted = threading.Event()
+        # Callback of the current run for live output
+        self.on_output = None
 
     def start_process(self):
         # Get the start_cmd for the selected language
         start_cmd = language_map[self.language]["start_cmd"]
 
-        # Use the appropriate start_cmd to execute the code
+        # Use the appropriate start_cmd to execute the code, in its own process
+        # group so an interrupt reaches the commands it started too.
+        # Node reserves more address space than it uses, so it is not limited
         self.proc = subprocess.Popen(
             start_cmd.split(),
             stdin=subprocess.PIPE,
@@ -85,44 +125,87 @@ class CodeInterpreter:
             stderr=subprocess.PIPE,
             text=True,
             bufsize=0,
+            preexec_fn=limit_memory() if self.language != "javascript" else None,
+            start_new_session=True,
+            env={**os.environ, OUTPUT_DIR_VARIABLE: self.output_dir},
         )
 
-        # Start watching ^ its `stdout` and `stderr` streams
-        threading.Thread(
-            target=self.save_and_display_stream,
-            args=(self.proc.stdout, False),  # Passes False to is_error_stream
-            daemon=True,
-        ).start()
-        threading.Thread(
-            target=self.save_and_display_stream,
-            args=(self.proc.stderr, True),  # Passes True to is_error_stream
-            daemon=True,
-        ).start()
-
-    def update_active_block(self):
-        """
-        This will also truncate the output,
-        which we need to do every time we update the active block.
-        """
-        # Strip then truncate the output if necessary
-        self.output = truncate_output(self.output)
+        # Start watching ^ its `stdout` and `stderr` streams, on the shared
+        # multiplexer thread or, where pipes can't be selected, a thread per stream
+        multiplexer = get_multiplexer()
+        proc = self.proc
+        for stream, is_error_stream in [(proc.stdout, False), (proc.stderr, True)]:
+            if multiplexer:
+                multiplexer.register(
+                    stream,
+                    lambda line, is_error_stream=is_error_stream: self.handle_line(
+                        proc, line, is_error_stream
+                    ),
+                )
+            else:
+                threading.Thread(
+                    target=self.save_and_display_stream,
+                    args=(proc, stream, is_error_stream),
+                    daemon=True,
+                ).start()
+
+    def memory_usage(self):
+        """Returns the resident memory of the subprocess in bytes."""
+        if self.proc is None or self.proc.poll() is not None:
+            return 0
+        return process_rss(self.proc.pid)
+
+    def close(self):
+        """Stops the subprocess and removes the kernel's output directory."""
+        self.stop_process()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def stop_process(self):
+        """Stops the subprocess, it is started again on the next run."""
+        if self.proc is None:
+            return
+        self.signal_process(signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.signal_process(signal.SIGKILL if hasattr(signal, "SIGKILL") else signal.SIGTERM)
+            self.proc.wait()
+        self.proc = None
 
-        # Display it
-        # self.active_block.active_line = self.active_line
-        # self.active_block.output = self.output
-        # self.active_block.refresh()
+    def run(self, code, on_output=None):
+        """
+        Executes code and records the files it created or modified in `self.file_tracker`.
 
-    def run(self, code):
+        `on_output(kind, value)` is called from the reader thread while the code runs,
+        with kind "stdout" or "stderr" and an output line, or "active_line" and a line number.
+        """
+        with tracing.span("code_interpreter.run", language=self.language) as span:
+            with tracing.span("files.snapshot"):
+                self.file_tracker.start()
+            try:
+                output = self.execute(code, on_output)
+                span.set(output_bytes=len(output.encode("utf-8")) if output else 0)
+                return output
+            finally:
+                with tracing.span("files.compare") as files_span:
+                    files_span.set(changes=len(self.file_tracker.stop()))
+
+    def execute(self, code, on_output=None):
         """
         Executes code.
         """
 
         # Get code to execute
         self.code = code
+        self.on_output = on_output
 
         # Should we keep a subprocess open? True by default
         open_subrocess = language_map[self.language].get("open_subrocess", True)
 
+        # Restart the subprocess if it exited, e.g. the code called exit()
+        if self.proc and (self.proc.poll() is not None or self.closed_proc is self.proc):
+            self.stop_process()
+
         # Start the subprocess if it hasn't been started
         if not self.proc and open_subrocess:
             try:
@@ -132,22 +215,28 @@ class CodeInterpreter:
                 # Like if they don't have `node` installed or something.
 
                 traceback_string = traceback.format_exc()
-                self.output = traceback_string
-                self.update_active_block()
-
-                # Before you return, wait for the display to catch up?
-                # (I'm not sure why this works)
-                time.sleep(0.1)
-
+                self.output = truncate_output(traceback_string)
                 return self.output
 
         # Reset output
         self.output = ""
+        self.output_buffer = OutputBuffer()
+        self.interrupted.clear()
+        self.end_marker = "END_OF_EXECUTION_" + uuid.uuid4().hex
+        self.pending_markers = {False, True}
+        error_print_cmd = language_map[self.language].get("error_print_cmd")
 
         # Use the print_cmd for the selected language
         self.print_cmd = language_map[self.language].get("print_cmd")
         code = self.code
 
+        # Only worth the extra output when someone watches the lines run
+        if on_output and self.language in ("python", "shell"):
+            try:
+                code = self.add_active_line_prints(code)
+            except SyntaxError:
+                pass
+
         if self.language == "python":
             # This lets us stop execution when error happens (which is not default -i behavior)
             # And solves a bunch of indentation problems-- if everything's indented, -i treats it as one block
@@ -160,10 +249,12 @@ class CodeInterpreter:
         code = "\n".join(code_lines)
 
         # Add end command (we'll be listening for this so we know when it ends)
+        # It is printed on both streams, once both arrived all of the output was read
         if (
             self.print_cmd and self.language != "applescript"
         ):  # Applescript is special. Needs it to be a shell command because 'return' (very common) will actually return, halt script
-            code += "\n\n" + self.print_cmd.format("END_OF_EXECUTION")
+            code += "\n\n" + self.print_cmd.format(self.end_marker)
+            code += "\n" + error_print_cmd.format(self.end_marker)
 
         # Applescript-specific processing
         if self.language == "applescript":
@@ -174,7 +265,8 @@ class CodeInterpreter:
             # Prepend start command
             code = "osascript -e " + code
             # Append end command
-            code += '\necho "END_OF_EXECUTION"'
+            code += f'\necho "{self.end_marker}"'
+            code += "\n" + error_print_cmd.format(self.end_marker)
 
         # Debug
         if self.debug_mode:
@@ -189,7 +281,6 @@ class CodeInterpreter:
 
         # Reset self.done so we can .wait() for it
         self.done = threading.Event()
-        self.done.clear()
 
         # Write code to stdin of the process
         try:
@@ -199,19 +290,51 @@ class CodeInterpreter:
             # It can just.. break sometimes? Let's fix this better in the future
             # For now, just try again
             self.start_process()
-            self.run()
-            return
-
-        # Wait until execution completes
-        self.done.wait()
+            return self.execute(self.code, on_output)
+
+        # Wait until execution completes, both end markers were read, or a limit is hit
+        proc = self.proc
+        with tracing.span("code_interpreter.wait") as span:
+            reason = wait_for_completion(
+                self.done,
+                lambda: process_cpu_time(proc.pid),
+                self.interrupted,
+                self.timeout,
+                self.cpu_timeout,
+            )
+            span.set(stopped=reason)
 
-        # Before you return, wait for the display to catch up?
-        # (I'm not sure why this works)
-        time.sleep(0.1)
+        restarted = False
+        if reason:
+            self.signal_process(signal.SIGINT)
+            if not self.done.wait(INTERRUPT_GRACE):
+                self.stop_process()
+            # The process also exits on the interrupt, e.g. a shell
+            restarted = self.proc is not proc or self.closed_proc is proc
 
         # Return code output
+        self.output = self.output_buffer.text()
+        if reason:
+            message = stopped_message(reason, restarted, self.timeout, self.cpu_timeout)
+            self.output = (self.output + "\n" + message).strip()
         return self.output
 
+    def interrupt(self):
+        """Stops the running code, can be called from any thread."""
+        self.interrupted.set()
+
+    def signal_process(self, signum):
+        """Sends a signal to the process group of the subprocess."""
+        if self.proc is None:
+            return
+        if platform.system() == "Windows":
+            self.proc.terminate()
+            return
+        try:
+            os.killpg(self.proc.pid, signum)
+        except ProcessLookupError:
+            pass
+
     def add_active_line_prints(self, code):
         """
         This function takes a code snippet and adds print statements before each line,
@@ -269,46 +392,75 @@ class CodeInterpreter:
         code = "\n".join(modified_code_lines)
         return code
 
-    def save_and_display_stream(self, stream, is_error_stream):
-        # Handle each line of output
+    def save_and_display_stream(self, proc, stream, is_error_stream):
+        # Thread per stream, used where the multiplexer is not available
         for line in iter(stream.readline, ""):
-            if self.debug_mode:
-                print("Recieved output line:")
-                print(line)
-                print("---")
-
-            line = line.strip()
-
-            # Node's interactive REPL outputs a billion things
-            # So we clean it up:
-            if self.language == "javascript":
-                if "Welcome to Node.js" in line:
-                    continue
-                if line in ["undefined", 'Type ".help" for more information.']:
-                    continue
-                # Remove trailing ">"s
-                line = re.sub(r"^\s*(>\s*)+", "", line)
-
-            # Python's interactive REPL outputs a million things
-            # So we clean it up:
-            if self.language == "python":
-                if re.match(r"^(\s*>>>\s*|\s*\.\.\.\s*)", line):
-                    continue
-
-            # Check if it's a message we added (like ACTIVE_LINE)
-            # Or if we should save it to self.output
-            if line.startswith("ACTIVE_LINE:"):
-                self.active_line = int(line.split(":")[1])
-            elif "END_OF_EXECUTION" in line:
-                self.done.set()
+            self.handle_line(proc, line.rstrip("\n"), is_error_stream)
+        self.handle_line(proc, None, is_error_stream)
+
+    def handle_line(self, proc, line, is_error_stream):
+        """
+        Handles a line of output of the subprocess, `None` when the stream closed.
+        """
+        if proc is not self.proc:
+            # Output of a process that has been replaced
+            return
+
+        if line is None:
+            # The process exited, don't wait for the end markers
+            self.closed_proc = proc
+            self.done.set()
+            return
+
+        if self.debug_mode:
+            print("Recieved output line:")
+            print(line)
+            print("---")
+
+        line = line.strip()
+
+        # Node's interactive REPL outputs a billion things
+        # So we clean it up:
+        if self.language == "javascript":
+            if "Welcome to Node.js" in line:
+                return
+            if line in ["undefined", 'Type ".help" for more information.']:
+                return
+            # Remove trailing ">"s
+            line = re.sub(r"^\s*(>\s*)+", "", line)
+
+        # Python's interactive REPL outputs a million things
+        # So we clean it up: prompts are written to stderr in front of the output
+        if self.language == "python":
+            line = re.sub(r"^(\s*(>>>|\.\.\.)\s*)+", "", line)
+            if not line:
+                return
+
+        # Check if it's a message we added (like ACTIVE_LINE)
+        # Or if we should save it to self.output
+        if line.startswith("ACTIVE_LINE:"):
+            self.active_line = int(line.split(":")[1])
+            self.notify("active_line", self.active_line)
+        elif self.end_marker and line.endswith(self.end_marker):
+            # Output printed without a newline ends up in front of the marker
+            if line[: -len(self.end_marker)].strip():
+                self.output_buffer.append(line[: -len(self.end_marker)].strip())
+            self.pending_markers.discard(is_error_stream)
+            if not self.pending_markers:
                 self.active_line = None
-            elif is_error_stream and "KeyboardInterrupt" in line:
-                raise KeyboardInterrupt
-            else:
-                self.output += "\n" + line
-                self.output = self.output.strip()
+                self.done.set()
+        else:
+            self.output_buffer.append(line)
+            self.notify("stderr" if is_error_stream else "stdout", line)
 
-            self.update_active_block()
+    def notify(self, kind, value):
+        on_output = self.on_output
+        if on_output is None:
+            return
+        try:
+            on_output(kind, value)
+        except Exception as e:
+            print(f"Failed to stream output: {e}")
 
 
 def truncate_output(data):
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class CompletionCacheMiss(Exception):
+    """Raised in replay mode when a completion is not in the cache."""
+
+
+def normalize_messages(messages):
+    """
+    Keeps only the message fields sent to the API, so bookkeeping fields like
+    parsed_arguments and whitespace differences do not change the cache key.
+    """
+    normalized = []
+    for message in messages:
+        entry = {"role": message.get("role")}
+        if message.get("content"):
+            entry["content"] = message["content"].strip()
+        if message.get("name"):
+            entry["name"] = message["name"]
+        if message.get("function_call"):
+            entry["function_call"] = {
+                "name": message["function_call"].get("name"),
+                "arguments": message["function_call"].get("arguments", ""),
+            }
+        if message.get("tool_calls"):
+            entry["tool_calls"] = [
+                {
+                    "id": tool_call.get("id"),
+                    "name": tool_call["function"].get("name"),
+                    "arguments": tool_call["function"].get("arguments", ""),
+                }
+                for tool_call in message["tool_calls"]
+            ]
+        if message.get("tool_call_id"):
+            entry["tool_call_id"] = message["tool_call_id"]
+        normalized.append(entry)
+    return normalized
+
+
+class CompletionCache:
+    """
+    Caches streamed chat completions: an in-memory LRU in front of an on-disk store.
+
+    Entries are keyed on the model, the normalized messages, the function schema,
+    the temperature and the dataset hash. A cached completion is replayed as the
+    same stream of deltas the API returned. In "replay" mode nothing is sent to
+    the API and misses raise CompletionCacheMiss, which lets the app run offline.
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        mode="on",
+        memory_entries=256,
+        ttl=7 * 24 * 3600,
+        max_bytes=100 * 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, request, dataset=None):
+        payload = {
+            "model": request.get("model") or request.get("engine"),
+            "messages": normalize_messages(request["messages"]),
+            "functions": request.get("functions"),
+            "temperature": request.get("temperature"),
+            "dataset": dataset,
+        }
+        if request.get("tools"):
+            payload["tools"] = request["tools"]
+        serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        """Returns the cached chunks for a key, or None."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if now - entry["created"] <= self.ttl:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return entry["chunks"]
+                del self.memory[key]
+
+        try:
+            with open(self.path(key), "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+        if entry is None or now - entry["created"] > self.ttl:
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+            return None
+
+        self.remember(key, entry)
+        self.hits += 1
+        return entry["chunks"]
+
+    def put(self, key, chunks):
+        entry = {"created": time.time(), "chunks": chunks}
+        self.remember(key, entry)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.memory.pop(key, None)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Removes expired entries, then the oldest ones until the store fits in max_bytes."""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.ttl:
+                self.remove(entry.name[: -len(".json")])
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.name[: -len(".json")]))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, key in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+    async def replay(self, chunks):
+        """Re-emits cached chunks in the shape of a streamed API response."""
+        for chunk in chunks:
+            yield {
+                "choices": [
+                    {
+                        "delta": json.loads(json.dumps(chunk["delta"])),
+                        "finish_reason": chunk["finish_reason"],
+                    }
+                ]
+            }
+
+    async def record(self, key, response):
+        """Passes a streamed response through and stores it once it has finished."""
+        chunks = []
+        async for chunk in response:
+            if "choices" in chunk and len(chunk["choices"]) > 0:
+                choice = chunk["choices"][0]
+                # Copy before the consumer mutates the delta
+                chunks.append(
+                    {
+                        "delta": json.loads(json.dumps(choice["delta"])),
+                        "finish_reason": choice["finish_reason"],
+                    }
+                )
+                # Store on the last chunk, consumers stop reading once they see it
+                if choice["finish_reason"]:
+                    self.put(key, chunks)
+            yield chunk
+
+
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache():
+    """
+    Returns the process-wide completion cache, or None if COMPLETION_CACHE is "off".
+    """
+    global _completion_cache
+    mode = os.environ.get("COMPLETION_CACHE", "off")
+    if mode == "off":
+        return None
+    with _completion_cache_lock:
+        if _completion_cache is None:
+            _completion_cache = CompletionCache(
+                os.environ.get("COMPLETION_CACHE_DIR", ".cache/completions"),
+                memory_entries=int(os.environ.get("COMPLETION_CACHE_ENTRIES", 256)),
+                ttl=float(os.environ.get("COMPLETION_CACHE_TTL", 7 * 24 * 3600)),
+                max_bytes=int(
+                    os.environ.get("COMPLETION_CACHE_MAX_BYTES", 100 * 1024 * 1024)
+                ),
+            )
+        _completion_cache.mode = mode
+    return _completion_cache
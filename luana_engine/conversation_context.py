@@ -0,0 +1,235 @@
+import ast
+import os
+import threading
+import time
+
+from tokentrim.model_map import MODEL_MAX_TOKENS
+
+# Share of the model's context window the prompt may use, the rest is left for the answer
+CONTEXT_TRIM_RATIO = float(os.environ.get("CONTEXT_TRIM_RATIO", 0.5))
+# Prompt budget in tokens, overrides CONTEXT_TRIM_RATIO when set
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 0))
+# Function outputs before the latest one are cut to about this many characters
+COMPACT_OUTPUT_CHARS = int(os.environ.get("COMPACT_OUTPUT_CHARS", 300))
+
+# Overhead of every message in the chat format, see tokentrim
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+
+# Seconds before loading a tokenizer that failed is tried again
+ENCODER_RETRY_SECONDS = float(os.environ.get("ENCODER_RETRY_SECONDS", 300))
+
+_encoders = {}
+# Time after which the tokenizer of a model that failed to load is tried again
+_encoder_retry_at = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(model):
+    """
+    Returns the tokenizer's encode function for a model, or None if it can't be
+    loaded, e.g. tiktoken has to download it and the machine is offline. A failed
+    load is tried again after ENCODER_RETRY_SECONDS.
+    """
+    with _encoders_lock:
+        if model in _encoders:
+            return _encoders[model]
+        if time.monotonic() < _encoder_retry_at.get(model, 0):
+            return None
+        try:
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            encode = encoding.encode
+        except Exception as e:
+            print(f"Tokenizer for {model} not available, estimating token counts: {e}")
+            _encoder_retry_at[model] = time.monotonic() + ENCODER_RETRY_SECONDS
+            return None
+        _encoders[model] = encode
+        _encoder_retry_at.pop(model, None)
+        return encode
+
+
+def count_tokens(text, model):
+    """Counts the tokens of a text, about 4 characters per token without a tokenizer."""
+    encode = get_encoder(model)
+    if encode is None:
+        return (len(text) + 3) // 4
+    return len(encode(text, disallowed_special=()))
+
+
+def compact_output(content, max_chars=COMPACT_OUTPUT_CHARS):
+    """Shortens the output of an earlier function call to its start and end."""
+    if not content or len(content) <= max_chars:
+        return content
+    head = content[: max_chars * 2 // 3]
+    tail = content[len(content) - max_chars // 3 :]
+    return (
+        head
+        + f"\n... [earlier output compacted, {content.count(chr(10)) + 1} lines, "
+        + f"{len(content)} characters] ...\n"
+        + tail
+    )
+
+
+def summarize_functions(source):
+    """
+    Summarizes preset function source for the system message: its imports and one
+    line per function with its signature and leading comment or docstring.
+    """
+    tree = ast.parse(source)
+    source_lines = source.split("\n")
+    lines = []
+    imports = [
+        ast.get_source_segment(source, node)
+        for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+    if imports:
+        lines.append("; ".join(imports))
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        line = f"- {node.name}({ast.unparse(node.args)})"
+        description = ast.get_docstring(node)
+        if description is None:
+            # The comment block right below the def line
+            comments = []
+            for source_line in source_lines[node.lineno :]:
+                if not source_line.strip().startswith("#"):
+                    break
+                comments.append(source_line.strip().lstrip("#").strip())
+            description = " ".join(comments)
+        if description:
+            line += ": " + " ".join(description.split())
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def prompt_message(message):
+    """Returns the fields of a message that are sent to the model."""
+    prompt = {
+        key: value
+        for key, value in message.items()
+        if key not in ("function_call", "tool_calls")
+    }
+    if "function_call" in message:
+        prompt["function_call"] = call_fields(message["function_call"])
+    if "tool_calls" in message:
+        prompt["tool_calls"] = [
+            {
+                "id": tool_call["id"],
+                "type": tool_call.get("type", "function"),
+                "function": call_fields(tool_call["function"]),
+            }
+            for tool_call in message["tool_calls"]
+        ]
+    return prompt
+
+
+def call_fields(function_call):
+    return {key: function_call[key] for key in ("name", "arguments") if key in function_call}
+
+
+def is_output(message):
+    return message.get("role") in ("function", "tool")
+
+
+class ConversationContext:
+    """
+    Builds the prompt of each agent step within a token budget.
+
+    Token counts are cached per message, so a step only tokenizes the messages
+    added since the previous one. Function outputs before the latest one are
+    compacted, and the oldest messages are left out while the prompt is over
+    the budget.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, trim_ratio=CONTEXT_TRIM_RATIO):
+        self.budget = budget
+        self.trim_ratio = trim_ratio
+        # message fields -> tokens, only holds the messages of the last prompt
+        self.counts = {}
+        self.model = None
+        self.last_tokens = 0
+        self.last_dropped = 0
+
+    def token_budget(self, model):
+        if self.budget:
+            return self.budget
+        return int(MODEL_MAX_TOKENS.get(model, 8192) * self.trim_ratio)
+
+    def message_key(self, message):
+        return tuple(
+            (field, value if isinstance(value, str) else repr(value))
+            for field, value in message.items()
+        )
+
+    def message_tokens(self, message, counts):
+        key = self.message_key(message)
+        tokens = self.counts.get(key)
+        if tokens is None:
+            tokens = TOKENS_PER_MESSAGE
+            for field, value in key:
+                if field == "function_call":
+                    value = message[field].get("name", "") + message[field].get("arguments", "")
+                elif field == "tool_calls":
+                    value = "".join(
+                        call.get("name", "") + call.get("arguments", "")
+                        for call in (tool_call["function"] for tool_call in message[field])
+                    )
+                tokens += count_tokens(value, self.model)
+                if field == "name":
+                    tokens += TOKENS_PER_NAME
+        counts[key] = tokens
+        return tokens
+
+    def build(self, messages, system_message, model):
+        """
+        Returns the messages to send: the system message and as many of the most
+        recent messages as fit in the budget.
+        """
+        if model != self.model:
+            self.model = model
+            self.counts = {}
+
+        # The outputs of the latest step, one per call, are kept whole
+        latest_outputs = set()
+        for index in range(len(messages) - 1, -1, -1):
+            if is_output(messages[index]):
+                latest_outputs.add(index)
+            elif latest_outputs:
+                break
+
+        counts = {}
+        system = {"role": "system", "content": system_message}
+        budget = self.token_budget(model) - self.message_tokens(system, counts)
+        tokens = 0
+        kept = []
+        for index in range(len(messages) - 1, -1, -1):
+            message = prompt_message(messages[index])
+            if is_output(message) and index not in latest_outputs:
+                message["content"] = compact_output(message.get("content"))
+            message_tokens = self.message_tokens(message, counts)
+            if kept and tokens + message_tokens > budget:
+                break
+            if not kept and message_tokens > budget and message.get("content"):
+                # The latest message alone is over the budget, keep its start and end
+                keep_chars = max(len(message["content"]) * budget // message_tokens, 0)
+                message["content"] = compact_output(message["content"], keep_chars)
+                message_tokens = self.message_tokens(message, counts)
+            kept.append(message)
+            tokens += message_tokens
+
+        # A tool output can't be sent without the message with its call
+        while kept and kept[-1].get("role") == "tool":
+            tokens -= counts[self.message_key(kept.pop())]
+
+        # Counts of messages that fell out of the prompt are not needed again
+        self.counts = counts
+        self.last_tokens = tokens + counts[self.message_key(system)]
+        self.last_dropped = len(messages) - len(kept)
+        return [system] + kept[::-1]
@@ -0,0 +1,247 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .dataset_cache import dataset_digest
+from .kpi_engine import kpi_dashboard
+from .metrics_pipeline import MetricsPipeline, metric_names_prompt, parse_metric_names
+from . import tracing
+
+# Dashboard snapshots are stored here, one directory per dataset and content hash
+SNAPSHOT_DIR = os.environ.get("DASHBOARD_SNAPSHOT_DIR", ".cache/dashboard")
+# Bump this when the snapshot contents change so old snapshots are rebuilt
+SNAPSHOT_VERSION = 1
+# Datasets whose dashboards are kept built, comma separated
+DASHBOARD_DATASETS = os.environ.get("DASHBOARD_DATASETS", ".data/finance.csv")
+# How often the watched datasets are checked for changes, in seconds
+DASHBOARD_REFRESH_INTERVAL = float(os.environ.get("DASHBOARD_REFRESH_INTERVAL", 60))
+
+summary_prompt = "Based on the key metrics, generate a executive summary and recommendations in 2-3 sentences: "
+
+_builder = None
+_builder_lock = threading.Lock()
+
+
+def metric_summary(tiles):
+    """Describes the dashboard tiles for the summary prompt."""
+    summary = ""
+    for name, metric in tiles.items():
+        summary += (
+            name
+            + " current value is "
+            + metric["value"]
+            + " delta over last period is "
+            + metric["delta"]
+            + "\n"
+        )
+    return summary
+
+
+def dataset_snapshots_dir(data_path):
+    name = os.path.splitext(os.path.basename(data_path))[0]
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def snapshot_dir(data_path, digest):
+    return os.path.join(dataset_snapshots_dir(data_path), f"{digest}-v{SNAPSHOT_VERSION}")
+
+
+def load_snapshot(directory):
+    """Returns the snapshot stored in a directory, None if there is none."""
+    try:
+        with open(os.path.join(directory, "snapshot.json")) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    snapshot["files"] = [os.path.join(directory, file) for file in snapshot["files"]]
+    return snapshot
+
+
+def latest_snapshot(data_path):
+    """Returns the last snapshot built for a dataset, whatever data it was built from."""
+    try:
+        with open(os.path.join(dataset_snapshots_dir(data_path), "latest.json")) as f:
+            digest = json.load(f)["digest"]
+    except (OSError, ValueError, KeyError):
+        return None
+    return load_snapshot(snapshot_dir(data_path, digest))
+
+
+def write_json(path, value):
+    # Written next to the target and renamed, readers never see a partial file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def build_dashboard(data_path, output_dir, agent_factory):
+    """
+    Computes the tiles, plots and summary of a dashboard into output_dir.
+
+    Finance ledgers are computed by the kpi engine, other datasets are analysed
+    by the agent. The agent is only created when it is needed.
+    """
+    agent = None
+    kpis = kpi_dashboard(data_path, output_dir=output_dir)
+    if kpis is not None:
+        tiles, files = kpis["tiles"], kpis["files"]
+    else:
+        agent = agent_factory()
+        messages, _ = agent.chat(metric_names_prompt, return_messages=True, show_thinking=False)
+        pipeline = MetricsPipeline(
+            agent, parse_metric_names(messages[-1]["content"]), output_dir=output_dir
+        )
+        tiles = {}
+        for metric, result in pipeline.as_completed():
+            if result is not None:
+                tiles[metric] = {"value": result["value"], "delta": result["delta"]}
+        files = pipeline.files
+
+    agent = agent or agent_factory()
+    messages, _ = agent.chat(
+        summary_prompt + metric_summary(tiles),
+        return_messages=True,
+        plot=False,
+        show_thinking=False,
+    )
+    return {
+        "tiles": tiles,
+        "files": [os.path.basename(file) for file in files],
+        "summary": messages[-1]["content"],
+    }
+
+
+def build_snapshot(data_path, digest=None, agent_factory=None):
+    """
+    Builds the dashboard snapshot of a dataset and makes it the latest one.
+
+    The snapshot is built in a temporary directory and renamed into place, and
+    older snapshots of the dataset other than the previous one are removed.
+    """
+    if agent_factory is None:
+        from .interpreter import Interpreter as agent_factory
+
+    digest = digest or dataset_digest(data_path)
+    directory = snapshot_dir(data_path, digest)
+    with tracing.span("dashboard.snapshot", path=data_path):
+        tmp_directory = f"{directory}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_directory)
+        try:
+            snapshot = build_dashboard(data_path, tmp_directory, agent_factory)
+            snapshot.update(
+                version=SNAPSHOT_VERSION,
+                data_path=data_path,
+                digest=digest,
+                built_at=time.time(),
+            )
+            write_json(os.path.join(tmp_directory, "snapshot.json"), snapshot)
+            try:
+                os.replace(tmp_directory, directory)
+            except OSError:
+                # Built concurrently by another process, keep theirs
+                shutil.rmtree(tmp_directory, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+
+    previous = latest_snapshot(data_path)
+    keep = {os.path.basename(directory)}
+    if previous is not None:
+        keep.add(f"{previous['digest']}-v{SNAPSHOT_VERSION}")
+    write_json(os.path.join(dataset_snapshots_dir(data_path), "latest.json"), {"digest": digest})
+    for name in os.listdir(dataset_snapshots_dir(data_path)):
+        path = os.path.join(dataset_snapshots_dir(data_path), name)
+        if name not in keep and os.path.isdir(path) and not name.endswith(".tmp"):
+            shutil.rmtree(path, ignore_errors=True)
+    return load_snapshot(directory)
+
+
+class SnapshotBuilder:
+    """
+    Keeps the dashboard snapshots of the datasets up to date in the background.
+
+    `get` serves the snapshot of the current data if it is built, and otherwise
+    the latest snapshot of the dataset while the new one is built, so a page load
+    never waits for the dashboard once it has been built once.
+    """
+
+    def __init__(self, agent_factory=None):
+        self.agent_factory = agent_factory
+        # (data path, digest) -> Future of the build
+        self.builds = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dashboard-snapshot")
+        self.watcher = None
+
+    def ensure(self, data_path):
+        """
+        Starts building the snapshot of the dataset's current data unless it is
+        built already. Returns the Future of the build, None if there is nothing to build.
+        """
+        digest = dataset_digest(data_path)
+        if load_snapshot(snapshot_dir(data_path, digest)) is not None:
+            return None
+        key = (os.path.abspath(data_path), digest)
+        with self.lock:
+            future = self.builds.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                # Failed builds are retried
+                future = self.builds[key] = self.executor.submit(
+                    build_snapshot, data_path, digest, self.agent_factory
+                )
+                future.add_done_callback(self._log_failure)
+            return future
+
+    def get(self, data_path):
+        """
+        Returns (snapshot, build): the snapshot to show, None if the dataset has
+        never been built, and the Future of a pending build, or None if the
+        snapshot is up to date.
+        """
+        build = self.ensure(data_path)
+        if build is not None and build.done() and build.exception() is None:
+            return build.result(), None
+        return latest_snapshot(data_path), build
+
+    def watch(self, data_paths, interval=DASHBOARD_REFRESH_INTERVAL):
+        """Checks the datasets for changes every `interval` seconds and rebuilds their snapshots."""
+        with self.lock:
+            if self.watcher is not None:
+                return
+
+            def loop():
+                while True:
+                    for data_path in data_paths:
+                        if os.path.exists(data_path):
+                            try:
+                                self.ensure(data_path)
+                            except Exception as e:
+                                print(f"Failed to check the dashboard of {data_path}: {e}")
+                    time.sleep(interval)
+
+            self.watcher = threading.Thread(target=loop, name="dashboard-watcher", daemon=True)
+            self.watcher.start()
+
+    def _log_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Failed to build the dashboard snapshot: {future.exception()}")
+
+
+def get_snapshot_builder():
+    """
+    Returns the process-wide snapshot builder, watching the datasets listed in
+    DASHBOARD_DATASETS.
+    """
+    global _builder
+    with _builder_lock:
+        if _builder is None:
+            _builder = SnapshotBuilder()
+            _builder.watch([path.strip() for path in DASHBOARD_DATASETS.split(",") if path.strip()])
+        return _builder
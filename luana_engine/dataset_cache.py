@@ -0,0 +1,130 @@
+import hashlib
+import os
+import re
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from . import tracing
+
+# Cleaned datasets are stored here as uncompressed Arrow IPC files, which can be memory mapped
+CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", ".cache/datasets")
+
+# Bump this when clean_dataset changes so stale cache files are not reused
+CLEANING_VERSION = 1
+
+MONTH_COLUMN_PATTERN = re.compile(r"^\d{4}/\d{2}$")
+
+_digests = {}
+_tables = {}
+_lock = threading.Lock()
+
+
+def dataset_digest(path):
+    """
+    Returns the content hash of a dataset file.
+
+    The hash is only recomputed when the file's mtime or size changes.
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    cached = _digests.get(key)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    digest = sha1.hexdigest()
+    _digests[key] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def month_columns(df):
+    """Returns the month columns (e.g. 2020/04) of a finance ledger."""
+    return [column for column in df.columns if MONTH_COLUMN_PATTERN.match(str(column))]
+
+
+def clean_dataset(df):
+    """
+    Cleans a raw dataset: removes repeated header rows and duplicate rows, and for
+    finance ledgers fills NaN values with 0 and converts the month columns to float.
+    """
+    # Remove header rows repeated inside the data
+    header = pd.Series([str(column) for column in df.columns], index=df.columns)
+    is_header_row = df.astype(str).eq(header, axis=1).all(axis=1)
+    if is_header_row.any():
+        df = df[~is_header_row].copy()
+        # The header rows made pandas read numeric columns as strings
+        for column in df.columns:
+            if not pd.api.types.is_numeric_dtype(df[column]):
+                try:
+                    df[column] = pd.to_numeric(df[column])
+                except (ValueError, TypeError):
+                    pass
+
+    # Remove duplicate rows
+    df = df.drop_duplicates()
+
+    months = month_columns(df)
+    if months:
+        # Convert string numbers to float and remove commas
+        for column in months:
+            df[column] = df[column].replace(",", "", regex=True).astype(float)
+
+        # Fill NaN values with 0
+        numeric_columns = df.select_dtypes("number").columns
+        df[numeric_columns] = df[numeric_columns].fillna(0)
+
+    return df.reset_index(drop=True)
+
+
+def cache_path(path):
+    """Returns the path of the cleaned columnar file for a dataset."""
+    digest = dataset_digest(path)
+    return os.path.join(CACHE_DIR, f"{digest}-v{CLEANING_VERSION}.arrow")
+
+
+def ingest_dataset(path):
+    """
+    Parses and cleans a dataset once and persists it as a columnar file.
+
+    Returns the path of the cached file, reusing it if the dataset has not changed.
+    """
+    target = cache_path(path)
+    if os.path.exists(target):
+        return target
+
+    with _lock:
+        if os.path.exists(target):
+            return target
+        with tracing.span("dataset.ingest", path=path):
+            df = clean_dataset(pd.read_csv(path))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        feather.write_feather(
+            pa.Table.from_pandas(df, preserve_index=False),
+            tmp_path,
+            compression="uncompressed",
+        )
+        os.replace(tmp_path, target)
+    return target
+
+
+def load_table(path):
+    """Returns the cleaned dataset as a memory mapped Arrow table."""
+    target = ingest_dataset(path)
+    key = os.path.abspath(path)
+    cached = _tables.get(key)
+    if cached is None or cached[0] != target:
+        cached = (target, feather.read_table(target, memory_map=True))
+        _tables[key] = cached
+    return cached[1]
+
+
+def load_dataset(path):
+    """Returns the cleaned dataset as a new pandas DataFrame."""
+    return load_table(path).to_pandas()
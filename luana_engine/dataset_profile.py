@@ -0,0 +1,172 @@
+import json
+import os
+import re
+import threading
+
+import pandas as pd
+
+from .conversation_context import count_tokens
+from .dataset_cache import dataset_digest, load_dataset, month_columns
+from . import tracing
+
+# Dataset profiles are stored here as json, one file per dataset content hash
+PROFILE_DIR = os.environ.get("DATASET_PROFILE_DIR", ".cache/profiles")
+# Bump this when profile_dataset changes so stale profiles are not reused
+PROFILE_VERSION = 1
+# Tokens the rendered profile may use in the system message
+PROFILE_TOKEN_BUDGET = int(os.environ.get("PROFILE_TOKEN_BUDGET", 600))
+
+# Most frequent values kept per dimension, rendering shows fewer if over the budget
+MAX_VALUES = 50
+# Numeric columns with these names hold codes, not amounts
+CODE_COLUMN_PATTERN = re.compile(r"(center|code|id|year|number|no)$", re.IGNORECASE)
+
+_profiles = {}
+_rendered = {}
+_lock = threading.Lock()
+
+
+def format_amount(value):
+    """
+    Formats an amount compactly for the prompt, e.g. -263,952.49 as -263,952.
+    Unlike `kpi_engine.format_number`, which keeps 2 decimals for the dashboard
+    tiles, it groups thousands and drops the decimals the model doesn't need.
+    """
+    if abs(value) >= 100:
+        return f"{value:,.0f}"
+    return f"{value:,.2f}".rstrip("0").rstrip(".")
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def profile_dataset(df):
+    """
+    Computes a compact profile of a cleaned dataset: the role of each column,
+    the most frequent values of dimensions, the range of amounts and of the
+    month columns.
+    """
+    months = month_columns(df)
+    columns = []
+    for column in df.columns:
+        if column in months:
+            continue
+        series = df[column]
+        numeric = pd.api.types.is_numeric_dtype(series)
+        if numeric and not CODE_COLUMN_PATTERN.search(str(column).strip()):
+            values = series.astype(float)
+            columns.append(
+                {
+                    "name": str(column),
+                    "role": "measure",
+                    "min": float(values.min()),
+                    "max": float(values.max()),
+                    "total": float(values.sum()),
+                }
+            )
+            continue
+        counts = series.value_counts()
+        columns.append(
+            {
+                "name": str(column),
+                "role": "code" if numeric else "dimension",
+                "distinct": int(len(counts)),
+                "values": [format_value(value) for value in counts.index[:MAX_VALUES]],
+            }
+        )
+
+    profile = {"rows": int(len(df)), "columns": columns}
+    if months:
+        amounts = df[months].to_numpy(dtype=float)
+        totals = amounts.sum(axis=0)
+        profile["months"] = {
+            "first": months[0],
+            "last": months[-1],
+            "count": len(months),
+            "min": float(amounts.min()),
+            "max": float(amounts.max()),
+            "min_total": float(totals.min()),
+            "max_total": float(totals.max()),
+        }
+    return profile
+
+
+def profile_path(digest):
+    return os.path.join(PROFILE_DIR, f"{digest}-v{PROFILE_VERSION}.json")
+
+
+def get_profile(path):
+    """
+    Returns the profile of a dataset, computed once per dataset version and
+    kept on disk for later processes.
+    """
+    digest = dataset_digest(path)
+    profile = _profiles.get(digest)
+    if profile is not None:
+        return profile
+
+    with _lock:
+        profile = _profiles.get(digest)
+        if profile is not None:
+            return profile
+        target = profile_path(digest)
+        try:
+            with open(target) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            with tracing.span("dataset.profile", path=path):
+                profile = profile_dataset(load_dataset(path))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(profile, f)
+            os.replace(tmp_path, target)
+        _profiles[digest] = profile
+    return profile
+
+
+def render_profile(profile, max_values=MAX_VALUES):
+    lines = [f"{profile['rows']} rows."]
+    months = profile.get("months")
+    if months:
+        lines.append(
+            f"Month columns {months['first']} to {months['last']} ({months['count']} months, float amounts):"
+            + f" line amounts from {format_amount(months['min'])} to {format_amount(months['max'])},"
+            + f" monthly totals from {format_amount(months['min_total'])} to {format_amount(months['max_total'])}."
+        )
+    for column in profile["columns"]:
+        if column["role"] == "measure":
+            lines.append(
+                f"- {column['name']} (amount): from {format_amount(column['min'])} to"
+                + f" {format_amount(column['max'])}, total {format_amount(column['total'])}"
+            )
+            continue
+        kind = "numeric code" if column["role"] == "code" else "text"
+        line = f"- {column['name']} ({kind}, {column['distinct']} distinct)"
+        values = column["values"][:max_values]
+        if values:
+            line += ": " + ", ".join(values)
+            if column["distinct"] > len(values):
+                line += f", ... {column['distinct'] - len(values)} more"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def describe_dataset(path, budget=PROFILE_TOKEN_BUDGET, model="gpt-4"):
+    """
+    Renders the profile of a dataset for the system message, listing fewer
+    values per column until it fits in `budget` tokens.
+    """
+    profile = get_profile(path)
+    key = (dataset_digest(path), budget, model)
+    text = _rendered.get(key)
+    if text is None:
+        for max_values in (MAX_VALUES, 20, 10, 5, 0):
+            text = render_profile(profile, max_values)
+            if count_tokens(text, model) <= budget:
+                break
+        _rendered[key] = text
+    return text
@@ -0,0 +1,108 @@
+import ctypes
+import os
+import time
+
+# Per run limits of generated code, in seconds of wall time and of CPU time.
+# Subprocess kernels are killed when they don't stop, in-process Python kernels
+# can only be interrupted between Python bytecodes, see PythonInterpreter.execute_cell
+EXECUTION_TIMEOUT = float(os.environ.get("EXECUTION_TIMEOUT", 60))
+EXECUTION_CPU_TIMEOUT = float(os.environ.get("EXECUTION_CPU_TIMEOUT", EXECUTION_TIMEOUT))
+# Address space limit of subprocess kernels in bytes, 0 for no limit
+EXECUTION_MEMORY_LIMIT = int(os.environ.get("EXECUTION_MEMORY_LIMIT", 4 * 1024**3))
+# How long interrupted code gets to stop before its kernel is replaced
+INTERRUPT_GRACE = float(os.environ.get("INTERRUPT_GRACE", 2))
+
+
+def thread_cpu_time(thread_id):
+    """Returns the CPU time of a thread in seconds, None where it can't be measured."""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+def process_cpu_time(pid):
+    """
+    Returns the CPU time of a process and its waited-for children in seconds,
+    None where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The fields after the command name, which can contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+    return (utime + stime + cutime + cstime) / os.sysconf("SC_CLK_TCK")
+
+
+def wait_for_completion(finished, cpu_time, interrupted, timeout=None, cpu_timeout=None):
+    """
+    Waits for `finished`, returns None once it is set, or why the run has to be
+    stopped: "timeout" (wall time), "cpu_timeout" or "cancelled".
+    """
+    timeout = EXECUTION_TIMEOUT if timeout is None else timeout
+    cpu_timeout = EXECUTION_CPU_TIMEOUT if cpu_timeout is None else cpu_timeout
+    started = time.monotonic()
+    cpu_started = cpu_time()
+    while True:
+        remaining = timeout - (time.monotonic() - started)
+        # Returns as soon as the run finishes, the polling only bounds how late a limit is noticed
+        if finished.wait(max(min(remaining, 0.25), 0)):
+            return None
+        if interrupted.is_set():
+            return "cancelled"
+        if time.monotonic() - started >= timeout:
+            return "timeout"
+        if cpu_started is not None:
+            cpu_now = cpu_time()
+            if cpu_now is not None and cpu_now - cpu_started >= cpu_timeout:
+                return "cpu_timeout"
+
+
+def interrupt_thread(thread_id):
+    """
+    Raises KeyboardInterrupt in a thread the next time it runs Python code. A
+    thread inside a long C call, e.g. a pandas merge, only gets it afterwards.
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(KeyboardInterrupt)
+    )
+
+
+def limit_memory(limit=None):
+    """
+    Returns a Popen preexec_fn limiting the address space of the subprocess,
+    or None where resource limits are not available.
+    """
+    limit = EXECUTION_MEMORY_LIMIT if limit is None else limit
+    try:
+        import resource
+    except ImportError:
+        return None
+    if not limit:
+        return None
+
+    def set_limit():
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    return set_limit
+
+
+def stopped_message(reason, restarted, timeout=None, cpu_timeout=None):
+    """Explains to the model why its code was stopped."""
+    timeout = EXECUTION_TIMEOUT if timeout is None else timeout
+    cpu_timeout = EXECUTION_CPU_TIMEOUT if cpu_timeout is None else cpu_timeout
+    if reason == "cancelled":
+        message = "Execution was cancelled by the user."
+    elif reason == "cpu_timeout":
+        message = f"Execution was stopped after using {cpu_timeout:g} seconds of CPU time."
+    else:
+        message = f"Execution timed out after {timeout:g} seconds."
+    if restarted:
+        message += " The kernel had to be restarted, variables defined in earlier code are gone."
+    else:
+        message += " The kernel was interrupted, variables defined in earlier code are kept."
+    if reason != "cancelled":
+        message += " Write a cheaper query: aggregate or filter before joining and avoid loops over rows."
+    return message
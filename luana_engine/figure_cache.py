@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from . import tracing
+
+# Memory the cached figures, tables and images of all sessions may use together
+FIGURE_CACHE_BYTES = int(os.environ.get("FIGURE_CACHE_BYTES", 256 * 1024 * 1024))
+
+_figure_cache = None
+_figure_cache_lock = threading.Lock()
+
+
+class FigureCache:
+    """
+    Keeps the parsed output files shown in the app, so Streamlit reruns don't
+    re-read and re-parse every plot and table.
+
+    Entries are keyed by path, mtime and size, so a rewritten file is loaded
+    again, and the least recently used entries are dropped while the cached
+    values use more than `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=FIGURE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        # path -> (mtime_ns, size, value, nbytes), least recently used first
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, load):
+        """
+        Returns the cached value of a file, or `load(path)` -> (value, nbytes) if
+        the file is new or changed since it was cached.
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value, nbytes = load(path)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.nbytes -= old[3]
+            # A value larger than the whole cache is returned but not kept
+            if nbytes <= self.max_bytes:
+                self.entries[key] = (stat.st_mtime_ns, stat.st_size, value, nbytes)
+                self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted[3]
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+def load_figure(path):
+    import plotly
+
+    with tracing.span("figure_cache.load", file=path):
+        fig = plotly.io.read_json(path)
+    # The parsed figure holds roughly what its JSON takes on disk
+    return fig, os.path.getsize(path)
+
+
+def load_table(path):
+    """Loads a CSV as (DataFrame, CSV bytes for the download button)."""
+    import pandas as pd
+
+    with tracing.span("figure_cache.load", file=path):
+        df = pd.read_csv(path)
+        csv = df.to_csv(index=False).encode("utf-8")
+    return (df, csv), int(df.memory_usage(index=True, deep=True).sum()) + len(csv)
+
+
+def load_image(path):
+    from PIL import Image
+
+    with tracing.span("figure_cache.load", file=path):
+        with Image.open(path) as image:
+            # Decode now, so the cached image doesn't keep the file open
+            image.load()
+            image = image.copy()
+    return image, image.width * image.height * len(image.getbands()) + sys.getsizeof(image)
+
+
+def get_figure_cache():
+    """Returns the process-wide figure cache, shared by all sessions."""
+    global _figure_cache
+    with _figure_cache_lock:
+        if _figure_cache is None:
+            _figure_cache = FigureCache()
+        return _figure_cache
@@ -0,0 +1,71 @@
+import os
+import uuid
+
+# Every kernel writes its artifacts to its own directory under this one
+OUTPUT_ROOT = os.environ.get("OUTPUT_ROOT", ".output")
+# Name of the variable, and environment variable of subprocess kernels, holding a kernel's output directory
+OUTPUT_DIR_VARIABLE = "OUTPUT_DIR"
+
+
+def new_output_dir(root=None):
+    """
+    Creates the output directory of a kernel. Runs of other kernels never write
+    to it, so the changes found in it are the kernel's own artifacts.
+    """
+    directory = os.path.join(root or OUTPUT_ROOT, uuid.uuid4().hex[:12])
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+class FileTracker:
+    """
+    Finds the files created or modified by a code run.
+
+    A snapshot of (mtime, size) for every watched file is taken before and after
+    the run; the files whose entry differs are the run's artifacts. Only watch
+    directories no other run writes to, e.g. the kernel's output directory, not
+    the shared cwd.
+    """
+
+    def __init__(self, watched_dirs, top_level_dirs=()):
+        self.watched_dirs = watched_dirs
+        self.top_level_dirs = top_level_dirs
+        self.before = {}
+        self.last_changes = []
+
+    def snapshot(self):
+        files = {}
+        for directory in self.watched_dirs:
+            for root, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    self._add(files, os.path.join(root, filename))
+        for directory in self.top_level_dirs:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_file():
+                    self._add(files, os.path.join(directory, entry.name))
+        return files
+
+    def _add(self, files, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # Deleted while we were walking the directory
+            return
+        files[os.path.normpath(path)] = (stat.st_mtime_ns, stat.st_size)
+
+    def start(self):
+        self.before = self.snapshot()
+
+    def stop(self):
+        """
+        Returns the files created or modified since `start`, oldest first.
+        """
+        after = self.snapshot()
+        changes = [path for path, entry in after.items() if self.before.get(path) != entry]
+        self.last_changes = sorted(changes, key=lambda path: (after[path][0], path))
+        self.before = {}
+        return self.last_changes
@@ -0,0 +1,196 @@
+import hashlib
+import os
+import threading
+from itertools import combinations
+import pandas as pd
+from .dataset_cache import cache_path, load_dataset, month_columns
+from . import tracing
+
+# Ledger columns the cube is keyed on
+SOURCE_DIMENSIONS = ["Profit Center", "Item", "Cost Center"]
+# Profit centers are grouped by the first two characters of their code
+PREFIX_DIMENSION = "Profit Center Prefix"
+DIMENSIONS = [PREFIX_DIMENSION] + SOURCE_DIMENSIONS
+
+_cubes = {}
+_lock = threading.Lock()
+
+
+def is_cube_source(df):
+    """Returns True for finance ledgers the cube can be built from."""
+    return set(SOURCE_DIMENSIONS) <= set(df.columns) and bool(month_columns(df))
+
+
+def column_hashes(df, months):
+    """
+    Returns a hash of the dimension columns and one hash per month column, used
+    to find out which parts of the ledger changed between two versions.
+    """
+
+    def digest(frame):
+        hashed = pd.util.hash_pandas_object(frame, index=False).values
+        return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+    return digest(df[SOURCE_DIMENSIONS]), {month: digest(df[month]) for month in months}
+
+
+def aggregate(df, months):
+    """Sums the month columns of the ledger by every dimension of the cube."""
+    keys = [df["Profit Center"].str[:2].rename(PREFIX_DIMENSION)] + [
+        df[dimension] for dimension in SOURCE_DIMENSIONS
+    ]
+    return df[months].groupby(keys, dropna=False, sort=True).sum()
+
+
+def _canonical(dimensions):
+    unknown = [dimension for dimension in dimensions if dimension not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimensions {unknown}, the cube has {DIMENSIONS}")
+    return tuple(dimension for dimension in DIMENSIONS if dimension in dimensions)
+
+
+class FinanceCube:
+    """
+    Monthly ledger amounts summed by Profit Center Prefix x Profit Center x Item x
+    Cost Center, with the rollups along every combination of dimensions.
+
+    Amounts keep the ledger's signs, revenue is negative. Queries return new
+    pandas objects with the months as columns:
+
+        CUBE.rollup("Item")                                # every item per month
+        CUBE.slice("Item", "Revenue").rollup("Profit Center Prefix")
+        CUBE.dice({"Item": ["Rent", "Software"]}).total(months=["2020/07"])
+    """
+
+    def __init__(self, base, months, precompute=True):
+        self.base = base
+        self.months = list(months)
+        self.key_hash = None
+        self.month_hashes = {}
+        self._rollups = {}
+        self._lock = threading.Lock()
+        if precompute:
+            for size in range(len(DIMENSIONS) + 1):
+                for dimensions in combinations(DIMENSIONS, size):
+                    self._rollup(dimensions)
+
+    @classmethod
+    def from_dataset(cls, df):
+        months = month_columns(df)
+        with tracing.span("cube.build", rows=len(df), months=len(months)):
+            cube = cls(aggregate(df, months), months)
+        cube.key_hash, cube.month_hashes = column_hashes(df, months)
+        return cube
+
+    def updated(self, df):
+        """
+        Returns the cube of a new version of the ledger.
+
+        When only month columns changed or were added, just those columns are
+        re-aggregated and patched into the base and the precomputed rollups.
+        """
+        months = month_columns(df)
+        key_hash, month_hashes = column_hashes(df, months)
+        if key_hash != self.key_hash:
+            return FinanceCube.from_dataset(df)
+
+        changed = [month for month in months if self.month_hashes.get(month) != month_hashes[month]]
+        with tracing.span("cube.update", changed_months=len(changed)):
+            fresh = aggregate(df, changed)
+            base = self.base.reindex(columns=months)
+            # Same dimension columns, so the aggregates have the same rows in the same order
+            base[changed] = fresh.to_numpy()
+            cube = FinanceCube(base, months, precompute=False)
+            for key, rollup in list(self._rollups.items()):
+                if key:
+                    patched = rollup.reindex(columns=months)
+                    patched[changed] = (
+                        fresh.groupby(level=list(key), dropna=False, sort=True).sum().to_numpy()
+                    )
+                else:
+                    patched = rollup.reindex(months)
+                    patched[changed] = fresh.sum()
+                cube._rollups[key] = patched
+        cube.key_hash, cube.month_hashes = key_hash, month_hashes
+        return cube
+
+    def _rollup(self, dimensions):
+        key = _canonical(dimensions)
+        with self._lock:
+            rollup = self._rollups.get(key)
+            if rollup is None:
+                if key:
+                    rollup = self.base.groupby(level=list(key), dropna=False, sort=True).sum()
+                else:
+                    rollup = self.base.sum()
+                self._rollups[key] = rollup
+        return rollup
+
+    def rollup(self, *dimensions, months=None):
+        """
+        Returns the amounts per month summed by the given dimensions, e.g.
+        CUBE.rollup("Item") or CUBE.rollup("Profit Center Prefix", "Item").
+        """
+        if not dimensions:
+            return self.total(months)
+        result = self._rollup(dimensions)
+        return result.loc[:, months or self.months].copy()
+
+    def total(self, months=None):
+        """Returns the total amount per month."""
+        return self._rollup(()).loc[months or self.months].copy()
+
+    def members(self, dimension):
+        """Returns the values of a dimension, e.g. CUBE.members("Item")."""
+        _canonical([dimension])
+        return list(self.base.index.unique(level=dimension))
+
+    def dice(self, filters):
+        """
+        Returns the sub-cube of the lines matching every filter, a dict of
+        dimension -> value or list of values.
+        """
+        mask = pd.Series(True, index=self.base.index)
+        for dimension, values in filters.items():
+            _canonical([dimension])
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            mask &= self.base.index.get_level_values(dimension).isin(list(values))
+        # Rollups of sub-cubes are computed on first use
+        return FinanceCube(self.base[mask.values], self.months, precompute=False)
+
+    def slice(self, dimension, value):
+        """Returns the sub-cube of one member, e.g. CUBE.slice("Item", "Revenue")."""
+        return self.dice({dimension: value})
+
+    def __repr__(self):
+        return (
+            f"FinanceCube(dimensions={DIMENSIONS}, lines={len(self.base)}, "
+            f"months={self.months[0] if self.months else None}..{self.months[-1] if self.months else None})"
+        )
+
+
+def load_cube(path, df=None):
+    """
+    Returns the cube of a dataset, or None if it is not a finance ledger.
+
+    The cube is kept per dataset and brought up to date incrementally when the
+    file changes. `df` is the cleaned dataset, if the caller already loaded it.
+    """
+    key = os.path.abspath(path)
+    version = cache_path(path)
+    with _lock:
+        cached = _cubes.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        if df is None:
+            df = load_dataset(path)
+        if not is_cube_source(df):
+            cube = None
+        elif cached and cached[1] is not None:
+            cube = cached[1].updated(df)
+        else:
+            cube = FinanceCube.from_dataset(df)
+        _cubes[key] = (version, cube)
+        return cube
@@ -1,18 +1,18 @@
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+from .dataset_cache import clean_dataset, load_dataset
+
+
+def load_data(file_path):
+    # Load the cleaned data from the dataset cache instead of parsing the CSV again
+    return load_dataset(file_path)
 
 
 def clean_data(df):
-    # Remove the duplicate header row
-    df = df.drop(0)
-    # Fill missing values with 0
-    df.fillna("0", inplace=True)
-    # Convert string numbers in month columns to float by removing commas
-    month_columns = df.columns[3:]
-    for column in month_columns:
-        df[column] = df[column].str.replace(",", "").astype(float)
-    return df
+    # Remove the duplicate header row, fill missing values with 0
+    # and convert string numbers in month columns to float by removing commas
+    return clean_dataset(df)
 
 
 def monthly_revenue_trend(df):
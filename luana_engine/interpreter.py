@@ -1,18 +1,44 @@
-from .utils import merge_deltas, parse_partial_json
+from .utils import merge_deltas, PartialJSONParser
 from .code_interpreter import CodeInterpreter
-from .python_interpreter import PythonInterpreter
+from .python_interpreter import (
+    PythonInterpreter,
+    DATASET_VARIABLE,
+    MONTH_COLUMNS_VARIABLE,
+    CUBE_VARIABLE,
+)
+from .finance_cube import is_cube_source
+from .kernel_pool import get_kernel_pool
+from .kernel_manager import get_kernel_manager
+from .file_tracker import OUTPUT_DIR_VARIABLE
 from .prompts import system_prompt
 import os
+import copy
+import contextlib
+import uuid
+import threading
 import time
+import asyncio
 import platform
 import openai
 import getpass
-import tokentrim as tt
 from .utils import load_dotenv
 import streamlit as st
-from .utils import get_file_modifications
 import shutil
-from .utils import plot_files
+from .utils import plot_files, run_sync
+from .dataset_cache import load_dataset, dataset_digest
+from .completion_cache import CompletionCacheMiss, get_completion_cache
+from .conversation_context import ConversationContext, is_output, summarize_functions
+from .tool_calls import (
+    code_names,
+    copy_variables,
+    function_calls,
+    immutable_names,
+    merge_tool_call_deltas,
+    plan_waves,
+    share_variables,
+)
+from .dataset_profile import describe_dataset
+from . import tracing
 from .prompts.generate_functions import finance_data_functions, city_budget_functions
 
 # Function schema for gpt-4
@@ -55,14 +81,42 @@ confirm_mode_message = """
 Press `CTRL-C` to exit.
 """
 
+# Lines of code output shown in the thinking panel while code runs, and how often it is redrawn
+LIVE_OUTPUT_LINES = 20
+LIVE_OUTPUT_INTERVAL = 0.05
+
 pre_load_function_mapping = {
     ".data/finance.csv": finance_data_functions,
     ".data/sf_budget.csv": city_budget_functions,
 }
 
+# The system message lists the preset functions instead of including their source
+preset_function_summaries = {
+    data_path: summarize_functions(functions)
+    for data_path, functions in pre_load_function_mapping.items()
+}
+
+
+def kernel_key(language, slot=0):
+    """Names the kernels of a session in the kernel manager."""
+    return language if slot == 0 else f"{language}:{slot}"
+
+
+def python_kernel_pool(data_path):
+    """
+    Returns the pool of started Python kernels with the preset functions and dataset loaded.
+    """
+    return get_kernel_pool(
+        ("python", data_path),
+        lambda: PythonInterpreter(
+            preset_functions=pre_load_function_mapping[data_path],
+            data_path=data_path,
+        ),
+    )
+
 
 class Interpreter:
-    def __init__(self):
+    def __init__(self, data_path=None):
         info = self.get_info_for_system_message()
         self.temperature = 0.001
         self.api_key = None
@@ -81,14 +135,45 @@ class Interpreter:
         self.system_message = system_prompt.OPEN_SYSTEM_PROMPT
         self.system_message += "\n\n" + info
         self.messages = []
-        # Store Code Interpreter instances for each language
-        self.code_interpreters = {}
+        # Token counts of the messages, kept between steps
+        self.context = ConversationContext()
+        # Code interpreters of this session are owned by the kernel manager
+        self.session_id = uuid.uuid4().hex
+        self.kernel_manager = get_kernel_manager()
         self.last_ran_code = None
         self.additional_system_message = None
+        # Dataset to answer about, None follows the "data" environment variable the app sets
+        self.selected_data_path = data_path
+        # Dataset the system message describes
         self.data_path = None
+        self.data_digest = None
         self.think_step = 0
+        # Budget for the agent loop of one chat turn
+        self.max_steps = int(os.environ.get("MAX_STEPS", 15))
+        self.max_wall_time = float(os.environ.get("MAX_WALL_TIME", 300))
+        # Times a step is asked again after its stream ended without a finish reason
+        self.max_stream_retries = int(os.environ.get("MAX_STREAM_RETRIES", 2))
+        self.step_timings = []
+        # Set by `cancel` to stop the current chat turn
+        self.cancel_event = threading.Event()
+        # Thinking panel of the current step, None when thinking isn't shown
+        self.expander = None
+        self.completion_cache = get_completion_cache()
+        # Serves the answers prefetched for the sample questions, set for interactive sessions
+        self.prefetcher = None
+        # Serves and stores answers to questions asked before, set for interactive sessions
+        self.question_cache = None
+        # Whether the last turn ended with an answer, rather than cancelled or out of budget
+        self.answered = False
+        # Index of the assistant message being streamed, None when no message is in flight
+        self.streaming_index = None
         self.chat_history = []
         self.output_files = []
+        self.modified_files = []
+        # Start warming a kernel now, so the first run_code does not wait for it
+        data_path = self.get_data_path()
+        if data_path in pre_load_function_mapping:
+            python_kernel_pool(data_path)
         # delete all files in .output folder but keep the folder
         """
         dir_path = ".output"
@@ -103,6 +188,10 @@ class Interpreter:
                 print(f"Failed to delete {file_path}. Reason: {e}")
         """
 
+    def get_data_path(self):
+        """Returns the path of the dataset the agent answers about."""
+        return self.selected_data_path or os.environ.get("data", ".data/finance.csv")
+
     def get_info_for_system_message(self):
         """
         Gets relevent information for the system message.
@@ -121,7 +210,50 @@ class Interpreter:
 
     def reset(self):
         self.messages = []
-        self.code_interpreters = {}
+        self.kernel_manager.close_session(self.session_id)
+
+    def fork(self):
+        """
+        Returns a new Interpreter that continues from this conversation.
+
+        The fork copies the settings and messages but gets its own code interpreters,
+        so forks can chat concurrently without sharing kernel state. Its Python
+        kernel starts with copies of the variables of this session's kernel, the
+        state the copied messages refer to.
+        """
+        forked = Interpreter(self.selected_data_path)
+        for attribute in [
+            "temperature",
+            "api_key",
+            "auto_run",
+            "local",
+            "model",
+            "debug_mode",
+            "use_azure",
+            "azure_api_base",
+            "azure_api_version",
+            "azure_deployment_name",
+            "system_message",
+            "additional_system_message",
+            "data_path",
+            "max_steps",
+            "max_wall_time",
+            "max_stream_retries",
+            "completion_cache",
+        ]:
+            setattr(forked, attribute, getattr(self, attribute))
+        forked.messages = copy.deepcopy(self.messages)
+        if self.kernel_manager.peek(self.session_id, kernel_key("python")) is not None:
+            source, _ = self.get_code_interpreter("python")
+            try:
+                target, _ = forked.get_code_interpreter("python")
+                try:
+                    copy_variables(source, target)
+                finally:
+                    forked.release_code_interpreter("python")
+            finally:
+                self.release_code_interpreter("python")
+        return forked
 
     def load(self, messages):
         self.messages = messages
@@ -134,20 +266,79 @@ class Interpreter:
         show_thinking=False,
         store_history=False,
     ):
+        return run_sync(
+            self.achat(
+                message,
+                return_messages=return_messages,
+                plot=plot,
+                show_thinking=show_thinking,
+                store_history=store_history,
+            )
+        )
+
+    async def achat(
+        self,
+        message=None,
+        return_messages=False,
+        plot=False,
+        show_thinking=False,
+        store_history=False,
+    ):
+        """
+        Async version of `chat`, streams the completions and awaits code execution
+        so many sessions can be served from one event loop.
+        """
         # Connect to an LLM (an large language model)
         if not self.local:
             # gpt-4
             self.verify_api_key()
         self.output_files = []
+        self.modified_files = []
+        self.cancel_event.clear()
         print("Inside chat now")
         if message:
             # If it was, we respond non-interactivley
             self.messages.append({"role": "user", "content": message})
             if store_history:
                 self.chat_history.append({"role": "user", "content": message})
-            self.respond(
-                plot=plot, show_thinking=show_thinking, store_history=store_history
-            )
+            data_path = self.get_data_path()
+            # a question asked before, maybe in other words, is answered from the cache,
+            # which holds the prefetched answers too
+            answer = None
+            if self.question_cache is not None:
+                answer = self.question_cache.lookup(data_path, message)
+            elif self.prefetcher is not None:
+                answer = self.prefetcher.answer(data_path, message)
+            if answer is not None:
+                with tracing.span("chat.cached", message_chars=len(message)):
+                    self.serve_answer(
+                        answer, plot=plot, show_thinking=show_thinking, store_history=store_history
+                    )
+            else:
+                # background answering pauses while the user waits for this turn
+                turn = self.prefetcher.interactive() if self.prefetcher is not None else contextlib.nullcontext()
+                with turn, tracing.span("chat.turn", message_chars=len(message)) as span:
+                    await self.arespond(
+                        plot=plot, show_thinking=show_thinking, store_history=store_history
+                    )
+                    span.set(steps=len(self.step_timings), output_files=len(self.output_files))
+                # only the first question of a conversation is answered without earlier context,
+                # answers served to other sessions must not depend on this one
+                first_question = sum(message.get("role") == "user" for message in self.messages) == 1
+                # the answer is stored for the data the turn was answered from
+                if (
+                    self.question_cache is not None
+                    and self.answered
+                    and first_question
+                    and dataset_digest(self.data_path) == self.data_digest
+                ):
+                    self.question_cache.add(
+                        self.data_path,
+                        self.data_digest,
+                        message,
+                        self.messages[-1]["content"],
+                        self.output_files,
+                    )
 
         if return_messages:
             return (
@@ -157,6 +348,26 @@ class Interpreter:
         else:
             return self.output_files
 
+    def serve_answer(self, answer, plot=False, show_thinking=False, store_history=False):
+        """Answers the latest question with a stored answer and its files instead of running the agent."""
+        self.messages.append({"role": "assistant", "content": answer["answer"]})
+        if store_history:
+            self.chat_history.append(self.messages[-1])
+        if show_thinking:
+            st.markdown(answer["answer"])
+        if plot:
+            for file in answer["files"]:
+                plot_files(file)
+        self.output_files.extend(answer["files"])
+
+    def cancel(self):
+        """
+        Stops the current chat turn: interrupts running code and stops before the
+        next LLM call. Can be called from any thread, e.g. a UI callback.
+        """
+        self.cancel_event.set()
+        self.kernel_manager.interrupt_session(self.session_id)
+
     def verify_api_key(self):
         """
         Makes sure we have an OPENAI_API_KEY.
@@ -191,44 +402,234 @@ class Interpreter:
             openai.api_key = os.environ["OPENAI_API_KEY"]
 
     def respond(self, plot=False, show_thinking=False, store_history=False):
-        # Add relevant info to system_message
-        # (e.g. current working directory, username, os, etc.)
-        # info = self.get_info_for_system_message()
-
-        # system_message = self.system_message + "\n\n" + info
-        self.think_step += 1
-        if not self.additional_system_message or self.data_path != os.environ.get(
-            "data", ".data/finance.csv"
-        ):
-            import pandas as pd
+        return run_sync(
+            self.arespond(
+                plot=plot, show_thinking=show_thinking, store_history=store_history
+            )
+        )
+
+    def get_code_interpreter(self, language, slot=0):
+        """
+        Returns (code interpreter, restarted) for a language and marks it busy until
+        `release_code_interpreter`. Slots above 0 are the sibling kernels running
+        the parallel calls of a turn next to the session's kernel.
+
+        On first use, or after the kernel manager closed the session's kernel, a
+        started Python kernel is taken from the pool or the interpreter is started.
+        """
+        if language == "python":
+            factory = python_kernel_pool(self.get_data_path()).acquire
+        else:
+            factory = lambda: CodeInterpreter(language, self.debug_mode)
+        return self.kernel_manager.acquire(self.session_id, kernel_key(language, slot), factory)
+
+    def release_code_interpreter(self, language, slot=0):
+        """
+        Marks the code interpreter idle, returns a note if it exceeded its memory limit.
+        """
+        return self.kernel_manager.release(self.session_id, kernel_key(language, slot))
+
+    async def arespond(self, plot=False, show_thinking=False, store_history=False):
+        """
+        Runs the agent loop: asks the LLM for the next step and runs its function
+        calls until it answers, or until the step or wall time budget is used up.
+        """
+        started = time.monotonic()
+        steps = 0
+        # Streams in a row that ended without a finish reason
+        broken_streams = 0
+        self.step_timings = []
+        self.answered = False
+        try:
+            while True:
+                if self.cancel_event.is_set():
+                    print(f"Cancelled after {steps} steps")
+                    self.close_interrupted_step()
+                    self.messages.append(
+                        {
+                            "role": "assistant",
+                            "content": "I stopped working on this question as you asked.",
+                        }
+                    )
+                    break
+
+                elapsed = time.monotonic() - started
+                if steps >= self.max_steps or elapsed >= self.max_wall_time:
+                    print(f"Stopping after {steps} steps and {elapsed:.1f}s")
+                    self.messages.append(
+                        {
+                            "role": "assistant",
+                            "content": "I had to stop working on this question because it took more than "
+                            + f"{self.max_steps} steps or {self.max_wall_time:.0f} seconds. "
+                            + "Please try a more specific question.",
+                        }
+                    )
+                    break
+
+                steps += 1
+                self.think_step += 1
+                with tracing.span("agent.step", step=self.think_step) as span:
+                    step_started = time.monotonic()
+                    finish_reason = await self.stream_step(show_thinking)
+                    timing = {
+                        "step": self.think_step,
+                        "llm_seconds": time.monotonic() - step_started,
+                    }
+                    self.step_timings.append(timing)
+                    span.set(finish_reason=finish_reason)
+
+                    if self.cancel_event.is_set():
+                        continue
+
+                    if finish_reason is None:
+                        # The stream broke off, its partial message is dropped and the step asked again
+                        self.close_interrupted_step()
+                        broken_streams += 1
+                        if broken_streams > self.max_stream_retries:
+                            self.messages.append(
+                                {
+                                    "role": "assistant",
+                                    "content": "I could not get a complete response from the model, please ask again.",
+                                }
+                            )
+                            break
+                        continue
+                    broken_streams = 0
+
+                    if finish_reason not in ("function_call", "tool_calls") or not function_calls(
+                        self.messages[-1]
+                    ):
+                        self.answered = True
+                        break
+
+                    execution_started = time.monotonic()
+                    await self.run_function_calls()
+                    timing["execution_seconds"] = time.monotonic() - execution_started
+        except BaseException:
+            # e.g. Streamlit's rerun after a click, the next turn still needs a valid history
+            self.close_interrupted_step()
+            raise
+
+        if self.debug_mode:
+            print("Step timings:", self.step_timings)
+
+        # we're done, check for outputs
+        self.think_step = 0
+        print("We are done")
+        print("last response", self.messages[-1])
+        if store_history:
+            self.chat_history.append(self.messages[-1])
+        if show_thinking:
+            st.markdown(self.messages[-1]["content"])
+
+        if self.modified_files:
+            output_files = self.modified_files
+            self.modified_files = []
+            print("output_files", output_files)
+            if plot:
+                for file in output_files:
+                    plot_files(file)
+            # reset if already displayed
+            self.last_ran_code = None
+            self.output_files.extend(output_files)
+
+    def close_interrupted_step(self):
+        """
+        Leaves self.messages valid for the next completion after a step was
+        cancelled or failed: drops the assistant message that was still
+        streaming, and answers the calls of the last one that did not run.
+        """
+        if self.streaming_index is not None:
+            del self.messages[self.streaming_index :]
+            self.streaming_index = None
+        for index in range(len(self.messages) - 1, -1, -1):
+            if self.messages[index].get("role") == "assistant":
+                break
+        else:
+            return
+        message = self.messages[index]
+        answered = {
+            output.get("tool_call_id") for output in self.messages[index + 1 :] if is_output(output)
+        }
+        if message.get("tool_calls"):
+            for tool_call in message["tool_calls"]:
+                if tool_call["id"] not in answered:
+                    self.messages.append(
+                        {
+                            "role": "tool",
+                            "tool_call_id": tool_call["id"],
+                            "name": "run_code",
+                            "content": "Not run, the user cancelled the question.",
+                        }
+                    )
+        elif message.get("function_call") and not answered:
+            self.messages.append(
+                {
+                    "role": "function",
+                    "name": "run_code",
+                    "content": "Not run, the user cancelled the question.",
+                }
+            )
 
-            df = pd.read_csv(os.environ.get("data", ".data/finance.csv"))
-            description = df.describe().to_string()
-            first_rows = df.head(5).to_string()
+    def get_additional_system_message(self):
+        """
+        Describes the selected dataset and how to work with it, rebuilt when the data changes.
+        """
+        data_path = self.get_data_path()
+        digest = dataset_digest(data_path)
+        if (
+            not self.additional_system_message
+            or self.data_path != data_path
+            or self.data_digest != digest
+        ):
+            self.data_path = data_path
+            self.data_digest = digest
+            with tracing.span("dataset.describe", path=self.data_path):
+                df = load_dataset(self.data_path)
+                profile = describe_dataset(self.data_path, model=self.model)
+            cube_instructions = ""
+            if is_cube_source(df):
+                cube_instructions = (
+                    f" Sums by Profit Center Prefix (first 2 characters of Profit Center), Profit Center, Item and Cost Center per month are precomputed in `{CUBE_VARIABLE}`, prefer it over filtering and grouping `{DATASET_VARIABLE}`:"
+                    + f" `{CUBE_VARIABLE}.rollup(*dimensions, months=None)` returns a DataFrame indexed by the dimensions with one column per month, `{CUBE_VARIABLE}.total(months=None)` the monthly totals,"
+                    + f" `{CUBE_VARIABLE}.slice(dimension, value)` and `{CUBE_VARIABLE}.dice({{dimension: [values]}})` return the sub-cube of the matching lines, `{CUBE_VARIABLE}.members(dimension)` lists the values of a dimension."
+                    + f" For example `{CUBE_VARIABLE}.slice('Item', 'Revenue').rollup('Profit Center Prefix').abs()` is the revenue by profit center prefix per month. Amounts keep the ledger signs."
+                )
             self.additional_system_message = (
                 "The data is located locally in current directory at "
-                + os.environ.get("data", ".data/finance.csv")
+                + self.data_path
                 + " Remember this is finance data per accounting format. Remove duplicate rows if necessary. Fill nan values with 0, convert string numbers to float and remove comma."
+                + f" The cleaned data is already loaded in the IPython kernel as `{DATASET_VARIABLE}` (duplicate rows removed, nan filled with 0, string numbers converted to float) and its month columns as `{MONTH_COLUMNS_VARIABLE}`, use them directly instead of loading the csv file again."
+                + f" Treat `{DATASET_VARIABLE}` and `{MONTH_COLUMNS_VARIABLE}` as read-only, never reassign them and call .copy() before modifying the data."
+                + cube_instructions
                 + "When you calculate Revenue or Profit, remember to convert revenue sum to positive."
                 + "Remember Revenue is not cost nor expense, think carefully about what to include and exclude in the result."
                 + "Try to use plot or table to present your result, decide on the best plot or chart type for financial reporting, use bar chart for breakdown comparison."
-                + "Remember to only use plotly for plots, never show the plot, always save output using plotly.io.write_json to .output/ folder in json format, finance dashboard can only read from output files."
-                + "When you decide to output a table, ask the user if they want to export it, if so, save it to .output/ folder in csv format"
+                + f"Remember to only use plotly for plots, never show the plot, always save output using plotly.io.write_json to the folder in the `{OUTPUT_DIR_VARIABLE}` variable in json format, e.g. os.path.join({OUTPUT_DIR_VARIABLE}, 'revenue.json') (in shell code it is the ${OUTPUT_DIR_VARIABLE} environment variable), finance dashboard can only read from output files."
+                + f"When you decide to output a table, ask the user if they want to export it, if so, save it to the `{OUTPUT_DIR_VARIABLE}` folder in csv format"
                 + "Don't tell the user where you stored the output data, tell the user it will be displayed on the finance dashboard"
-                "The data description is "
-                + description
-                + " and the first 5 rows are "
-                + first_rows
+                + "\n\nThe data profile is:\n"
+                + profile
             )
 
-        messages = tt.trim(
-            self.messages,
-            self.model,
-            trim_ratio=0.5,
-            system_message=self.system_message
-            + pre_load_function_mapping[os.environ.get("data", ".data/finance.csv")]
-            + self.additional_system_message,
+        return self.additional_system_message
+
+    async def stream_step(self, show_thinking=False):
+        """
+        Streams the next assistant message into self.messages and returns its finish reason.
+        """
+        system_message = (
+            self.system_message
+            + preset_function_summaries.get(self.get_data_path(), "")
+            + self.get_additional_system_message()
         )
+        with tracing.span("prompt.trim", messages=len(self.messages)) as span:
+            messages = self.context.build(self.messages, system_message, self.model)
+            span.set(
+                trimmed_messages=len(messages),
+                prompt_tokens=self.context.last_tokens,
+                dropped_messages=self.context.last_dropped,
+            )
 
         if self.debug_mode:
             print("\n", "Sending `messages` to LLM:", "\n")
@@ -237,149 +638,296 @@ class Interpreter:
 
         # Initialize message, function call trackers, and active block
         self.messages.append({})
-        in_function_call = False
+        # Until the message is complete, an interrupted step removes it
+        self.streaming_index = len(self.messages) - 1
+        arguments_parser = PartialJSONParser()
+        tool_call_parsers = []
 
         expander = None
         process_box = None
         if show_thinking:
             expander = st.expander("Show Thinking Step " + str(self.think_step))
             process_box = expander.empty()
-
-        for _ in range(3):  # 3 retries
-            try:
-                if self.use_azure:
-                    response = openai.ChatCompletion.create(
-                        engine=self.azure_deployment_name,
-                        messages=messages,
-                        functions=[function_schema],
-                        temperature=self.temperature,
-                        stream=True,
-                    )
-                else:
-                    response = openai.ChatCompletion.create(
-                        model=self.model,
-                        messages=messages,
-                        functions=[function_schema],
-                        stream=True,
-                        temperature=self.temperature,
-                    )
-
-                break
-            except openai.error.RateLimitError:
-                # Rate limit hit. Retrying in 3 seconds
-                time.sleep(5)
-        else:
-            raise openai.error.RateLimitError("RateLimitError: Max retries reached")
-
-        for chunk in response:
-            if self.use_azure and ('choices' not in chunk or len(chunk['choices']) == 0):
-                continue
-
+        # The output of the step's function call is streamed into the same expander
+        self.expander = expander
+
+        with tracing.span("llm.stream", step=self.think_step) as span:
+            stream_started = time.monotonic()
+            chunks = 0
+            for _ in range(3):  # 3 retries
+                try:
+                    response = await self.create_completion(messages)
+                    break
+                except openai.error.RateLimitError:
+                    # Rate limit hit. Retrying in 5 seconds
+                    await asyncio.sleep(5)
             else:
-                delta = chunk["choices"][0]["delta"]
+                raise openai.error.RateLimitError("RateLimitError: Max retries reached")
 
-            # Accumulate deltas into the last message in messages
-            self.messages[-1] = merge_deltas(self.messages[-1], delta)
+            async for chunk in response:
+                if self.cancel_event.is_set():
+                    break
 
-            if "function_call" in self.messages[-1]:
-                if in_function_call == False:
-                    pass
+                if self.use_azure and ('choices' not in chunk or len(chunk['choices']) == 0):
+                    continue
 
-                in_function_call = True
-                if "arguments" in self.messages[-1]["function_call"]:
-                    arguments = self.messages[-1]["function_call"]["arguments"]
-                    new_parsed_arguments = parse_partial_json(arguments)
-                    if new_parsed_arguments:
+                else:
+                    delta = chunk["choices"][0]["delta"]
+
+                if chunks == 0:
+                    span.set(first_chunk_seconds=time.monotonic() - stream_started)
+                # One streamed delta is roughly one token
+                chunks += 1
+
+                # Function call arguments go to the incremental parser instead of being
+                # concatenated and re-parsed on every chunk
+                arguments_delta = None
+                if "function_call" in delta and "arguments" in delta["function_call"]:
+                    arguments_delta = delta["function_call"].pop("arguments")
+                # Tool calls arrive as a list of deltas addressed by index
+                tool_call_deltas = delta.pop("tool_calls", None)
+
+                # Accumulate deltas into the last message in messages
+                self.messages[-1] = merge_deltas(self.messages[-1], delta)
+
+                if tool_call_deltas:
+                    merge_tool_call_deltas(
+                        self.messages[-1].setdefault("tool_calls", []),
+                        tool_call_deltas,
+                        tool_call_parsers,
+                        PartialJSONParser,
+                    )
+                elif "function_call" in self.messages[-1]:
+                    if arguments_delta:
+                        new_parsed_arguments = arguments_parser.feed(arguments_delta)
+                        if new_parsed_arguments:
+                            self.messages[-1]["function_call"][
+                                "parsed_arguments"
+                            ] = new_parsed_arguments
+                elif "tool_calls" not in self.messages[-1]:
+                    if show_thinking:
+                        # stream thinking process
+                        process_box.markdown(self.messages[-1]["content"])
+
+                if chunk["choices"][0]["finish_reason"]:
+                    self.streaming_index = None
+                    if "function_call" in self.messages[-1]:
                         self.messages[-1]["function_call"][
-                            "parsed_arguments"
-                        ] = new_parsed_arguments
-            else:
-                in_function_call = False
-                if show_thinking:
-                    # stream thinking process
-                    process_box.markdown(self.messages[-1]["content"])
-
-            if chunk["choices"][0]["finish_reason"]:
-                if chunk["choices"][0]["finish_reason"] == "function_call":
-                    if self.debug_mode:
+                            "arguments"
+                        ] = arguments_parser.text
+                    if function_calls(self.messages[-1]) and self.debug_mode:
                         print("Running function:")
                         print(self.messages[-1])
                         print("---")
                         if show_thinking:
-                            process_box.markdown("Running function:")
-                            process_box.code(
-                                self.messages[-1]["function_call"]["parsed_arguments"][
-                                    "code"
-                                ],
-                                language=self.messages[-1]["function_call"][
-                                    "parsed_arguments"
-                                ]["language"],
-                            )
-
-                    if "parsed_arguments" not in self.messages[-1]["function_call"]:
-                        self.messages.append(
-                            {
-                                "role": "function",
-                                "name": "run_code",
-                                "content": """Your function call could not be parsed. Please use ONLY the `run_code` function, which takes two parameters: `code` and `language`. Your response should be formatted as a JSON.""",
-                            }
-                        )
-
-                        self.respond(
-                            plot=plot,
-                            show_thinking=show_thinking,
-                            store_history=store_history,
-                        )
-                        return
-                    language = self.messages[-1]["function_call"]["parsed_arguments"][
-                        "language"
-                    ]
-                    if language not in self.code_interpreters:
-                        if language == "python":
-                            self.code_interpreters[language] = PythonInterpreter(
-                                preset_functions=pre_load_function_mapping[
-                                    os.environ.get("data", ".data/finance.csv")
-                                ]
-                            )
-                        else:
-                            self.code_interpreters[language] = CodeInterpreter(
-                                language, self.debug_mode
-                            )
-                    code_interpreter = self.code_interpreters[language]
-                    self.last_ran_code = self.messages[-1]["function_call"][
-                        "parsed_arguments"
-                    ]["code"]
-                    output = code_interpreter.run(self.last_ran_code)
-                    self.messages.append(
-                        {
-                            "role": "function",
-                            "name": "run_code",
-                            "content": output if output else "No output",
-                        }
-                    )
-                    self.respond(
-                        plot=plot,
-                        show_thinking=show_thinking,
-                        store_history=store_history,
+                            for call in function_calls(self.messages[-1]):
+                                if "parsed_arguments" in call:
+                                    process_box.markdown("Running function:")
+                                    process_box.code(
+                                        call["parsed_arguments"]["code"],
+                                        language=call["parsed_arguments"]["language"],
+                                    )
+                    span.set(
+                        chunks=chunks,
+                        content_chars=len(self.messages[-1].get("content") or ""),
+                        argument_chars=len(arguments_parser.text),
+                        finish_reason=chunk["choices"][0]["finish_reason"],
                     )
+                    return chunk["choices"][0]["finish_reason"]
+
+            # The stream ended without a finish reason
+            span.set(chunks=chunks)
+            return None
+
+    async def create_completion(self, messages):
+        """
+        Starts a streamed completion, replayed from the completion cache when possible.
+        """
+        if self.use_azure:
+            # Older Azure API versions only know the single function call API
+            request = {"engine": self.azure_deployment_name, "functions": [function_schema]}
+        else:
+            # Tools let the model ask for several independent code runs in one turn
+            request = {
+                "model": self.model,
+                "tools": [{"type": "function", "function": function_schema}],
+            }
+        request.update(
+            messages=messages,
+            temperature=self.temperature,
+            stream=True,
+        )
+        if self.completion_cache is None:
+            return await openai.ChatCompletion.acreate(**request)
+
+        key = self.completion_cache.key(
+            request,
+            dataset=dataset_digest(self.get_data_path()),
+        )
+        chunks = self.completion_cache.get(key)
+        if chunks is not None:
+            tracing.annotate(cached=True)
+            return self.completion_cache.replay(chunks)
+        if self.completion_cache.mode == "replay":
+            raise CompletionCacheMiss("Completion not found in the cache: " + key)
+        response = await openai.ChatCompletion.acreate(**request)
+        return self.completion_cache.record(key, response)
+
+    async def run_code_live(self, code_interpreter, code):
+        """
+        Runs code on a worker thread and streams its output lines and active line
+        into the thinking expander while it runs.
+        """
+        loop = asyncio.get_running_loop()
+        updates = asyncio.Queue()
+        output_box = self.expander.empty()
+
+        def on_output(kind, value):
+            # Called from the kernel's threads, Streamlit is only touched from the loop
+            loop.call_soon_threadsafe(updates.put_nowait, (kind, value))
+
+        run = asyncio.ensure_future(asyncio.to_thread(code_interpreter.run, code, on_output))
+        lines = []
+        active_line = None
+        while True:
+            finished = run.done()
+            changed = False
+            while not updates.empty():
+                kind, value = updates.get_nowait()
+                if kind == "active_line":
+                    active_line = value
                 else:
-                    # we're done, check for outputs
-                    self.think_step = 0
-                    print("We are done")
-                    print("last response", self.messages[-1])
-                    if store_history:
-                        self.chat_history.append(self.messages[-1])
-                    if show_thinking:
-                        st.markdown(self.messages[-1]["content"])
-
-                    if self.last_ran_code and len(self.last_ran_code) > 0:
-                        output_files = get_file_modifications(self.last_ran_code)
-                        print("output_files", output_files)
-                        if plot:
-                            for file in output_files:
-                                plot_files(file)
-                        # reset if already displayed
-                        self.last_ran_code = None
-                        self.output_files.extend(output_files)
-
-                    return
+                    lines.append(value)
+                    del lines[:-LIVE_OUTPUT_LINES]
+                changed = True
+            if changed:
+                with output_box.container():
+                    if active_line is not None and not finished:
+                        st.caption(f"Running line {active_line}")
+                    if lines:
+                        st.code("\n".join(lines), language="text")
+            if finished:
+                return run.result()
+            # Batches the lines of each interval into one update of the page
+            await asyncio.wait([run], timeout=LIVE_OUTPUT_INTERVAL)
+
+    async def run_function_calls(self):
+        """
+        Runs the function calls of the last message and appends their outputs to
+        self.messages, in the order of the calls.
+
+        Calls without a data dependency on each other run at the same time, each
+        on its own kernel, see plan_waves.
+        """
+        message = self.messages[-1]
+        calls = function_calls(message)
+        outputs = [None] * len(calls)
+        runnable = []
+        for index, call in enumerate(calls):
+            if "parsed_arguments" in call:
+                runnable.append(index)
+            else:
+                outputs[index] = (
+                    "Your function call could not be parsed. Please use ONLY the `run_code` function, which takes two parameters: `code` and `language`. Your response should be formatted as a JSON."
+                )
+
+        # Method calls on the session's modules, functions and dataset variables don't modify shared state
+        session_kernel = self.kernel_manager.peek(self.session_id, kernel_key("python"))
+        waves = plan_waves(
+            [
+                (calls[index]["parsed_arguments"]["language"], calls[index]["parsed_arguments"]["code"])
+                for index in runnable
+            ],
+            immutable_names(session_kernel),
+        )
+        for wave in waves:
+            indices = [runnable[position] for position in wave]
+            if self.cancel_event.is_set():
+                for index in indices:
+                    outputs[index] = "Not run, the user cancelled the question."
+                continue
+            wave_outputs = await self.run_wave(
+                [calls[index]["parsed_arguments"] for index in indices]
+            )
+            for index, output in zip(indices, wave_outputs):
+                outputs[index] = output
+
+        if message.get("tool_calls"):
+            for tool_call, output in zip(message["tool_calls"], outputs):
+                self.messages.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": tool_call["id"],
+                        "name": "run_code",
+                        "content": output if output else "No output",
+                    }
+                )
+        else:
+            self.messages.append(
+                {
+                    "role": "function",
+                    "name": "run_code",
+                    "content": outputs[0] if outputs[0] else "No output",
+                }
+            )
+
+    async def run_wave(self, calls):
+        """
+        Runs independent calls at the same time and returns their outputs. The
+        first call runs on the session's kernel, the others on sibling kernels that
+        start from its variables and hand back what they assign.
+        """
+        # Starting a kernel and running code block, keep them off the event loop
+        kernels = []
+        try:
+            for slot, arguments in enumerate(calls):
+                kernels.append(
+                    await asyncio.to_thread(self.get_code_interpreter, arguments["language"], slot)
+                )
+            for code_interpreter, _ in kernels[1:]:
+                share_variables(kernels[0][0], code_interpreter)
+            outputs = list(
+                await asyncio.gather(
+                    *(
+                        self.run_code(code_interpreter, arguments)
+                        for (code_interpreter, _), arguments in zip(kernels, calls)
+                    )
+                )
+            )
+            for (code_interpreter, _), arguments in zip(kernels[1:], calls[1:]):
+                share_variables(code_interpreter, kernels[0][0], code_names(arguments["code"])[1])
+        finally:
+            notes = [
+                await asyncio.to_thread(self.release_code_interpreter, arguments["language"], slot)
+                for slot, arguments in enumerate(calls[: len(kernels)])
+            ]
+
+        if kernels[0][1]:
+            outputs[0] = (
+                "Note: the kernel was restarted to free memory, variables defined in earlier code are gone.\n"
+                + (outputs[0] or "")
+            )
+        for index, note in enumerate(notes):
+            if note:
+                outputs[index] = (outputs[index] or "") + "\n" + note
+        return outputs
+
+    async def run_code(self, code_interpreter, arguments):
+        """
+        Runs the code of one call and records the files it changed.
+        """
+        language = arguments["language"]
+        self.last_ran_code = arguments["code"]
+        with tracing.span("code.run", language=language, code_chars=len(arguments["code"])) as span:
+            if self.expander is not None:
+                output = await self.run_code_live(code_interpreter, arguments["code"])
+            else:
+                output = await asyncio.to_thread(code_interpreter.run, arguments["code"])
+            span.set(
+                output_bytes=len(output.encode("utf-8")) if output else 0,
+                modified_files=len(code_interpreter.file_tracker.last_changes),
+            )
+        for file in code_interpreter.file_tracker.last_changes:
+            if file not in self.modified_files:
+                self.modified_files.append(file)
+        return output
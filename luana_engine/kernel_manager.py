@@ -0,0 +1,269 @@
+import gc
+import os
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from .kernel_pool import close_kernel
+
+MB = 1024 * 1024
+
+_kernel_manager = None
+_kernel_manager_lock = threading.Lock()
+
+
+def object_size(value):
+    """Estimates the memory held by one object of a kernel namespace."""
+    # Imported lazily, pandas is only needed when the namespace holds pandas objects
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (types.ModuleType, types.FunctionType, type)):
+        return 0
+    return sys.getsizeof(value)
+
+
+def namespace_size(namespace):
+    """
+    Estimates the memory held by the values of a namespace, following lists,
+    tuples and dicts (like IPython's Out) one level deep.
+    """
+    seen = set()
+    total = 0
+    for value in list(namespace.values()):
+        values = [value]
+        if isinstance(value, (list, tuple)):
+            values.extend(value)
+        elif isinstance(value, dict):
+            values.extend(value.values())
+        for item in values:
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            total += object_size(item)
+    return total
+
+
+def process_rss(pid):
+    """Returns the resident memory of a process in bytes, 0 where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class ManagedKernel:
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.busy = 0
+        self.last_used = time.monotonic()
+        self.memory = 0
+
+
+class KernelManager:
+    """
+    Owns the code interpreters of every session.
+
+    Each session gets its own kernel per language. After a run the kernel's
+    memory is measured on a background thread, off the path of the turn: an idle
+    kernel above `kernel_limit` is restarted, and while the kernels together use
+    more than `budget`, or have been idle for longer than `idle_timeout`, the
+    least recently used idle kernels are closed. A session whose kernel was
+    closed gets a new one on its next run.
+
+    The memory of Python kernels is an estimate from the sizes of their
+    variables, subprocess kernels report their resident memory and are also
+    hard-limited by the OS (see execution_limits).
+    """
+
+    def __init__(self, budget=2048 * MB, kernel_limit=1024 * MB, idle_timeout=1800):
+        self.budget = budget
+        self.kernel_limit = kernel_limit
+        self.idle_timeout = idle_timeout
+        # (session, language) -> ManagedKernel, least recently used first
+        self.kernels = OrderedDict()
+        self.evicted = set()
+        self.lock = threading.Lock()
+        # Kernels released since they were last measured, and the thread measuring them
+        self.unmeasured = set()
+        self.measure_event = threading.Event()
+        self.measure_lock = threading.Lock()
+        self.measurer = None
+
+    def acquire(self, session, language, factory):
+        """
+        Returns (kernel, restarted) for a session and marks the kernel busy until
+        `release`. `restarted` is True if the session's previous kernel was closed.
+        """
+        key = (session, language)
+        with self.lock:
+            entry = self.kernels.get(key)
+            if entry is not None:
+                entry.busy += 1
+                self.kernels.move_to_end(key)
+                return entry.kernel, False
+            restarted = key in self.evicted
+            self.evicted.discard(key)
+
+        kernel = factory()
+        with self.lock:
+            entry = self.kernels.get(key)
+            if entry is None:
+                entry = self.kernels[key] = ManagedKernel(kernel)
+                kernel = None
+            entry.busy += 1
+            self.kernels.move_to_end(key)
+        if kernel is not None:
+            # Another thread of the session started one first
+            close_kernel(kernel)
+        return entry.kernel, restarted
+
+    def peek(self, session, language):
+        """Returns the kernel of a session without acquiring it, None if it has none."""
+        with self.lock:
+            entry = self.kernels.get((session, language))
+        return entry.kernel if entry is not None else None
+
+    def release(self, session, language):
+        """
+        Marks a kernel idle after a run and queues it to be measured.
+
+        Returns a note for the run output if the kernel was last measured above
+        its limit while it was busy, and had to be restarted now.
+        """
+        key = (session, language)
+        note = None
+        with self.lock:
+            entry = self.kernels.get(key)
+            if entry is None:
+                return None
+            entry.busy -= 1
+            entry.last_used = time.monotonic()
+            if entry.memory > self.kernel_limit and entry.busy == 0:
+                self._evict(key)
+                note = (
+                    f"The kernel used {entry.memory / MB:.0f} MB, more than its limit of "
+                    + f"{self.kernel_limit / MB:.0f} MB, and was restarted. "
+                    + "Variables defined in earlier code were cleared."
+                )
+            else:
+                self.unmeasured.add(key)
+                if self.measurer is None:
+                    self.measurer = threading.Thread(
+                        target=self._measure_loop, name="kernel-measure", daemon=True
+                    )
+                    self.measurer.start()
+        self.measure_event.set()
+        return note
+
+    def measure(self):
+        """
+        Measures the kernels released since their last measurement, restarts the
+        idle ones above their limit and enforces the budget. Runs on the
+        measuring thread; a call returns once every kernel released before it
+        has been measured.
+        """
+        with self.measure_lock:
+            with self.lock:
+                entries = [(key, self.kernels[key]) for key in self.unmeasured if key in self.kernels]
+                self.unmeasured = set()
+            # Not traced, the measurements are not part of any turn
+            for key, entry in entries:
+                entry.memory = kernel_memory(entry.kernel)
+
+            closed = []
+            with self.lock:
+                for key, entry in entries:
+                    over_limit = entry.memory > self.kernel_limit and entry.busy == 0
+                    if over_limit and self.kernels.get(key) is entry:
+                        closed.append(self._evict(key, close=False))
+            for kernel in closed:
+                close_kernel(kernel)
+            self.enforce_budget()
+
+    def _measure_loop(self):
+        while True:
+            self.measure_event.wait()
+            self.measure_event.clear()
+            try:
+                self.measure()
+            except Exception as e:
+                print(f"Failed to measure the kernels: {e}")
+
+    def enforce_budget(self):
+        """Closes idle kernels, least recently used first, until the budget is met."""
+        closed = []
+        now = time.monotonic()
+        with self.lock:
+            total = sum(entry.memory for entry in self.kernels.values())
+            for key, entry in list(self.kernels.items()):
+                if entry.busy:
+                    continue
+                if total > self.budget or now - entry.last_used > self.idle_timeout:
+                    total -= entry.memory
+                    closed.append(self._evict(key, close=False))
+        for kernel in closed:
+            close_kernel(kernel)
+        if closed:
+            gc.collect()
+
+    def _evict(self, key, close=True):
+        entry = self.kernels.pop(key)
+        self.evicted.add(key)
+        if close:
+            close_kernel(entry.kernel)
+        return entry.kernel
+
+    def close_session(self, session):
+        """Closes every kernel of a session."""
+        with self.lock:
+            keys = [key for key in self.kernels if key[0] == session]
+            kernels = [self.kernels.pop(key).kernel for key in keys]
+            self.evicted = {key for key in self.evicted if key[0] != session}
+        for kernel in kernels:
+            close_kernel(kernel)
+
+    def interrupt_session(self, session):
+        """Interrupts the code running in the kernels of a session."""
+        with self.lock:
+            kernels = [
+                entry.kernel
+                for key, entry in self.kernels.items()
+                if key[0] == session and entry.busy
+            ]
+        for kernel in kernels:
+            interrupt = getattr(kernel, "interrupt", None)
+            if interrupt:
+                interrupt()
+
+    def memory_usage(self):
+        """Returns the last measured memory of all kernels in bytes."""
+        with self.lock:
+            return sum(entry.memory for entry in self.kernels.values())
+
+
+def kernel_memory(kernel):
+    memory_usage = getattr(kernel, "memory_usage", None)
+    return memory_usage() if memory_usage else 0
+
+
+def get_kernel_manager():
+    """Returns the process-wide kernel manager, configured from the environment."""
+    global _kernel_manager
+    with _kernel_manager_lock:
+        if _kernel_manager is None:
+            _kernel_manager = KernelManager(
+                budget=int(os.environ.get("KERNEL_MEMORY_BUDGET", 2048 * MB)),
+                kernel_limit=int(os.environ.get("KERNEL_MEMORY_LIMIT", 1024 * MB)),
+                idle_timeout=float(os.environ.get("KERNEL_IDLE_TIMEOUT", 1800)),
+            )
+        return _kernel_manager
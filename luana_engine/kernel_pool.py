@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import tracing
+
+# Number of started kernels kept ready per dataset, 0 starts kernels on demand
+POOL_SIZE = int(os.environ.get("KERNEL_POOL_SIZE", 1))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class KernelPool:
+    """
+    Keeps `size` kernels started in the background, so a session gets a kernel
+    with the imports, preset functions and dataset already loaded on its first
+    run_code instead of paying for the startup.
+    """
+
+    def __init__(self, factory, size=POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self.ready = deque()
+        self.pending = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kernel-pool")
+        self.replenish()
+
+    def replenish(self):
+        """Starts kernels in the background until the pool is full again."""
+        with self.lock:
+            if self.closed:
+                return
+            missing = self.size - len(self.ready) - self.pending
+            self.pending += max(missing, 0)
+        for _ in range(missing):
+            self.executor.submit(self._start_kernel)
+
+    def _start_kernel(self):
+        try:
+            with tracing.span("kernel_pool.start"):
+                kernel = self.factory()
+        except Exception as e:
+            print(f"Failed to start a kernel for the pool: {e}")
+            with self.lock:
+                self.pending -= 1
+            return
+        with self.lock:
+            self.pending -= 1
+            if not self.closed:
+                self.ready.append(kernel)
+                return
+        close_kernel(kernel)
+
+    def acquire(self):
+        """Returns a started kernel, or starts one now if none is ready."""
+        with self.lock:
+            kernel = self.ready.popleft() if self.ready else None
+        self.replenish()
+        with tracing.span("kernel_pool.acquire", warm=kernel is not None):
+            if kernel is None:
+                kernel = self.factory()
+        return kernel
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            kernels = list(self.ready)
+            self.ready.clear()
+        self.executor.shutdown(wait=False)
+        for kernel in kernels:
+            close_kernel(kernel)
+
+
+def close_kernel(kernel):
+    close = getattr(kernel, "close", None)
+    if close:
+        close()
+
+
+def get_kernel_pool(key, factory):
+    """Returns the process-wide pool for a key, e.g. the language and dataset of the kernels."""
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = KernelPool(factory)
+        return pool
@@ -0,0 +1,131 @@
+import os
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from .dataset_cache import load_dataset, month_columns
+from . import tracing
+
+REVENUE_ITEM = "Revenue"
+
+# Name -> whether the KPI is a ratio in percent; ratio deltas are in percentage points
+KPI_CATALOG = {
+    "Revenue": False,
+    "Expenses": False,
+    "Net Profit": False,
+    "Profit Margin": True,
+    "Revenue Growth": True,
+    "Expense Ratio": True,
+}
+
+# The KPIs shown as tiles on the dashboard
+DASHBOARD_KPIS = ["Revenue", "Expenses", "Net Profit", "Profit Margin"]
+
+# Shown for values that can't be computed, like the delta of the first month
+NOT_AVAILABLE = "n/a"
+
+
+def is_finance_ledger(df):
+    """Returns True for datasets with an Item column and month columns, like finance.csv."""
+    return "Item" in df.columns and bool(month_columns(df))
+
+
+def compute_kpis(df):
+    """
+    Computes every KPI of the catalog for every month in one pass over the ledger.
+
+    Revenue is booked as negative amounts, so revenue and expenses are summed and
+    made positive like in `financial_plots`. Returns a DataFrame indexed by month
+    with one column per KPI.
+    """
+    months = month_columns(df)
+    values = df[months].to_numpy(dtype=float)
+    is_revenue = (df["Item"] == REVENUE_ITEM).to_numpy()
+    # Both totals with a single matrix product over the month columns
+    totals = np.abs(np.vstack([is_revenue, ~is_revenue]).astype(float) @ values)
+    revenue, expenses = totals
+    net_profit = revenue - expenses
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margin = net_profit / revenue * 100
+        expense_ratio = expenses / revenue * 100
+        growth = np.full(len(months), np.nan)
+        growth[1:] = (revenue[1:] - revenue[:-1]) / revenue[:-1] * 100
+
+    return pd.DataFrame(
+        {
+            "Revenue": revenue,
+            "Expenses": expenses,
+            "Net Profit": net_profit,
+            "Profit Margin": margin,
+            "Revenue Growth": growth,
+            "Expense Ratio": expense_ratio,
+        },
+        index=pd.Index(months, name="Month"),
+    )
+
+
+def kpi_deltas(kpis):
+    """
+    Returns the change of every KPI over the previous month: in percent for
+    amounts and in percentage points for ratios.
+    """
+    deltas = kpis.diff()
+    amounts = [name for name in kpis.columns if not KPI_CATALOG.get(name)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deltas[amounts] = deltas[amounts] / kpis[amounts].shift().abs() * 100
+    return deltas
+
+
+def format_number(value):
+    """Formats a tile value or delta with 2 decimals, NOT_AVAILABLE for NaN and infinity."""
+    if value is None or not np.isfinite(value):
+        return NOT_AVAILABLE
+    return "{:.2f}".format(value)
+
+
+def kpi_tiles(kpis, names=None):
+    """
+    Returns {name: {"value", "delta"}} for the latest month, formatted like the
+    results of `metrics_pipeline.compute_metric`. With a single month, or a
+    previous value of 0, the delta is NOT_AVAILABLE.
+    """
+    deltas = kpi_deltas(kpis)
+    tiles = {}
+    for name in names or DASHBOARD_KPIS:
+        tiles[name] = {
+            "value": format_number(kpis[name].iloc[-1]),
+            "delta": format_number(deltas[name].iloc[-1]),
+        }
+    return tiles
+
+
+def plot_kpi(kpis, name):
+    fig = go.Figure(
+        data=go.Scatter(x=list(kpis.index), y=kpis[name].tolist(), mode="lines+markers")
+    )
+    fig.update_layout(title=name, xaxis_title="Month", yaxis_title=name)
+    return fig
+
+
+def kpi_dashboard(data_path, names=None, output_dir=".output"):
+    """
+    Computes the dashboard tiles and their plots without the LLM.
+
+    Returns {"tiles": ..., "files": [...]}, or None if the dataset is not a
+    finance ledger and the metrics have to be worked out by the agent.
+    """
+    with tracing.span("kpi.dashboard", path=data_path):
+        df = load_dataset(data_path)
+        if not is_finance_ledger(df):
+            return None
+        kpis = compute_kpis(df)
+        names = names or DASHBOARD_KPIS
+
+        os.makedirs(output_dir, exist_ok=True)
+        files = []
+        for name in names:
+            file = os.path.join(output_dir, name + ".json")
+            pio.write_json(plot_kpi(kpis, name), file)
+            files.append(file)
+        return {"tiles": kpi_tiles(kpis, names), "files": files}
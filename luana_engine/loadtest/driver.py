@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import openai
+
+from .. import interpreter
+from .server import FakeOpenAIServerProcess
+
+
+def percentile(values, percent):
+    """Returns the percentile of the values with linear interpolation."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+async def run_session(questions, latencies, errors):
+    agent = interpreter.Interpreter()
+    for question in questions:
+        started = time.monotonic()
+        try:
+            await agent.achat(question)
+            latencies.append(time.monotonic() - started)
+        except Exception as e:
+            errors.append(repr(e))
+
+
+async def run_sessions(sessions, questions):
+    latencies = []
+    errors = []
+    await asyncio.gather(
+        *[run_session(questions, latencies, errors) for _ in range(sessions)]
+    )
+    return latencies, errors
+
+
+def run_load_test(
+    sessions=10,
+    questions=("What is the total revenue?",),
+    script=None,
+    ttft=0.5,
+    token_latency=0.02,
+):
+    """
+    Simulates concurrent sessions against a local stand-in for the OpenAI API.
+
+    All sessions are driven from one event loop through Interpreter.achat, like
+    a worker serving many users. Returns throughput, answer latency percentiles
+    and the worker's CPU time; the stand-in runs in its own process, so its CPU
+    time is not part of it.
+    """
+    previous = (openai.api_base, openai.api_type, os.environ.get("OPENAI_API_KEY"))
+    with FakeOpenAIServerProcess(script, ttft=ttft, token_latency=token_latency) as server:
+        openai.api_base = server.url
+        openai.api_type = "open_ai"
+        os.environ["OPENAI_API_KEY"] = "sk-local"
+        try:
+            wall_started = time.monotonic()
+            cpu_started = time.process_time()
+            latencies, errors = asyncio.run(run_sessions(sessions, list(questions)))
+            wall_seconds = time.monotonic() - wall_started
+            cpu_seconds = time.process_time() - cpu_started
+        finally:
+            openai.api_base, openai.api_type = previous[0], previous[1]
+            if previous[2] is None:
+                os.environ.pop("OPENAI_API_KEY", None)
+            else:
+                os.environ["OPENAI_API_KEY"] = previous[2]
+
+    return {
+        "sessions": sessions,
+        "answers": len(latencies),
+        "errors": errors,
+        "llm_requests": server.requests,
+        "wall_seconds": wall_seconds,
+        "throughput_answers_per_second": len(latencies) / wall_seconds,
+        "latency_p50_seconds": percentile(latencies, 50),
+        "latency_p95_seconds": percentile(latencies, 95),
+        "cpu_seconds": cpu_seconds,
+        "cpu_utilization": cpu_seconds / wall_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the agent against a local OpenAI stand-in"
+    )
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument(
+        "--question",
+        action="append",
+        help="question asked by every session, can be repeated",
+    )
+    parser.add_argument("--script", help="json file with the scripted responses")
+    parser.add_argument("--ttft", type=float, default=0.5, help="time to first token")
+    parser.add_argument(
+        "--token-latency", type=float, default=0.02, help="latency per token"
+    )
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    report = run_load_test(
+        sessions=args.sessions,
+        questions=args.question or ["What is the total revenue?"],
+        script=script,
+        ttft=args.ttft,
+        token_latency=args.token_latency,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import json
+import multiprocessing
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Answers with one run_code call on the preloaded data, then a short summary
+default_script = [
+    {
+        "turns": [
+            {
+                "content": "Let me calculate the total revenue.",
+                "function_call": {
+                    "language": "python",
+                    "code": "revenue = DATA[DATA['Item'] == 'Revenue'][MONTH_COLUMNS].sum().abs()\nprint(revenue)",
+                },
+            },
+            {
+                "content": "The total revenue is shown above, it will be displayed on the finance dashboard."
+            },
+        ]
+    }
+]
+
+
+def split_tokens(text, size=4):
+    """Splits text into token-sized pieces, roughly 4 characters per token."""
+    return [text[i : i + size] for i in range(0, len(text), size)] or [""]
+
+
+class FakeOpenAIServer:
+    """
+    A local stand-in for the OpenAI chat completions API, for load tests.
+
+    It speaks the streaming chat-completions / function-call protocol consumed by
+    Interpreter.stream_step. Responses come from a script: a list of rules
+    {"match": "substring of the user question", "turns": [...]}; the first rule
+    that matches the last user message is used (a rule without "match" matches
+    everything). The n-th assistant turn after the user message gets turns[n],
+    which is {"content": "..."} and/or {"function_call": {"language", "code"}}, or
+    {"tool_calls": [{"language", "code"}, ...]} for several calls in one turn.
+    Requests with `tools` get the calls as tool calls, others as a function call.
+    `ttft` and `token_latency` (seconds) simulate time to first token and per
+    token latency.
+    """
+
+    def __init__(self, script=None, ttft=0.0, token_latency=0.0, host="127.0.0.1", port=0):
+        self.script = script or default_script
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def next_turn(self, messages):
+        """Picks the scripted turn for the conversation in the request."""
+        question = ""
+        step = 0
+        for message in messages:
+            if message.get("role") == "user":
+                question = message.get("content") or ""
+                step = 0
+            elif message.get("role") == "assistant":
+                step += 1
+
+        for rule in self.script:
+            if rule.get("match", "") in question:
+                turns = rule["turns"]
+                return turns[min(step, len(turns) - 1)]
+        return {"content": "I don't know."}
+
+    def turn_calls(self, turn):
+        if "tool_calls" in turn:
+            return turn["tool_calls"]
+        if "function_call" in turn:
+            return [turn["function_call"]]
+        return []
+
+    def chunks(self, turn, tools=False):
+        """Yields the deltas and finish reason of a scripted turn."""
+        if turn.get("content"):
+            yield {"role": "assistant", "content": ""}, None
+            for token in split_tokens(turn["content"]):
+                yield {"content": token}, None
+        else:
+            yield {"role": "assistant", "content": None}, None
+        calls = self.turn_calls(turn)
+        if calls and tools:
+            for index, call in enumerate(calls):
+                yield {
+                    "tool_calls": [
+                        {
+                            "index": index,
+                            "id": "call_" + uuid.uuid4().hex,
+                            "type": "function",
+                            "function": {"name": "run_code", "arguments": ""},
+                        }
+                    ]
+                }, None
+                for token in split_tokens(json.dumps(call)):
+                    yield {"tool_calls": [{"index": index, "function": {"arguments": token}}]}, None
+            yield {}, "tool_calls"
+        elif calls:
+            arguments = json.dumps(calls[0])
+            yield {"function_call": {"name": "run_code", "arguments": ""}}, None
+            for token in split_tokens(arguments):
+                yield {"function_call": {"arguments": token}}, None
+            yield {}, "function_call"
+        else:
+            yield {}, "stop"
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with server.lock:
+                    server.requests += 1
+
+                turn = server.next_turn(request.get("messages", []))
+                completion_id = "chatcmpl-" + uuid.uuid4().hex
+                model = request.get("model", "gpt-4")
+                time.sleep(server.ttft)
+
+                if not request.get("stream"):
+                    self.send_json(
+                        server.completion(turn, completion_id, model, bool(request.get("tools")))
+                    )
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for delta, finish_reason in server.chunks(turn, bool(request.get("tools"))):
+                        chunk = {
+                            "id": completion_id,
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "delta": delta,
+                                    "finish_reason": finish_reason,
+                                }
+                            ],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                        time.sleep(server.token_latency)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stops reading once it has seen the finish reason
+                    pass
+
+            def send_json(self, body):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def completion(self, turn, completion_id, model, tools=False):
+        message = {"role": "assistant", "content": turn.get("content")}
+        finish_reason = "stop"
+        calls = self.turn_calls(turn)
+        if calls and tools:
+            message["tool_calls"] = [
+                {
+                    "id": "call_" + uuid.uuid4().hex,
+                    "type": "function",
+                    "function": {"name": "run_code", "arguments": json.dumps(call)},
+                }
+                for call in calls
+            ]
+            finish_reason = "tool_calls"
+        elif calls:
+            message["function_call"] = {
+                "name": "run_code",
+                "arguments": json.dumps(calls[0]),
+            }
+            finish_reason = "function_call"
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        }
+
+
+def serve(connection, script, ttft, token_latency):
+    """Runs a FakeOpenAIServer until told to stop, sends its url then its request count."""
+    with FakeOpenAIServer(script, ttft=ttft, token_latency=token_latency) as server:
+        connection.send(server.url)
+        connection.recv()
+    connection.send(server.requests)
+
+
+class FakeOpenAIServerProcess:
+    """
+    Runs a FakeOpenAIServer in a child process, so the CPU time of its threads
+    is not counted as the CPU time of the process under test. `requests` is set
+    once the server is stopped.
+    """
+
+    def __init__(self, script=None, ttft=0.0, token_latency=0.0):
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=serve,
+            args=(child_connection, script, ttft, token_latency),
+            name="fake-openai-server",
+            daemon=True,
+        )
+        self.url = None
+        self.requests = None
+
+    def start(self):
+        self.process.start()
+        self.url = self.connection.recv()
+        return self.url
+
+    def stop(self):
+        self.connection.send("stop")
+        self.requests = self.connection.recv()
+        self.process.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .file_tracker import new_output_dir
+from .kpi_engine import format_number
+
+metric_names_prompt = (
+    "Analyze the data and come up with 1-4 key metrics you can calculate to show value, and delta over last time period. "
+    + "Tell me the metric names directly in one sentence, comma seperated, without any explanation, "
+)
+
+metric_value_prompt = """and it's delta over last time period in percentage, return a json obeject of schema: {"value": "", "delta": ""}, no explaination, return the json object directly in your response."""
+
+
+def parse_metric_names(content):
+    """Splits the comma separated metric names answered by the agent."""
+    metrics = [metric.strip().rstrip(".").strip() for metric in content.split(",")]
+    return [metric for metric in metrics if metric]
+
+
+def read_metric_file(file):
+    """Reads the latest value and delta in percentage from a saved plotly json."""
+    with open(file, "r") as f:
+        metric_data = json.load(f)
+    y_values = metric_data["data"][0]["y"]
+    last_value = y_values[-1]
+    delta = None
+    # a single point, or a previous value of 0, has no delta
+    if len(y_values) > 1 and last_value is not None and y_values[-2]:
+        delta = (last_value - y_values[-2]) / y_values[-2] * 100
+    return {"value": format_number(last_value), "delta": format_number(delta)}
+
+
+def compute_metric(agent, metric):
+    """
+    Plots a metric and calculates its value and delta with the given agent.
+
+    Returns a dict with the formatted value, delta and the plot files.
+    """
+    files = agent.chat(
+        f"now plot the metric {metric} over time, save the plot as {metric}.json using plotly",
+        return_messages=False,
+        plot=False,
+        show_thinking=False,
+    )
+    messages, _ = agent.chat(
+        "now calculate the value of " + metric + metric_value_prompt,
+        return_messages=True,
+        show_thinking=False,
+    )
+    # parse last message as json object
+    content = messages[-1]["content"]
+    metric_data = json.loads(content[content.find("{") : content.rfind("}") + 1])
+    return {
+        "value": "{:.2f}".format(float(metric_data["value"])),
+        "delta": "{:.2f}".format(float(metric_data["delta"])),
+        "files": list(files or []),
+    }
+
+
+class MetricsPipeline:
+    """
+    Computes the dashboard metrics concurrently.
+
+    Every metric runs on its own fork of the agent, so each gets a copy of the
+    analysis conversation and its own kernel, and the results can be rendered
+    as they finish instead of after 2 x N sequential agent conversations.
+    The plots are copied to `output_dir` before a fork's kernels are closed.
+    """
+
+    def __init__(self, agent, metrics, max_workers=None, output_dir=None):
+        self.metrics = metrics
+        self.output_dir = output_dir or new_output_dir()
+        self.results = {}
+        self.files = []
+        self._files_collected = False
+        self._lock = threading.Lock()
+        executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(len(metrics), 1),
+            thread_name_prefix="metrics",
+        )
+        self._futures = {
+            executor.submit(self._compute, agent, metric): metric for metric in metrics
+        }
+        # Let the workers finish in the background
+        executor.shutdown(wait=False)
+
+    def _compute(self, agent, metric):
+        # Forking copies the kernel variables, so it runs on the worker too
+        forked = agent.fork()
+        try:
+            result = compute_metric(forked, metric)
+            result["files"] = [
+                shutil.copy(file, self.output_dir) for file in result["files"] if os.path.exists(file)
+            ]
+            return result
+        finally:
+            forked.reset()
+
+    def as_completed(self):
+        """
+        Yields (metric, result) as each metric finishes; result is None if it failed.
+        """
+        for future in as_completed(self._futures):
+            metric = self._futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Failed to compute metric {metric}: {e}")
+                result = None
+            self.results[metric] = result
+            yield metric, result
+        self._collect_files()
+
+    def _collect_files(self):
+        # Keep the plots in metric order, whatever order they finished in
+        with self._lock:
+            if self._files_collected:
+                return
+            for metric in self.metrics:
+                if self.results.get(metric):
+                    self.files.extend(self.results[metric]["files"])
+            self._files_collected = True
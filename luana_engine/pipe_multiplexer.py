@@ -0,0 +1,140 @@
+import codecs
+import os
+import platform
+import selectors
+import threading
+from collections import deque
+
+_multiplexer = None
+_multiplexer_lock = threading.Lock()
+
+
+class OutputBuffer:
+    """
+    Keeps the last `max_chars` characters of a run's output lines.
+
+    Appending is O(1) amortized, old lines are dropped from the front instead of
+    re-truncating the whole output on every line.
+    """
+
+    def __init__(self, max_chars=2000):
+        self.max_chars = max_chars
+        self.lines = deque()
+        self.chars = 0
+        self.truncated = False
+
+    def append(self, line):
+        self.lines.append(line)
+        self.chars += len(line) + 1
+        while self.chars > self.max_chars and len(self.lines) > 1:
+            self.chars -= len(self.lines.popleft()) + 1
+            self.truncated = True
+
+    def text(self):
+        data = "\n".join(self.lines).strip()
+        if self.truncated or len(data) > self.max_chars:
+            return (
+                f"Output truncated. Showing the last {self.max_chars} characters.\n\n"
+                + data[-self.max_chars :]
+            )
+        return data
+
+
+class PipeReader:
+    """Splits the bytes read from a pipe into lines for a callback."""
+
+    def __init__(self, stream, on_line):
+        # Holding the stream keeps its file descriptor open until EOF is read
+        self.stream = stream
+        self.fd = stream.fileno()
+        self.on_line = on_line
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.partial = ""
+
+    def read(self):
+        """Reads what is available, returns False at EOF."""
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+
+        if not data:
+            if self.partial:
+                self.emit(self.partial)
+            self.emit(None)
+            return False
+
+        lines = (self.partial + self.decoder.decode(data)).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.emit(line)
+        return True
+
+    def emit(self, line):
+        try:
+            self.on_line(line)
+        except Exception as e:
+            print(f"Failed to handle output line: {e}")
+
+
+class PipeMultiplexer:
+    """
+    Reads the output pipes of every code interpreter subprocess from one thread.
+
+    `register(stream, on_line)` calls `on_line(line)` on the multiplexer thread for
+    every line written to the stream, and `on_line(None)` once it is closed.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+        self.thread = threading.Thread(
+            target=self.loop, name="pipe-multiplexer", daemon=True
+        )
+        self.thread.start()
+
+    def register(self, stream, on_line):
+        os.set_blocking(stream.fileno(), False)
+        with self.lock:
+            self.pending.append(PipeReader(stream, on_line))
+        os.write(self.wakeup_write, b"\0")
+
+    def loop(self):
+        while True:
+            for key, _ in self.selector.select():
+                reader = key.data
+                if reader is None:
+                    self.add_pending()
+                elif not reader.read():
+                    self.selector.unregister(reader.fd)
+
+    def add_pending(self):
+        try:
+            while os.read(self.wakeup_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            readers, self.pending = self.pending, []
+        for reader in readers:
+            self.selector.register(reader.fd, selectors.EVENT_READ, reader)
+
+
+def get_multiplexer():
+    """
+    Returns the process-wide pipe multiplexer, or None on Windows where pipes
+    cannot be used with selectors.
+    """
+    global _multiplexer
+    if platform.system() == "Windows":
+        return None
+    with _multiplexer_lock:
+        if _multiplexer is None:
+            _multiplexer = PipeMultiplexer()
+        return _multiplexer
@@ -26,37 +26,27 @@ import pandas as pd
 import plotly.graph_objects as go
 import plotly.io as pio
 import json
+from luana_engine.dataset_cache import load_dataset
 
 def load_and_clean_data(file_path):
-    # Load the data
-    data = pd.read_csv(file_path)
-
-    # Remove duplicate rows
-    data = data.drop_duplicates()
-
-    # Fill NaN values with 0
-    data = data.fillna(0)
-
-    # Convert string numbers to float and remove commas
-    for column in data.columns[3:]:
-        data[column] = data[column].replace(',', '', regex=True).astype(float)
-
-    return data
+    # Load the cleaned data from the dataset cache: duplicate rows removed,
+    # NaN values filled with 0 and month columns converted from strings with commas to float
+    return load_dataset(file_path)
 
 def calculate_revenue(data):
-    # Calculate the Total for each month
+    # Calculate the total revenue for each month as positive amounts
     total_data = data[data['Item'] == "Revenue"].iloc[:, 3:].sum().abs()
 
     return total_data
 
 def calculate_expense(data):
-    # Calculate the Total for each month
+    # Calculate the total of all items except revenue for each month
     total_data = data[data['Item'] != "Revenue"].iloc[:, 3:].sum()
 
     return total_data
 
 def calculate_item(data, item):
-    # Calculate the Total for each month
+    # Calculate the total of one item for each month
     total_data = data[data['Item'] == item].iloc[:, 3:].sum()
 
     return total_data
@@ -71,7 +61,7 @@ def generate_plot_total_over_time(total_data, title, file_name):
     return fig
 
 def calculate_value_and_delta(total_data):
-    # Calculate the value
+    # Calculate the sum of all months and the delta of the last month in percentage as json
     value = total_data.sum()
 
     # Calculate the delta over the last time period in percentage
@@ -84,10 +74,13 @@ def calculate_value_and_delta(total_data):
 """
 
 city_budget_functions = """
+import pandas as pd
+from luana_engine.dataset_cache import load_dataset
+
 def load_and_preprocess_data(file_path):
-    #Loads the data from the given file path and preprocesses it by converting the 'Budget' column to numeric.
-    data = pd.read_csv(file_path)
-    data['Budget'] = pd.to_numeric(data['Budget'].str.replace(',', ''), errors='coerce')
+    #Loads the cleaned data from the dataset cache and converts the 'Budget' column to numeric.
+    data = load_dataset(file_path)
+    data['Budget'] = pd.to_numeric(data['Budget'].astype(str).str.replace(',', ''), errors='coerce')
     return data
 
 def calculate_total_expenditure(data):
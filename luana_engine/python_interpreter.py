@@ -1,22 +1,274 @@
+import io
+import ast
+import sys
+import atexit
+import shutil
+import threading
+import contextvars
+from contextlib import contextmanager
+import pandas as pd
 from IPython.core.interactiveshell import InteractiveShell
-from IPython.utils.capture import capture_output
+from traitlets.config import Config
 from .prompts.generate_functions import finance_data_functions
+from .dataset_cache import cache_path, load_dataset, month_columns
+from .file_tracker import OUTPUT_DIR_VARIABLE, FileTracker, new_output_dir
+from .finance_cube import load_cube
+from .kernel_manager import namespace_size
+from .execution_limits import (
+    EXECUTION_CPU_TIMEOUT,
+    EXECUTION_TIMEOUT,
+    INTERRUPT_GRACE,
+    interrupt_thread,
+    stopped_message,
+    thread_cpu_time,
+    wait_for_completion,
+)
+from . import tracing
+
+# Names of the read-only variables the cleaned dataset is bound to in the kernel
+DATASET_VARIABLE = "DATA"
+MONTH_COLUMNS_VARIABLE = "MONTH_COLUMNS"
+CUBE_VARIABLE = "CUBE"
+# With Copy-on-Write, the default from pandas 3, a shallow copy of a DataFrame
+# shares its data until either one is written to
+COPY_ON_WRITE = int(pd.__version__.split(".")[0]) >= 3
+
+_install_lock = threading.Lock()
+
+
+class ThreadRoutedStream:
+    """
+    Stands in for sys.stdout / sys.stderr and sends each write to the capture
+    buffer of the writing thread, so kernels can run cells concurrently.
+    Threads that are not capturing write to the original stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _routed_stream(name):
+    with _install_lock:
+        stream = getattr(sys, name)
+        if not isinstance(stream, ThreadRoutedStream):
+            stream = ThreadRoutedStream(stream)
+            setattr(sys, name, stream)
+        return stream
+
+
+class LineCallbackBuffer(io.StringIO):
+    """
+    A capture buffer that also passes every completed line to `on_output(kind, line)`.
+    """
+
+    def __init__(self, kind, on_output):
+        super().__init__()
+        self.kind = kind
+        self.on_output = on_output
+        self.partial = ""
+
+    def write(self, text):
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.on_output(self.kind, line)
+        return super().write(text)
+
+    def flush_partial(self):
+        if self.partial:
+            self.on_output(self.kind, self.partial)
+            self.partial = ""
+
+
+@contextmanager
+def capture_thread_output(on_output=None):
+    """
+    Captures what the current thread writes to stdout and stderr, and streams
+    it line by line to `on_output(kind, line)` if given.
+    """
+    stdout = _routed_stream("stdout")
+    stderr = _routed_stream("stderr")
+    if on_output:
+        captured = (
+            LineCallbackBuffer("stdout", on_output),
+            LineCallbackBuffer("stderr", on_output),
+        )
+    else:
+        captured = (io.StringIO(), io.StringIO())
+    stdout.local.buffer, stderr.local.buffer = captured
+    try:
+        yield captured
+    finally:
+        stdout.local.buffer = None
+        stderr.local.buffer = None
+        if on_output:
+            for buffer in captured:
+                buffer.flush_partial()
+
+
+# Name of the function the active line markers call in the kernel namespace
+ACTIVE_LINE_FUNCTION = "__active_line__"
+
+
+class ActiveLineMarker(ast.NodeTransformer):
+    """
+    IPython AST transformer calling `__active_line__(lineno)` before every top
+    level statement of a cell while its output is streamed.
+
+    Unlike add_active_line_prints it works on the parsed cell, so tracebacks still
+    show the original source, and it leaves loop bodies alone, so it costs one
+    call per statement.
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    def visit_Module(self, node):
+        if not self.enabled:
+            return node
+        body = []
+        for statement in node.body:
+            marker = ast.Expr(
+                value=ast.Call(
+                    func=ast.Name(id=ACTIVE_LINE_FUNCTION, ctx=ast.Load()),
+                    args=[ast.Constant(value=statement.lineno)],
+                    keywords=[],
+                )
+            )
+            body.append(ast.copy_location(marker, statement))
+            body.append(statement)
+        node.body = body
+        return ast.fix_missing_locations(node)
+
+
+class KernelShell(InteractiveShell):
+    """
+    An InteractiveShell that leaves sys.modules["__main__"] alone, like
+    InteractiveShellEmbed does. Otherwise every new shell replaces the
+    process's __main__ with its own namespace and keeps it alive.
+    """
+
+    def init_sys_modules(self):
+        pass
+
+
+def create_shell():
+    """
+    Creates an IPython shell with its own namespace.
+
+    Unlike InteractiveShell.instance(), which is a process-wide singleton,
+    every interpreter gets a separate shell, so sessions and forked
+    conversations do not share variables.
+    """
+    config = Config()
+    config.HistoryManager.enabled = False
+    # Tracebacks are read by the model, ANSI colors only cost tokens
+    config.InteractiveShell.colors = "NoColor"
+    return KernelShell(config=config)
+
+
+def dispose_shell(shell):
+    """
+    Clears a shell's namespace and unregisters its atexit hooks, the shell's
+    own and the one of its %%script magics, which would otherwise keep the
+    shell and all of its variables alive until exit.
+    """
+    shell.reset(new_session=False)
+    shell.user_ns.clear()
+    atexit.unregister(shell.atexit_operations)
+    script_magics = shell.magics_manager.registry.get("ScriptMagics")
+    if script_magics is not None:
+        atexit.unregister(script_magics.kill_bg_processes)
 
 
 class PythonInterpreter:
-    def __init__(self, preset_functions=None):
-        self.shell = InteractiveShell.instance()
+    def __init__(self, preset_functions=None, data_path=None):
+        self.shell = create_shell()
+        self.preset_functions = preset_functions
+        self.data_path = data_path
+        self.dataset_version = None
+        # The clean dataset, cells only ever get copies of it
+        self.dataset = None
+        self.preloaded = {}
+        # Artifacts are only looked for in the kernel's own directory
+        self.output_dir = new_output_dir()
+        self.file_tracker = FileTracker([self.output_dir])
+        self.timeout = EXECUTION_TIMEOUT
+        self.cpu_timeout = EXECUTION_CPU_TIMEOUT
+        self.interrupted = threading.Event()
+        # (thread, shell) of the cell running now
+        self.running_cell = None
+        # (thread, shell) of cells that could not be stopped and still run after a restart
+        self.stuck_cells = []
+        self.active_line_marker = ActiveLineMarker()
+        self.shell.ast_transformers.append(self.active_line_marker)
         self.run(preset_functions)
 
-    def run(self, code):
-        with capture_output() as captured:
-            try:
-                self.shell.run_cell(code)
-                stdout = captured.stdout
-                stderr = captured.stderr
-            except Exception as e:
-                stdout = ""
-                stderr = str(e)
+    def refresh_dataset(self):
+        """
+        Binds the cleaned dataset, its month columns and, for finance ledgers,
+        its aggregate cube in the kernel namespace.
+
+        The dataset is only reloaded when the underlying file changes; the
+        variables are re-bound if a cell reassigned or deleted them. Every cell
+        gets its own copy of the dataset as DATA, edits in place don't outlive
+        the cell; with Copy-on-Write the copy is shallow and only the columns a
+        cell writes to are copied. The kernel's output directory is bound as
+        OUTPUT_DIR.
+        """
+        self.preloaded[OUTPUT_DIR_VARIABLE] = self.output_dir
+        version = cache_path(self.data_path) if self.data_path else None
+        if version != self.dataset_version:
+            with tracing.span("dataset.load", path=self.data_path):
+                data = load_dataset(self.data_path)
+            self.dataset = data
+            self.preloaded = {
+                OUTPUT_DIR_VARIABLE: self.output_dir,
+                MONTH_COLUMNS_VARIABLE: pd.Index(month_columns(data)),
+            }
+            cube = load_cube(self.data_path, data)
+            if cube is not None:
+                self.preloaded[CUBE_VARIABLE] = cube
+            self.dataset_version = version
+        if self.dataset is not None:
+            self.preloaded[DATASET_VARIABLE] = self.dataset.copy(deep=not COPY_ON_WRITE)
+
+        user_ns = self.shell.user_ns
+        for name, value in self.preloaded.items():
+            if user_ns.get(name) is not value:
+                user_ns[name] = value
+
+    def run(self, code, on_output=None):
+        """
+        Runs a cell and returns its output. `on_output(kind, value)` is called from
+        the cell's thread for every line of output ("stdout" / "stderr") and before
+        every top level statement ("active_line" with its line number).
+        """
+        with tracing.span("python_interpreter.run") as span:
+            self.refresh_dataset()
+            with tracing.span("files.snapshot"):
+                self.file_tracker.start()
+            with tracing.span("python_interpreter.execute") as execute_span:
+                stdout, stderr, stopped = self.execute_cell(code, on_output)
+                execute_span.set(stopped=stopped)
+            with tracing.span("files.compare") as files_span:
+                changes = self.file_tracker.stop()
+                files_span.set(changes=len(changes))
+            span.set(stdout_bytes=len(stdout.encode("utf-8")), stderr_bytes=len(stderr.encode("utf-8")))
 
         # Combine stdout and stderr
         output = f"STDOUT: {stdout}, STDERR: {stderr}"
@@ -25,4 +277,125 @@ class PythonInterpreter:
         if len(output) > 2000:
             output = output[:2000]
 
+        if stopped:
+            reason, restarted = stopped
+            if restarted:
+                self.restart()
+                # Keep the files of the stopped run, not the ones of the restart
+                self.file_tracker.last_changes = changes
+            output += "\n" + stopped_message(reason, restarted, self.timeout, self.cpu_timeout)
+
         return output
+
+    def execute_cell(self, code, on_output=None):
+        """
+        Runs a cell on its own thread within the wall time and CPU time limits.
+
+        Returns (stdout, stderr, stopped); stopped is None, or (reason, restarted)
+        when the cell was interrupted and restarted is True if it did not stop
+        and the kernel has to be replaced.
+
+        The limits are cooperative: the interrupt is only raised once the cell
+        runs Python code again, so C code like a large pandas merge runs to its
+        end, and the memory of the cell is not limited. Only the subprocess
+        kernels of CodeInterpreter get a hard memory limit and are killed.
+        """
+        self.interrupted.clear()
+        finished = threading.Event()
+        result = {"stdout": "", "stderr": ""}
+        shell = self.shell
+        self.active_line_marker.enabled = on_output is not None
+        if on_output:
+            shell.user_ns[ACTIVE_LINE_FUNCTION] = lambda line: on_output("active_line", line)
+            shell.user_ns_hidden[ACTIVE_LINE_FUNCTION] = None
+
+        def execute():
+            try:
+                with capture_thread_output(on_output) as (captured_stdout, captured_stderr):
+                    try:
+                        shell.run_cell(code)
+                    except BaseException as e:
+                        # Also an interrupt that arrives outside of run_cell
+                        captured_stderr.write(repr(e))
+                    finally:
+                        result["stdout"] = captured_stdout.getvalue()
+                        result["stderr"] = captured_stderr.getvalue()
+            finally:
+                finished.set()
+
+        # Copy the context so tracing spans of the cell nest under this run
+        thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(execute,),
+            name="python-kernel",
+            daemon=True,
+        )
+        self.running_cell = (thread, shell)
+        thread.start()
+        reason = wait_for_completion(
+            finished,
+            lambda: thread_cpu_time(thread.ident),
+            self.interrupted,
+            self.timeout,
+            self.cpu_timeout,
+        )
+        if reason is None:
+            return result["stdout"], result["stderr"], None
+
+        # Raises KeyboardInterrupt in the cell as soon as it is back in Python code
+        interrupt_thread(thread.ident)
+        restarted = not finished.wait(INTERRUPT_GRACE)
+        return result["stdout"], result["stderr"], (reason, restarted)
+
+    def interrupt(self):
+        """Stops the running cell, can be called from any thread."""
+        self.interrupted.set()
+
+    def restart(self):
+        """
+        Replaces the shell, e.g. when a cell could not be interrupted, and loads
+        the preset functions and the dataset into the new one. A thread can't be
+        killed, the stuck cell is left to finish on the old shell and is kept in
+        `stuck_cells`, so its memory is still counted for the kernel.
+        """
+        with tracing.span("python_interpreter.restart"):
+            if self.running_cell is not None and self.running_cell[0].is_alive():
+                self.stuck_cells.append(self.running_cell)
+            else:
+                dispose_shell(self.shell)
+            self.running_cell = None
+            self.shell = create_shell()
+            self.shell.ast_transformers.append(self.active_line_marker)
+            self.preloaded = {}
+            self.dataset_version = None
+            self.refresh_dataset()
+            if self.preset_functions:
+                self.execute_cell(self.preset_functions)
+
+    def memory_usage(self):
+        """
+        Estimates the memory held by the kernel namespace in bytes, and by the
+        shells of stuck cells that are still running.
+        """
+        for thread, shell in self.stuck_cells:
+            if not thread.is_alive():
+                dispose_shell(shell)
+        self.stuck_cells = [(thread, shell) for thread, shell in self.stuck_cells if thread.is_alive()]
+        return namespace_size(self.shell.user_ns) + sum(
+            namespace_size(shell.user_ns) for _, shell in self.stuck_cells
+        )
+
+    def close(self):
+        """
+        Clears the namespaces of the kernel and its stuck cells so their data can
+        be freed, and removes the kernel's output directory.
+        """
+        dispose_shell(self.shell)
+        for _, shell in self.stuck_cells:
+            dispose_shell(shell)
+        self.stuck_cells = []
+        self.running_cell = None
+        self.preloaded = {}
+        self.dataset = None
+        self.dataset_version = None
+        shutil.rmtree(self.output_dir, ignore_errors=True)
@@ -0,0 +1,321 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from .answer_store import AnswerStore
+from .dataset_cache import dataset_digest
+from .dataset_profile import get_profile
+from . import tracing
+
+# Similarity from which a stored answer is served for a question
+QUESTION_CACHE_THRESHOLD = float(os.environ.get("QUESTION_CACHE_THRESHOLD", 0.85))
+# Lengths of the character n-grams the questions are compared on
+NGRAM_SIZES = (3, 4, 5)
+
+MONTHS = [
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+]
+MONTH_NAMES = {month: month for month in MONTHS}
+MONTH_NAMES.update({month[:3]: month for month in MONTHS})
+MONTH_NAMES["sept"] = "september"
+
+# Words that don't change what is asked
+FILLER_WORDS = {
+    "a",
+    "an",
+    "the",
+    "what",
+    "whats",
+    "is",
+    "are",
+    "was",
+    "were",
+    "in",
+    "of",
+    "for",
+    "me",
+    "my",
+    "our",
+    "us",
+    "i",
+    "we",
+    "you",
+    "can",
+    "could",
+    "please",
+    "show",
+    "give",
+    "tell",
+    "get",
+    "total",
+    "much",
+    "how",
+    "do",
+    "did",
+    "have",
+    "had",
+    "to",
+    "on",
+    "during",
+}
+# Words that give a question its direction, questions with opposite ones must not match,
+# however close the rest of the question is
+DIRECTION_WORDS = {}
+for canonical, words in {
+    "increase": "increase increased increasing rise rose risen rising grow grew grown growing growth gain gained",
+    "decrease": "decrease decreased decreasing decline declined declining drop dropped dropping fall fell fallen falling shrink shrank reduce reduced",
+    "more": "more higher greater above exceed exceeded",
+    "less": "less fewer lower below",
+    "max": "max maximum most top highest largest biggest best",
+    "min": "min minimum least bottom lowest smallest worst",
+    "average": "average avg mean",
+    "median": "median",
+    "count": "count",
+    "not": "not without excluding except",
+}.items():
+    DIRECTION_WORDS.update({word: canonical for word in words.split()})
+
+# Questions starting like this, or referring to an earlier answer, depend on the conversation
+FOLLOW_UP_PATTERN = re.compile(
+    r"^(and|also|but|so|then|now|what about|how about|same)\b|\b(it|its|that|those|these|this|them|they|above|previous|again)\b"
+)
+
+DATE_PATTERNS = [
+    # 2020/09, 2020-09
+    (re.compile(r"\b(20\d\d)[-/](0?[1-9]|1[0-2])\b"), lambda m: (m.group(1), m.group(2))),
+    # 09/2020, 9-2020
+    (re.compile(r"\b(0?[1-9]|1[0-2])[-/](20\d\d)\b"), lambda m: (m.group(2), m.group(1))),
+]
+
+_question_cache = None
+_question_cache_lock = threading.Lock()
+
+
+def stem(word):
+    # Plurals match their singular, "fees" and "fee" are the same item
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def dataset_vocabulary(data_path):
+    """Returns the values of the dataset's dimensions as tuples of stemmed words, longest first."""
+    vocabulary = set()
+    for column in get_profile(data_path)["columns"]:
+        if column["role"] != "dimension":
+            continue
+        for value in column["values"]:
+            words = tuple(stem(word) for word in re.findall(r"[a-z0-9&]+", value.lower()))
+            if words:
+                vocabulary.add(words)
+    return sorted(vocabulary, key=len, reverse=True)
+
+
+def question_terms(question, vocabulary=()):
+    """
+    Normalizes a question for matching, returns (text, entities).
+
+    Dates and month abbreviations become month names, plurals their singular,
+    direction and comparison words their canonical form and the dataset's
+    values, like the ledger items, single tokens. Filler words are dropped. The
+    entities are the months, years, numbers, dataset values and directions of
+    the question, questions only match if they have the same ones: character
+    n-grams can't tell "increased" from "decreased".
+    """
+    text = question.lower()
+    for pattern, parts in DATE_PATTERNS:
+        text = pattern.sub(lambda m: "{} {}".format(MONTHS[int(parts(m)[1]) - 1], parts(m)[0]), text)
+    words = [stem(word) for word in re.findall(r"[a-z0-9&%]+", text)]
+
+    tokens = []
+    entities = set()
+    index = 0
+    while index < len(words):
+        value = next(
+            (value for value in vocabulary if tuple(words[index : index + len(value)]) == value),
+            None,
+        )
+        if value is not None:
+            token = "_".join(value)
+            tokens.append(token)
+            entities.add(token)
+            index += len(value)
+            continue
+        word = MONTH_NAMES.get(words[index], words[index])
+        word = DIRECTION_WORDS.get(word, word)
+        if word in MONTHS or word.isdigit() or word in DIRECTION_WORDS.values():
+            entities.add(word)
+        if word not in FILLER_WORDS:
+            tokens.append(word)
+        index += 1
+    return " ".join(tokens), frozenset(entities)
+
+
+def is_follow_up(question):
+    """Whether a question reads as a follow-up to the conversation rather than on its own."""
+    return bool(FOLLOW_UP_PATTERN.search(question.lower().strip()))
+
+
+def ngrams(text):
+    """Counts the character n-grams of the words of a text, padded with spaces."""
+    counts = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            for start in range(max(len(padded) - size + 1, 1)):
+                counts[padded[start : start + size]] += 1
+    return counts
+
+
+def tfidf(counts, idf, default_idf):
+    vector = {gram: count * idf.get(gram, default_idf) for gram, count in counts.items()}
+    norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+    return {gram: weight / norm for gram, weight in vector.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+
+class QuestionIndex:
+    """The normalized questions answered for one version of a dataset."""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        # answer directory name -> (answer, normalized text, entities, n-gram counts)
+        self.entries = {}
+        # n-gram weights, and the weighted n-grams of every entry, recomputed when an entry is added
+        self.idf = None
+        self.default_idf = 1.0
+        self.vectors = {}
+
+    def add(self, name, answer):
+        text, entities = question_terms(answer["question"], self.vocabulary)
+        self.entries[name] = (answer, text, entities, ngrams(text))
+        self.idf = None
+
+    def weights(self):
+        if self.idf is None:
+            documents = Counter()
+            for _, _, _, counts in self.entries.values():
+                documents.update(counts.keys())
+            total = len(self.entries)
+            # smoothed idf, as in scikit-learn
+            self.idf = {
+                gram: math.log((1 + total) / (1 + frequency)) + 1
+                for gram, frequency in documents.items()
+            }
+            self.default_idf = math.log(1 + total) + 1
+            self.vectors = {
+                name: tfidf(counts, self.idf, self.default_idf)
+                for name, (_, _, _, counts) in self.entries.items()
+            }
+        return self.idf, self.default_idf
+
+    def best_match(self, question):
+        """Returns (answer, score) of the closest question about the same entities, or (None, 0)."""
+        text, entities = question_terms(question, self.vocabulary)
+        query = tfidf(ngrams(text), *self.weights())
+        best, best_score = None, 0.0
+        for name, (answer, _, answer_entities, _) in self.entries.items():
+            if answer_entities != entities:
+                continue
+            score = cosine(query, self.vectors[name])
+            if score > best_score:
+                best, best_score = answer, score
+        return best, best_score
+
+
+class QuestionCache:
+    """
+    Serves stored answers for questions asked before, in other words.
+
+    Questions are normalized with the dataset's vocabulary and compared on the
+    TF-IDF weighted character n-grams of their words, locally, against the
+    questions answered for the same version of the dataset. A stored answer is
+    served when its question is about the same months, numbers and dataset
+    values and at least `threshold` similar. Answers are shared with the
+    question prefetcher through the AnswerStore.
+    """
+
+    def __init__(self, store=None, threshold=QUESTION_CACHE_THRESHOLD):
+        self.store = store or AnswerStore()
+        self.threshold = threshold
+        # (data path, digest) -> QuestionIndex
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def index(self, data_path, digest):
+        """
+        Returns the index of the questions answered for a dataset version, with
+        the answers stored since the last lookup. Called with the lock held.
+        """
+        key = (os.path.abspath(data_path), digest)
+        index = self.indexes.get(key)
+        if index is None:
+            # Indexes of the dataset's older versions are not needed again
+            self.indexes = {k: v for k, v in self.indexes.items() if k[0] != key[0]}
+            index = self.indexes[key] = QuestionIndex(dataset_vocabulary(data_path))
+        directory = self.store.version_dir(data_path, digest)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        for name in names:
+            if name not in index.entries and not name.endswith(".tmp"):
+                answer = self.store.load(os.path.join(directory, name))
+                if answer is not None:
+                    index.add(name, answer)
+        return index
+
+    def lookup(self, data_path, question):
+        """Returns the stored answer to the question, or to one close enough to it, or None."""
+        if is_follow_up(question):
+            return None
+        digest = dataset_digest(data_path)
+        with tracing.span("question_cache.lookup", path=data_path) as span:
+            answer = self.store.get(data_path, digest, question)
+            score = 1.0
+            if answer is None:
+                with self.lock:
+                    answer, score = self.index(data_path, digest).best_match(question)
+            span.set(score=score, hit=score >= self.threshold)
+        if answer is None or score < self.threshold:
+            return None
+        return answer
+
+    def add(self, data_path, digest, question, answer, files=()):
+        """
+        Stores the answer to a question that was not answered before, returns
+        None for follow-ups. Callers only add the first question of a
+        conversation, later answers can depend on the earlier turns.
+        """
+        if is_follow_up(question):
+            return None
+        return self.store.put(data_path, digest, question, answer, files)
+
+
+def get_question_cache():
+    """Returns the process-wide question cache, or None if QUESTION_CACHE is "off"."""
+    global _question_cache
+    if os.environ.get("QUESTION_CACHE", "off") == "off":
+        return None
+    with _question_cache_lock:
+        if _question_cache is None:
+            _question_cache = QuestionCache()
+        return _question_cache
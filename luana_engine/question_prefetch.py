@@ -0,0 +1,197 @@
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+
+from .answer_store import AnswerStore, question_key
+from .dataset_cache import dataset_digest
+from . import tracing
+
+# Sample questions shown in the sidebar, answered in the background before they are asked
+SAMPLE_QUESTIONS = {
+    ".data/finance.csv": [
+        "What is the total revenue in September?",
+        "Show me the revenue month over month",
+        "Show me July cost breakdown by category",
+        "Give me a trend on consulting fees",
+        "Show me my P&L month over month",
+        "Show me my profit margin month over month",
+        "Export the data for me",
+    ],
+    ".data/sf_budget.csv": [
+        "show me the total budget year over year",
+        "what contributed to the budget decrease in year 2021?",
+        "give me a budget breakdown in 2021",
+    ],
+}
+# Set to "off" to not answer the sample questions in the background
+PREFETCH_QUESTIONS = os.environ.get("PREFETCH_QUESTIONS", "on")
+# Seconds without an interactive turn before background answering starts or resumes
+PREFETCH_IDLE_SECONDS = float(os.environ.get("PREFETCH_IDLE_SECONDS", 5))
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+class PrefetchJob:
+    def __init__(self, data_path, digest, question):
+        self.data_path = data_path
+        self.digest = digest
+        self.question = question
+        self.agent = None
+        # Set when the job is cancelled, requeue is set too if it should run again later
+        self.cancelled = False
+        self.requeue = False
+
+    @property
+    def key(self):
+        return (os.path.abspath(self.data_path), self.digest, question_key(self.question))
+
+    def cancel(self, requeue=False):
+        self.cancelled = True
+        self.requeue = requeue
+        if self.agent is not None:
+            self.agent.cancel()
+
+
+class QuestionPrefetcher:
+    """
+    Answers the sample questions of the selected dataset in the background.
+
+    Questions run one at a time on a fresh agent, and only while no interactive
+    turn is running: an interactive turn interrupts the running question, which
+    is answered again once the app has been idle for `idle_seconds`. Answers and
+    their files are stored per dataset version in an AnswerStore, and `answer`
+    serves them when the question is asked.
+    """
+
+    def __init__(self, store=None, agent_factory=None, idle_seconds=PREFETCH_IDLE_SECONDS):
+        # Called with the data path of a question, returns the agent that answers it
+        self.store = store or AnswerStore()
+        self.agent_factory = agent_factory
+        self.idle_seconds = idle_seconds
+        self.queue = deque()
+        self.running = None
+        self.interactive_turns = 0
+        self.last_interactive = 0
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def prefetch(self, data_path, questions):
+        """
+        Queues the questions of a dataset that have no stored answer for its
+        current data. Questions queued for other datasets are dropped, the user
+        moved on from them.
+        """
+        digest = dataset_digest(data_path)
+        self.store.prune(data_path, digest)
+        with self.condition:
+            self._cancel(lambda job: job.data_path != data_path or job.digest != digest)
+            pending = {job.key for job in self.queue}
+            if self.running is not None:
+                pending.add(self.running.key)
+            for question in questions:
+                job = PrefetchJob(data_path, digest, question)
+                if job.key not in pending and self.store.get(data_path, digest, question) is None:
+                    self.queue.append(job)
+                    pending.add(job.key)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="question-prefetch", daemon=True)
+                self.worker.start()
+            self.condition.notify_all()
+
+    def answer(self, data_path, question):
+        """Returns the stored answer to a question about the dataset's current data, or None."""
+        return self.store.get(data_path, dataset_digest(data_path), question)
+
+    def cancel(self, data_path=None):
+        """Drops the queued questions and stops the running one, of one dataset or of all."""
+        with self.condition:
+            self._cancel(lambda job: data_path is None or job.data_path == data_path)
+
+    @contextlib.contextmanager
+    def interactive(self):
+        """Marks an interactive turn, background answering pauses until it is over."""
+        with self.condition:
+            self.interactive_turns += 1
+            if self.running is not None:
+                self.running.cancel(requeue=True)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.interactive_turns -= 1
+                self.last_interactive = time.monotonic()
+                self.condition.notify_all()
+
+    def _cancel(self, matches):
+        self.queue = deque(job for job in self.queue if not matches(job))
+        if self.running is not None and matches(self.running):
+            self.running.cancel()
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                idle_for = time.monotonic() - self.last_interactive
+                if self.queue and not self.interactive_turns and idle_for >= self.idle_seconds:
+                    self.running = self.queue.popleft()
+                    return self.running
+                timeout = None
+                if self.queue and not self.interactive_turns:
+                    timeout = self.idle_seconds - idle_for
+                self.condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                self._answer(job)
+            except Exception as e:
+                print(f"Failed to answer {job.question!r} in the background: {e}")
+            finally:
+                with self.condition:
+                    self.running = None
+                    if job.requeue:
+                        self.queue.appendleft(PrefetchJob(job.data_path, job.digest, job.question))
+
+    def _answer(self, job):
+        if self.agent_factory is None:
+            from .interpreter import Interpreter as agent_factory
+        else:
+            agent_factory = self.agent_factory
+
+        # The agent answers about the job's dataset, whichever one the app shows now
+        agent = agent_factory(job.data_path)
+        with self.condition:
+            job.agent = agent
+            if job.cancelled:
+                return
+        try:
+            with tracing.span("prefetch.question", question=job.question) as span:
+                messages, files = agent.chat(job.question, return_messages=True)
+                span.set(cancelled=job.cancelled)
+            if not job.cancelled and dataset_digest(job.data_path) == job.digest:
+                self.store.put(
+                    job.data_path,
+                    job.digest,
+                    job.question,
+                    messages[-1]["content"],
+                    files,
+                    source="prefetch",
+                )
+        finally:
+            if hasattr(agent, "reset"):
+                # Frees the agent's kernels
+                agent.reset()
+
+
+def get_question_prefetcher():
+    """Returns the process-wide prefetcher, or None if PREFETCH_QUESTIONS is "off"."""
+    global _prefetcher
+    if PREFETCH_QUESTIONS == "off":
+        return None
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = QuestionPrefetcher()
+        return _prefetcher
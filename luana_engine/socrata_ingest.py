@@ -0,0 +1,212 @@
+import csv
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from . import tracing
+
+# Rows requested per page, Socrata serves up to 50000
+PAGE_SIZE = int(os.environ.get("SOCRATA_PAGE_SIZE", 5000))
+
+# How often datasets synced in the background are refreshed, in seconds
+SOCRATA_REFRESH_INTERVAL = float(os.environ.get("SOCRATA_REFRESH_INTERVAL", 3600))
+
+# System fields kept in the parts to merge refreshed rows, left out of the dataset
+ID_FIELD = ":id"
+UPDATED_FIELD = ":updated_at"
+
+# target path -> thread keeping it synced
+_syncs = {}
+_syncs_lock = threading.Lock()
+
+
+def parts_dir(target):
+    """Returns the directory holding the downloaded pages of a dataset."""
+    return os.path.splitext(target)[0] + ".parts"
+
+
+def part_path(target, index):
+    return os.path.join(parts_dir(target), f"part-{index:05d}.csv")
+
+
+def read_state(target):
+    try:
+        with open(os.path.join(parts_dir(target), "state.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_state(target, state):
+    path = os.path.join(parts_dir(target), "state.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def write_part(path, records):
+    # Socrata leaves null fields out of a record, so pages can have different columns
+    tmp_path = path + ".tmp"
+    pd.DataFrame.from_records(records).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def soql_timestamp(value):
+    # :updated_at is returned with a Z suffix, SoQL compares floating timestamps
+    return value.rstrip("Z")
+
+
+def fetch_pages(client, dataset_id, target, state, key, where=None):
+    """
+    Fetches the pages of a query ordered by :id into part files, from the offset
+    stored under state[key]. The state is saved after every page, so an
+    interrupted download resumes with the next page.
+    """
+    page_size = state["page_size"]
+    while True:
+        offset = state[key]
+        with tracing.span("socrata.page", dataset=dataset_id, offset=offset) as span:
+            records = client.get(
+                dataset_id,
+                where=where,
+                order=ID_FIELD,
+                limit=page_size,
+                offset=offset,
+                exclude_system_fields="false",
+            )
+            span.set(rows=len(records))
+        if records:
+            write_part(part_path(target, state["parts"]), records)
+            state["parts"] += 1
+            state[key] = offset + len(records)
+            latest = max(record.get(UPDATED_FIELD, "") for record in records)
+            state["pending_updated_at"] = max(state.get("pending_updated_at") or "", latest)
+        if len(records) < page_size:
+            write_state(target, state)
+            return
+        write_state(target, state)
+
+
+def drop_replaced_rows(target, state):
+    """Removes the older versions of rows fetched by a refresh from the earlier parts."""
+    refreshed_ids = set()
+    for index in range(state["refresh_first_part"], state["parts"]):
+        with open(part_path(target, index), newline="") as f:
+            refreshed_ids.update(row.get(ID_FIELD) for row in csv.DictReader(f))
+    refreshed_ids.discard(None)
+    if not refreshed_ids:
+        return
+    for index in range(state["refresh_first_part"]):
+        path = part_path(target, index)
+        part = pd.read_csv(path, dtype=str, keep_default_na=False)
+        if ID_FIELD not in part.columns:
+            continue
+        replaced = part[ID_FIELD].isin(refreshed_ids)
+        if replaced.any():
+            part[~replaced].to_csv(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+
+
+def assemble(target, state):
+    """
+    Writes the parts into the dataset file one at a time, with the union of
+    their columns and without the system fields.
+    """
+    paths = [part_path(target, index) for index in range(state["parts"])]
+    columns = []
+    for path in paths:
+        with open(path, newline="") as f:
+            header = next(csv.reader(f), [])
+        columns.extend(column for column in header if column not in columns)
+    columns = [column for column in columns if not column.startswith(":")]
+
+    tmp_path = target + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        if columns:
+            csv.writer(f).writerow(columns)
+        for path in paths:
+            part = pd.read_csv(path, dtype=str, keep_default_na=False)
+            part.reindex(columns=columns, fill_value="").to_csv(f, header=False, index=False)
+    os.replace(tmp_path, target)
+
+
+def sync_dataset(client, dataset_id, target, page_size=PAGE_SIZE):
+    """
+    Downloads a Socrata dataset into `target` page by page, or refreshes it.
+
+    The first run pages through the whole dataset ordered by :id. Every page is
+    written to its own part file under `<target>.parts` as it arrives, so memory
+    is bounded by one page and an interrupted run resumes from the last stored
+    page. Later runs only fetch the rows whose :updated_at is newer than the
+    newest one stored and replace their earlier versions. Rows deleted at the
+    source are not noticed by a refresh, remove the parts directory to download
+    everything again.
+
+    Returns the number of rows fetched.
+    """
+    os.makedirs(parts_dir(target), exist_ok=True)
+    state = read_state(target)
+    if state is None or state.get("dataset") != dataset_id:
+        state = {
+            "dataset": dataset_id,
+            "page_size": page_size,
+            "parts": 0,
+            "offset": 0,
+            "complete": False,
+            "updated_at": None,
+        }
+
+    with tracing.span("socrata.sync", dataset=dataset_id) as span:
+        if not state["complete"]:
+            fetch_pages(client, dataset_id, target, state, "offset")
+            state["complete"] = True
+            fetched = state["offset"]
+        else:
+            if "refresh_offset" not in state:
+                state["refresh_offset"] = 0
+                state["refresh_first_part"] = state["parts"]
+            where = None
+            if state["updated_at"]:
+                where = f"{UPDATED_FIELD} > '{soql_timestamp(state['updated_at'])}'"
+            fetch_pages(client, dataset_id, target, state, "refresh_offset", where)
+            drop_replaced_rows(target, state)
+            fetched = state.pop("refresh_offset")
+            state.pop("refresh_first_part")
+
+        state["updated_at"] = max(
+            state["updated_at"] or "", state.pop("pending_updated_at", None) or ""
+        ) or None
+        if fetched or not os.path.exists(target):
+            assemble(target, state)
+        write_state(target, state)
+        span.set(rows=fetched)
+    return fetched
+
+
+def sync_in_background(client_factory, dataset_id, target, interval=SOCRATA_REFRESH_INTERVAL):
+    """
+    Keeps a Socrata dataset synced into `target` on a background thread,
+    refreshed every `interval` seconds, and returns the thread. The dataset is
+    synced by one thread per process, later calls return it.
+    """
+    key = os.path.abspath(target)
+    with _syncs_lock:
+        thread = _syncs.get(key)
+        if thread is not None:
+            return thread
+
+        def loop():
+            while True:
+                try:
+                    sync_dataset(client_factory(), dataset_id, target)
+                except Exception as e:
+                    # keep serving the data downloaded so far, the next run resumes from there
+                    print(f"Failed to sync {dataset_id} into {target}: {e}")
+                time.sleep(interval)
+
+        thread = _syncs[key] = threading.Thread(target=loop, name="socrata-sync", daemon=True)
+        thread.start()
+        return thread
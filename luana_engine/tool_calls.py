@@ -0,0 +1,224 @@
+import ast
+import builtins
+import copy
+import types
+
+from .python_interpreter import PythonInterpreter
+
+# Languages whose calls can run next to each other on sibling kernels
+PARALLEL_LANGUAGES = {"python"}
+# Calls that change the state of the whole process or namespace, cells making them run alone
+BARRIER_CALLS = {
+    "os.chdir",
+    "os.putenv",
+    "os.unsetenv",
+    "os.environ.update",
+    "os.environ.pop",
+    "sys.path.append",
+    "sys.path.insert",
+    "exec",
+    "eval",
+    "globals",
+    "setattr",
+    "delattr",
+}
+
+
+def function_calls(message):
+    """
+    Returns the calls of an assistant message: the entries of `tool_calls`, or
+    its legacy `function_call`.
+    """
+    if message.get("tool_calls"):
+        return [tool_call["function"] for tool_call in message["tool_calls"]]
+    if message.get("function_call"):
+        return [message["function_call"]]
+    return []
+
+
+def merge_tool_call_deltas(tool_calls, deltas, parsers, make_parser):
+    """
+    Merges the streamed `tool_calls` deltas into the list of tool calls. Each
+    delta carries the index of its call, its arguments go to that call's parser.
+    """
+    for delta in deltas:
+        index = delta["index"]
+        while len(tool_calls) <= index:
+            tool_calls.append(
+                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}}
+            )
+            parsers.append(make_parser())
+        tool_call = tool_calls[index]
+        if delta.get("id"):
+            tool_call["id"] = delta["id"]
+        function = delta.get("function") or {}
+        if function.get("name"):
+            tool_call["function"]["name"] = function["name"]
+        if function.get("arguments"):
+            parsed_arguments = parsers[index].feed(function["arguments"])
+            tool_call["function"]["arguments"] = parsers[index].text
+            if parsed_arguments:
+                tool_call["function"]["parsed_arguments"] = parsed_arguments
+
+
+def dotted_name(node):
+    """Returns e.g. "os.path.join" for an attribute chain on a name, None for other expressions."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def root_name(node):
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def code_names(code, immutable=()):
+    """
+    Returns (reads, writes): the names a Python cell reads, and the names it
+    assigns, imports, deletes or modifies attributes or items of. A method call
+    like df.dropna(inplace=True) or totals.append(1) may modify its object, it
+    counts as a write of the root name unless the name is in `immutable`, e.g.
+    modules, or imported by the cell. None if the cell can't be parsed or makes
+    a call in BARRIER_CALLS.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    reads = set()
+    writes = set()
+    imported = set()
+    called = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                reads.add(node.id)
+            else:
+                writes.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            writes.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                imported.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, (ast.Attribute, ast.Subscript)) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            # df.x = ... or del df["x"] modifies the object, count it as a write of its root name
+            name = root_name(node.value)
+            if name is not None:
+                writes.add(name)
+        elif isinstance(node, ast.Call):
+            if dotted_name(node.func) in BARRIER_CALLS:
+                return None
+            if isinstance(node.func, ast.Attribute):
+                name = root_name(node.func.value)
+                if name is not None:
+                    called.add(name)
+    writes |= imported
+    writes |= called - imported - set(immutable)
+    reads -= set(dir(builtins))
+    return reads, writes
+
+
+def plan_waves(calls, immutable=()):
+    """
+    Groups the (language, code) calls of one assistant turn into waves that run
+    one after the other. The calls of a wave run concurrently: they are Python
+    cells next to each other in the turn that don't read or write what another
+    cell of the wave writes. Other calls get a wave of their own. Method calls
+    on the `immutable` names don't count as writes, see code_names.
+    """
+    waves = []
+    # names (reads, writes) of the calls of each wave, None for a wave that runs alone
+    wave_names = []
+    for index, (language, code) in enumerate(calls):
+        names = code_names(code, immutable) if language in PARALLEL_LANGUAGES else None
+        if (
+            names is not None
+            and wave_names
+            and wave_names[-1] is not None
+            and all(
+                not (names[1] & (reads | writes)) and not (names[0] & writes)
+                for reads, writes in wave_names[-1]
+            )
+        ):
+            waves[-1].append(index)
+            wave_names[-1].append(names)
+        else:
+            waves.append([index])
+            wave_names.append([names] if names is not None else None)
+    return waves
+
+
+def user_variables(kernel):
+    """
+    Returns the variables defined in a Python kernel, without IPython's
+    bookkeeping and the dataset variables every kernel binds itself.
+    """
+    hidden = kernel.shell.user_ns_hidden
+    return {
+        name: value
+        for name, value in kernel.shell.user_ns.items()
+        if not name.startswith("_") and name not in hidden and name not in kernel.preloaded
+    }
+
+
+def immutable_names(kernel):
+    """
+    Returns the names of a Python kernel whose method calls don't modify shared
+    state: modules, functions and classes, and the dataset variables, which every
+    kernel binds to its own copy.
+    """
+    if not isinstance(kernel, PythonInterpreter):
+        return set()
+    names = set(kernel.preloaded)
+    for name, value in kernel.shell.user_ns.items():
+        if isinstance(value, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)):
+            names.add(name)
+    return names
+
+
+def share_variables(source, target, names=None):
+    """
+    Binds the variables of one Python kernel in another, by reference, so a
+    sibling kernel starts from the session kernel's state and the session kernel
+    gets what the sibling assigned. Variables the source doesn't have, e.g. that
+    were deleted, are removed from the target.
+    """
+    if not (isinstance(source, PythonInterpreter) and isinstance(target, PythonInterpreter)):
+        return
+    variables = user_variables(source)
+    if names is None:
+        names = set(variables) | set(user_variables(target))
+    for name in names:
+        if name in variables:
+            target.shell.user_ns[name] = variables[name]
+        elif name not in target.preloaded:
+            target.shell.user_ns.pop(name, None)
+
+
+def copy_variables(source, target):
+    """
+    Binds copies of the variables of one Python kernel in another, so the target
+    continues from the source's state without sharing it. Modules, functions and
+    classes are bound as they are; values that can't be copied are left out.
+    Returns the names left out.
+    """
+    if not (isinstance(source, PythonInterpreter) and isinstance(target, PythonInterpreter)):
+        return []
+    skipped = []
+    for name, value in user_variables(source).items():
+        if isinstance(value, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)):
+            target.shell.user_ns[name] = value
+            continue
+        try:
+            target.shell.user_ns[name] = copy.deepcopy(value)
+        except Exception:
+            skipped.append(name)
+    return skipped
@@ -0,0 +1,160 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Turn on with TRACING=1 or tracing.enable() at runtime
+_enabled = os.environ.get("TRACING", "").lower() in ("1", "true", "yes")
+_spans = deque(maxlen=int(os.environ.get("TRACING_MAX_SPANS", 100000)))
+_current_span = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+
+# Converts perf_counter readings to wall clock microseconds for the exported traces
+_epoch_offset = time.time() - time.perf_counter()
+
+
+class Span:
+    """
+    A timed stage of the agent pipeline, nested under the span that was active
+    when it started (also across asyncio tasks and asyncio.to_thread).
+    """
+
+    __slots__ = ("id", "name", "attributes", "parent_id", "thread_id", "start", "end", "_token")
+
+    def __init__(self, name, attributes):
+        self.id = next(_ids)
+        self.name = name
+        self.attributes = attributes
+        self.parent_id = None
+        self.thread_id = None
+        self.start = None
+        self.end = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.id if parent else None
+        self.thread_id = threading.get_ident()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        _spans.append(self)
+        return False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": _epoch_offset + self.start,
+            "duration": self.duration,
+            "thread_id": self.thread_id,
+            "attributes": self.attributes,
+        }
+
+
+class NoopSpan:
+    """Returned while tracing is off, so instrumented code costs one function call."""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_noop_span = NoopSpan()
+
+
+def span(name, **attributes):
+    """
+    Starts a span to be used as a context manager:
+
+        with tracing.span("code.run", language=language) as s:
+            output = run(code)
+            s.set(output_bytes=len(output))
+    """
+    if not _enabled:
+        return _noop_span
+    return Span(name, attributes)
+
+
+def annotate(**attributes):
+    """Adds attributes to the innermost active span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    _spans.clear()
+
+
+def spans():
+    """Returns the finished spans, oldest first."""
+    return list(_spans)
+
+
+def chrome_trace():
+    """Returns the finished spans in the Chrome trace event format (chrome://tracing, Perfetto)."""
+    pid = os.getpid()
+    events = []
+    for finished in spans():
+        events.append(
+            {
+                "name": finished.name,
+                "cat": "luana",
+                "ph": "X",
+                "ts": (_epoch_offset + finished.start) * 1e6,
+                "dur": finished.duration * 1e6,
+                "pid": pid,
+                "tid": finished.thread_id,
+                "args": dict(finished.attributes, span_id=finished.id, parent_id=finished.parent_id),
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(path):
+    with open(path, "w") as f:
+        json.dump(chrome_trace(), f, default=str)
+
+
+def export_jsonl(path):
+    """Writes one JSON object per finished span."""
+    with open(path, "w") as f:
+        for finished in spans():
+            f.write(json.dumps(finished.to_dict(), default=str) + "\n")
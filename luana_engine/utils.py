@@ -1,9 +1,13 @@
 import json
+import re
 import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join, dirname
-import openai
-from .prompts.output_file_check import output_file_check_prompt
 import streamlit as st
+from . import tracing
+from .figure_cache import get_figure_cache, load_figure, load_image, load_table
 
 
 def load_dotenv():
@@ -23,6 +27,29 @@ def load_dotenv():
         print("WARNING: .env file not found")
 
 
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code and returns its result.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # Already inside an event loop (e.g. a notebook), run it on a separate thread
+    # that keeps the Streamlit session, so st.* calls still render
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run).result()
+
+
 def merge_deltas(original, delta):
     """
     Pushes the delta into the original and returns that.
@@ -101,56 +128,309 @@ def parse_partial_json(s):
         return None
 
 
-def get_file_modifications(code: str, retry: int = 2):
-    if retry < 1:
-        return None
+_JSON_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+_STRING_SPECIAL_CHARS = re.compile(r'["\\]')
 
-    prompt = output_file_check_prompt.format(code=code)
-    messages = [{"role": "user", "content": prompt}]
-    print(messages)
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=messages,
-        stream=False,
-        temperature=0.03,
-    )
 
-    try:
-        result = json.loads(response["choices"][0]["message"]["content"])
-    except json.JSONDecodeError:
-        result = ""
-    if not result or not isinstance(result, dict) or "modifications" not in result:
-        return get_file_modifications(code, llm, retry=retry - 1)
-    return result["modifications"]
+class PartialJSONParser:
+    """
+    Incrementally decodes a streamed JSON object, e.g. function call arguments.
+
+    Unlike `parse_partial_json`, which re-scans the whole accumulated string,
+    `feed` only looks at the new chunk. The bracket, string and escape state is
+    kept between chunks, and the top-level string values (`language`, `code`)
+    are decoded as they arrive, so reading them never re-parses the input.
+    Raw newlines inside strings are tolerated, like `parse_partial_json` does.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._text = ""
+        self.malformed = False
+        self.complete = False
+
+        # Bracket / string / escape state
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self._unicode_digits = None
+        self._high_surrogate = None
+
+        # Top-level object state: "start", "key", "colon", "value", "scalar", "raw" or "comma"
+        self._state = "start"
+        self._key = None
+        self._key_parts = []
+        self._field_parts = {}
+        self._field_cache = {}
+        self._raw_parts = []
+        self.fields = {}
+
+    @property
+    def text(self):
+        """The raw arguments string received so far."""
+        if len(self._chunks) > 1 or (self._chunks and not self._text):
+            self._text = "".join(self._chunks)
+            self._chunks = [self._text]
+        return self._text
+
+    @property
+    def value(self):
+        """
+        The partially decoded object, or None if the input is not a JSON object.
+        """
+        if self.malformed or self._state == "start":
+            return None
+        for key, parts in self._field_parts.items():
+            cached = self._field_cache.get(key)
+            if cached is None or cached[0] != len(parts):
+                cached = self._field_cache[key] = (len(parts), "".join(parts))
+            self.fields[key] = cached[1]
+        return dict(self.fields)
+
+    def get(self, key, default=None):
+        value = self.value
+        if value is None:
+            return default
+        return value.get(key, default)
+
+    def feed(self, chunk):
+        """
+        Consumes the next chunk of the JSON text and returns the decoded value.
+        """
+        if not chunk:
+            return self.value
+        self._chunks.append(chunk)
+        if self.malformed:
+            return None
+
+        i = 0
+        n = len(chunk)
+        while i < n and not self.malformed:
+            if self.in_string:
+                i = self._consume_string(chunk, i, n)
+            else:
+                self._consume_structural(chunk[i])
+                i += 1
+        return self.value
+
+    def _decoding(self):
+        # Only top-level keys and string values are decoded, nested values are kept raw
+        return self._state in ("key", "value")
+
+    def _emit(self, text):
+        if self._state == "key":
+            self._key_parts.append(text)
+        else:
+            self._field_parts[self._key].append(text)
+
+    def _consume_string(self, chunk, i, n):
+        if not self._decoding():
+            return self._consume_raw_string(chunk, i, n)
+
+        if self._unicode_digits is not None:
+            take = min(4 - len(self._unicode_digits), n - i)
+            self._unicode_digits += chunk[i : i + take]
+            if len(self._unicode_digits) == 4:
+                self._emit_unicode(self._unicode_digits)
+                self._unicode_digits = None
+            return i + take
+
+        if self.escaped:
+            self.escaped = False
+            char = chunk[i]
+            if char == "u":
+                self._unicode_digits = ""
+            else:
+                self._flush_surrogate()
+                self._emit(_JSON_ESCAPES.get(char, char))
+            return i + 1
+
+        match = _STRING_SPECIAL_CHARS.search(chunk, i)
+        end = match.start() if match else n
+        if end > i:
+            self._flush_surrogate()
+            self._emit(chunk[i:end])
+        if not match:
+            return n
 
+        if match.group() == "\\":
+            self.escaped = True
+        else:
+            self._flush_surrogate()
+            self._close_string()
+        return end + 1
+
+    def _consume_raw_string(self, chunk, i, n):
+        if self.escaped:
+            self.escaped = False
+            self._raw_parts.append(chunk[i])
+            return i + 1
+
+        match = _STRING_SPECIAL_CHARS.search(chunk, i)
+        end = match.end() if match else n
+        self._raw_parts.append(chunk[i:end])
+        if match:
+            if match.group() == "\\":
+                self.escaped = True
+            else:
+                self.in_string = False
+        return end
+
+    def _emit_unicode(self, digits):
+        try:
+            code_point = int(digits, 16)
+        except ValueError:
+            self.malformed = True
+            return
+        if 0xD800 <= code_point <= 0xDBFF:
+            self._flush_surrogate()
+            self._high_surrogate = code_point
+        elif 0xDC00 <= code_point <= 0xDFFF and self._high_surrogate is not None:
+            high = self._high_surrogate
+            self._high_surrogate = None
+            self._emit(chr(0x10000 + ((high - 0xD800) << 10) + (code_point - 0xDC00)))
+        else:
+            self._flush_surrogate()
+            self._emit(chr(code_point))
+
+    def _flush_surrogate(self):
+        # A lone high surrogate, keep it as is like json.loads does
+        if self._high_surrogate is not None:
+            self._emit(chr(self._high_surrogate))
+            self._high_surrogate = None
+
+    def _close_string(self):
+        self.in_string = False
+        if self._state == "key":
+            self._key = "".join(self._key_parts)
+            self._key_parts = []
+            self._state = "colon"
+        else:
+            self._state = "comma"
+
+    def _finish_raw_value(self):
+        raw = "".join(self._raw_parts)
+        self._raw_parts = []
+        try:
+            self.fields[self._key] = json.loads(raw)
+        except json.JSONDecodeError:
+            self.malformed = True
+        self._state = "comma"
+
+    def _consume_structural(self, char):
+        state = self._state
+
+        if state == "raw":
+            self._raw_parts.append(char)
+            if char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.stack.append("}")
+            elif char == "[":
+                self.stack.append("]")
+            elif char == "}" or char == "]":
+                if not self.stack or self.stack[-1] != char:
+                    # Mismatched closing character; the input is malformed.
+                    self.malformed = True
+                    return
+                self.stack.pop()
+                if len(self.stack) == 1:
+                    self._finish_raw_value()
+            return
+
+        if state == "scalar":
+            if char in ",}" or char.isspace():
+                self._finish_raw_value()
+                if not self.malformed and not char.isspace():
+                    self._consume_structural(char)
+            else:
+                self._raw_parts.append(char)
+            return
+
+        if char.isspace():
+            return
+
+        if state == "start":
+            if char == "{":
+                self.stack.append("}")
+                self._state = "key"
+            else:
+                self.malformed = True
+        elif self.complete:
+            # Trailing data after the object was closed
+            self.malformed = True
+        elif state == "key":
+            if char == '"':
+                self.in_string = True
+            elif char == "}" and not self.fields and not self._field_parts:
+                self._close_object()
+            else:
+                self.malformed = True
+        elif state == "colon":
+            if char == ":":
+                self._state = "value"
+            else:
+                self.malformed = True
+        elif state == "value":
+            self.fields.pop(self._key, None)
+            self._field_parts.pop(self._key, None)
+            self._field_cache.pop(self._key, None)
+            if char == '"':
+                self._field_parts[self._key] = []
+                self.in_string = True
+            elif char == "{" or char == "[":
+                self.stack.append("}" if char == "{" else "]")
+                self._raw_parts = [char]
+                self._state = "raw"
+            else:
+                self._raw_parts = [char]
+                self._state = "scalar"
+        elif state == "comma":
+            if char == ",":
+                self._state = "key"
+            elif char == "}":
+                self._close_object()
+            else:
+                self.malformed = True
 
-@st.cache_data
-def convert_df(df):
-    return df.to_csv(index=False).encode("utf-8")
+    def _close_object(self):
+        self.stack.pop()
+        self.complete = True
+        self._state = "comma"
 
 
 def plot_files(file, component=None):
+    """
+    Shows an output file in the app. Parsed files come from the shared figure
+    cache, so reruns don't read them again unless they changed.
+    """
+    cache = get_figure_cache()
+    with tracing.span("plot_files", file=file):
         if file.endswith(".png") or file.endswith(".jpg") or file.endswith(".jpeg"):
-            image = Image.open(file)
+            image = cache.get(file, load_image)
             if component:
                 component.image(image)
             else:
                 st.image(image)
         elif file.endswith(".json"):
-            import plotly
-
-            fig = plotly.io.read_json(file)
+            fig = cache.get(file, load_figure)
             if component:
                 component.plotly_chart(fig, use_container_width=True)
             else:
                 st.plotly_chart(fig, use_container_width=True)
         elif file.endswith(".csv"):
-            import pandas as pd
-
-            df = pd.read_csv(file)
+            df, csv = cache.get(file, load_table)
             # show dataframe
             st.dataframe(df, use_container_width=True)
-            csv = convert_df(df)
             # strip directy path from file name
             file_name = file.split("/")[-1]
             st.download_button(
@@ -0,0 +1,17 @@
+import pytest
+
+from luana_engine import file_tracker
+
+
+@pytest.fixture(scope="session", autouse=True)
+def session_output_root(tmp_path_factory):
+    """Also covers the kernels the pools warm up in the background after a test ended."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(file_tracker, "OUTPUT_ROOT", str(tmp_path_factory.mktemp("output_root")))
+        yield
+
+
+@pytest.fixture(autouse=True)
+def output_root(tmp_path, monkeypatch):
+    """Kernels write their output directories under the test's tmp_path, not the working tree."""
+    monkeypatch.setattr(file_tracker, "OUTPUT_ROOT", str(tmp_path / "output_root"))
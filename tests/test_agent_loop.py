@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+import openai
+
+from luana_engine import interpreter
+
+
+def stream(deltas, finish_reason):
+    async def chunks():
+        for delta in deltas:
+            yield {"choices": [{"delta": delta, "finish_reason": None}]}
+        yield {"choices": [{"delta": {}, "finish_reason": finish_reason}]}
+
+    return chunks()
+
+
+def function_call(code):
+    arguments = json.dumps({"language": "python", "code": code})
+    return stream(
+        [{"role": "assistant", "content": None, "function_call": {"name": "run_code"}}]
+        + [
+            {"function_call": {"arguments": arguments[i : i + 5]}}
+            for i in range(0, len(arguments), 5)
+        ],
+        "function_call",
+    )
+
+
+def answer(text):
+    return stream([{"role": "assistant", "content": text}], "stop")
+
+
+def fake_openai(monkeypatch, responses):
+    requests = []
+
+    async def acreate(**kwargs):
+        requests.append(kwargs)
+        return responses.pop(0)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    return requests
+
+
+def test_chat_runs_function_calls_until_answer(monkeypatch):
+    requests = fake_openai(
+        monkeypatch,
+        [function_call("print(len(DATA), 6 * 7)"), answer("The answer is 42.")],
+    )
+    agent = interpreter.Interpreter()
+
+    messages, files = agent.chat("What is 6 * 7?", return_messages=True)
+
+    assert messages[-1]["content"] == "The answer is 42."
+    assert messages[1]["function_call"]["parsed_arguments"]["code"] == (
+        "print(len(DATA), 6 * 7)"
+    )
+    assert messages[2]["role"] == "function"
+    assert "700 42" in messages[2]["content"]
+    assert files == []
+    assert len(requests) == 2
+
+
+def test_achat_can_be_awaited(monkeypatch):
+    fake_openai(monkeypatch, [answer("Hello!")])
+    agent = interpreter.Interpreter()
+
+    messages, _ = asyncio.run(agent.achat("Hi", return_messages=True))
+
+    assert messages[-1]["content"] == "Hello!"
+
+
+def test_chat_stops_at_step_budget(monkeypatch):
+    requests = fake_openai(monkeypatch, [function_call("x = 1") for _ in range(5)])
+    agent = interpreter.Interpreter()
+    agent.max_steps = 3
+
+    messages, _ = agent.chat("Loop forever", return_messages=True)
+
+    assert len(requests) == 3
+    assert len(agent.step_timings) == 3
+    assert "execution_seconds" in agent.step_timings[-1]
+    assert messages[-1]["role"] == "assistant"
+    assert "3 steps" in messages[-1]["content"]
+
+
+def test_chat_streams_code_output_when_thinking(monkeypatch):
+    fake_openai(
+        monkeypatch,
+        [function_call("for i in range(3):\n    print(i)"), answer("Done.")],
+    )
+    agent = interpreter.Interpreter()
+
+    messages, _ = agent.chat("Count", return_messages=True, show_thinking=True)
+
+    assert "0\n1\n2" in messages[2]["content"]
+    assert messages[-1]["content"] == "Done."
+
+
+def test_fork_continues_from_a_copy_of_the_kernel_state(monkeypatch):
+    fake_openai(monkeypatch, [function_call("totals = [1, 2]"), answer("Stored the totals.")])
+    agent = interpreter.Interpreter()
+    agent.chat("Store the totals")
+
+    forked = agent.fork()
+    kernel, _ = forked.get_code_interpreter("python")
+    kernel.run("totals.append(3)")
+    forked.release_code_interpreter("python")
+
+    assert "[1, 2, 3]" in kernel.run("print(totals)")
+    parent, _ = agent.get_code_interpreter("python")
+    assert "[1, 2]" in parent.run("print(totals)")
+    agent.release_code_interpreter("python")
+    assert len(forked.messages) == len(agent.messages)
+
+
+def broken_stream(text):
+    async def chunks():
+        yield {"choices": [{"delta": {"role": "assistant", "content": text}, "finish_reason": None}]}
+
+    return chunks()
+
+
+def test_stream_without_finish_reason_is_asked_again(monkeypatch):
+    requests = fake_openai(monkeypatch, [broken_stream("The ans"), answer("The answer is 42.")])
+    agent = interpreter.Interpreter()
+
+    messages, _ = agent.chat("What is 6 * 7?", return_messages=True)
+
+    assert [message["role"] for message in messages] == ["user", "assistant"]
+    assert messages[-1]["content"] == "The answer is 42."
+    assert agent.answered
+    assert len(requests) == 2
+
+    fake_openai(monkeypatch, [broken_stream("The") for _ in range(3)])
+    messages, _ = agent.chat("And 6 * 8?", return_messages=True)
+
+    assert [message["role"] for message in messages] == ["user", "assistant", "user", "assistant"]
+    assert "could not get a complete response" in messages[-1]["content"]
+    assert not agent.answered
@@ -0,0 +1,69 @@
+import os
+import threading
+
+from luana_engine.code_interpreter import CodeInterpreter
+from luana_engine.pipe_multiplexer import OutputBuffer, PipeMultiplexer
+
+
+def test_output_buffer_keeps_the_tail():
+    buffer = OutputBuffer(max_chars=10)
+    for i in range(100):
+        buffer.append(str(i))
+
+    text = buffer.text()
+    assert text.startswith("Output truncated. Showing the last 10 characters.")
+    assert text.endswith("98\n99")
+
+
+def test_multiplexer_splits_lines_and_reports_eof():
+    read_fd, write_fd = os.pipe()
+    lines = []
+    closed = threading.Event()
+
+    def on_line(line):
+        if line is None:
+            closed.set()
+        else:
+            lines.append(line)
+
+    with os.fdopen(read_fd, "rb", buffering=0) as stream:
+        PipeMultiplexer().register(stream, on_line)
+        os.write(write_fd, "first\nsec".encode())
+        os.write(write_fd, "ond\nlast é".encode())
+        os.close(write_fd)
+        assert closed.wait(5)
+
+    assert lines == ["first", "second", "last é"]
+
+
+def test_shell_run_collects_both_streams():
+    interpreter = CodeInterpreter("shell", False)
+
+    # A line looking like the old fixed sentinel does not end the run
+    output = interpreter.run("echo END_OF_EXECUTION\necho out\necho err >&2")
+    assert output.split("\n") == ["END_OF_EXECUTION", "out", "err"]
+    assert interpreter.run("echo again") == "again"
+    interpreter.close()
+
+
+def test_python_subprocess_restarts_after_exit():
+    interpreter = CodeInterpreter("python", False)
+
+    assert "ZeroDivisionError" in interpreter.run("1 / 0")
+    interpreter.run("import sys\nsys.exit(0)")
+    assert interpreter.run("print(6 * 7)") == "42"
+    interpreter.close()
+
+
+def test_shell_run_streams_lines():
+    interpreter = CodeInterpreter("shell", False)
+    events = []
+
+    output = interpreter.run(
+        "echo out; echo err >&2", on_output=lambda kind, value: events.append((kind, value))
+    )
+
+    assert output.split("\n") == ["out", "err"]
+    assert ("stdout", "out") in events
+    assert ("stderr", "err") in events
+    interpreter.close()
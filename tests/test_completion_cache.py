@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+import pytest
+
+from luana_engine import interpreter
+from luana_engine.completion_cache import CompletionCache, CompletionCacheMiss
+
+from .test_agent_loop import answer, fake_openai
+
+request = {
+    "model": "gpt-4",
+    "messages": [{"role": "user", "content": "Hi "}],
+    "functions": [],
+    "temperature": 0.001,
+}
+chunks = [
+    {"delta": {"role": "assistant", "content": "Hel"}, "finish_reason": None},
+    {"delta": {"content": "lo"}, "finish_reason": "stop"},
+]
+
+
+def test_completion_cache_key_ignores_bookkeeping_fields(tmp_path):
+    cache = CompletionCache(str(tmp_path))
+    call = {"name": "run_code", "arguments": "{}"}
+    with_parsed = dict(
+        request,
+        messages=[{"role": "assistant", "function_call": dict(call, parsed_arguments={})}],
+    )
+    without_parsed = dict(
+        request, messages=[{"role": "assistant", "content": None, "function_call": call}]
+    )
+
+    assert cache.key(with_parsed) == cache.key(without_parsed)
+    assert cache.key(request, dataset="a") != cache.key(request, dataset="b")
+
+
+def test_completion_cache_persists_and_expires(tmp_path):
+    cache = CompletionCache(str(tmp_path), ttl=60)
+    key = cache.key(request)
+    cache.put(key, chunks)
+
+    # A new cache instance reads it back from disk
+    assert CompletionCache(str(tmp_path)).get(key) == chunks
+
+    assert CompletionCache(str(tmp_path), ttl=-1).get(key) is None
+    assert not os.path.exists(cache.path(key))
+
+
+def test_completion_cache_evicts_oldest_when_over_size(tmp_path):
+    cache = CompletionCache(str(tmp_path), memory_entries=1, max_bytes=1)
+    cache.put("old", chunks)
+    cache.put("new", chunks)
+
+    assert not os.path.exists(cache.path("old"))
+    assert cache.get("old") is None
+
+
+def test_completion_cache_replays_as_stream(tmp_path):
+    cache = CompletionCache(str(tmp_path))
+
+    async def collect():
+        return [chunk async for chunk in cache.replay(chunks)]
+
+    replayed = asyncio.run(collect())
+    assert [chunk["choices"][0]["delta"] for chunk in replayed] == [
+        chunk["delta"] for chunk in chunks
+    ]
+    assert replayed[-1]["choices"][0]["finish_reason"] == "stop"
+
+
+def test_interpreter_reuses_cached_completions(tmp_path, monkeypatch):
+    cache = CompletionCache(str(tmp_path))
+    monkeypatch.setattr(interpreter, "get_completion_cache", lambda: cache)
+    requests = fake_openai(monkeypatch, [answer("Hello!")])
+
+    first, _ = interpreter.Interpreter().chat("Hi", return_messages=True)
+    second, _ = interpreter.Interpreter().chat("Hi", return_messages=True)
+
+    assert first[-1]["content"] == second[-1]["content"] == "Hello!"
+    assert len(requests) == 1
+
+    cache.mode = "replay"
+    with pytest.raises(CompletionCacheMiss):
+        interpreter.Interpreter().chat("Something new")
@@ -0,0 +1,138 @@
+import sys
+import types
+
+from luana_engine import conversation_context
+from luana_engine.conversation_context import (
+    ConversationContext,
+    compact_output,
+    count_tokens,
+    summarize_functions,
+)
+
+
+def word_tokenizer(monkeypatch):
+    calls = []
+
+    def encode(text, **kwargs):
+        calls.append(text)
+        return text.split()
+
+    monkeypatch.setitem(conversation_context._encoders, "test-model", encode)
+    return calls
+
+
+def conversation(turns):
+    messages = []
+    for turn in range(turns):
+        messages += [
+            {"role": "user", "content": f"question {turn}"},
+            {
+                "role": "assistant",
+                "content": None,
+                "function_call": {
+                    "name": "run_code",
+                    "arguments": "{}",
+                    "parsed_arguments": {},
+                },
+            },
+            {"role": "function", "name": "run_code", "content": "row\n" * 200},
+        ]
+    return messages
+
+
+def test_compacts_all_but_the_latest_output(monkeypatch):
+    word_tokenizer(monkeypatch)
+    messages = conversation(2)
+    context = ConversationContext(budget=10000)
+
+    prompt = context.build(messages, "system", "test-model")
+
+    assert prompt[0] == {"role": "system", "content": "system"}
+    assert len(prompt) == 7
+    assert "earlier output compacted, 201 lines" in prompt[3]["content"]
+    assert prompt[6]["content"] == "row\n" * 200
+    assert "parsed_arguments" not in prompt[2]["function_call"]
+    # the history itself is not changed
+    assert messages[2]["content"] == "row\n" * 200
+    assert "parsed_arguments" in messages[1]["function_call"]
+
+
+def test_only_new_messages_are_tokenized(monkeypatch):
+    calls = word_tokenizer(monkeypatch)
+    messages = conversation(3)
+    context = ConversationContext(budget=10000)
+
+    context.build(messages, "system", "test-model")
+    calls.clear()
+    messages.append({"role": "user", "content": "one more question"})
+    context.build(messages, "system", "test-model")
+
+    assert calls == ["user", "one more question"]
+
+
+def test_drops_oldest_messages_over_budget(monkeypatch):
+    word_tokenizer(monkeypatch)
+    messages = conversation(5)
+    context = ConversationContext(budget=400)
+
+    prompt = context.build(messages, "system", "test-model")
+
+    assert context.last_tokens <= 400
+    assert context.last_dropped > 0
+    assert prompt[-1]["content"] == "row\n" * 200
+    assert len(prompt) == 1 + len(messages) - context.last_dropped
+
+
+def test_failed_tokenizer_load_is_estimated_and_retried(monkeypatch):
+    loads = []
+
+    def encoding_for_model(model):
+        loads.append(model)
+        if len(loads) == 1:
+            raise OSError("offline")
+        return types.SimpleNamespace(encode=lambda text, **kwargs: text.split())
+
+    tiktoken = types.SimpleNamespace(encoding_for_model=encoding_for_model)
+    monkeypatch.setitem(sys.modules, "tiktoken", tiktoken)
+    monkeypatch.setattr(conversation_context, "_encoders", {})
+    monkeypatch.setattr(conversation_context, "_encoder_retry_at", {})
+
+    # offline, about 4 characters per token, and not tried again right away
+    assert count_tokens("one two three", "retry-model") == 4
+    assert count_tokens("one two three", "retry-model") == 4
+    assert loads == ["retry-model"]
+
+    # the backoff is over
+    conversation_context._encoder_retry_at["retry-model"] = 0
+    assert count_tokens("one two three", "retry-model") == 3
+    assert count_tokens("one two three", "retry-model") == 3
+    assert loads == ["retry-model", "retry-model"]
+
+
+def test_compact_output():
+    assert compact_output("short", 10) == "short"
+    compacted = compact_output("a" * 50 + "b" * 50, 30)
+    assert compacted.startswith("a" * 20)
+    assert compacted.endswith("b" * 10)
+    assert compact_output("abc" * 10, 0).endswith("] ...\n")
+
+
+def test_summarize_functions():
+    source = '''
+import pandas as pd
+
+def total(data, column="Budget"):
+    # Sums a column
+    # of the data
+    return data[column].sum()
+
+def growth(values):
+    """Percentage change of the last value."""
+    return values[-1] / values[-2] - 1
+'''
+
+    assert summarize_functions(source) == (
+        "import pandas as pd\n"
+        "- total(data, column='Budget'): Sums a column of the data\n"
+        "- growth(values): Percentage change of the last value."
+    )
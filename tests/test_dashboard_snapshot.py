@@ -0,0 +1,75 @@
+import os
+import threading
+
+import pandas as pd
+
+from luana_engine import dashboard_snapshot
+from luana_engine.dashboard_snapshot import SnapshotBuilder, build_snapshot, latest_snapshot
+
+
+class FakeAgent:
+    prompts = []
+    # Holds the summary until the test has looked at the pending build
+    gate = threading.Event()
+
+    def chat(self, prompt, **kwargs):
+        assert FakeAgent.gate.wait(5)
+        FakeAgent.prompts.append(prompt)
+        return [{"role": "assistant", "content": "Revenue doubled."}], []
+
+
+def ledger(revenue):
+    return pd.DataFrame(
+        {
+            "Profit Center": ["CD9", "CD9"],
+            "Item": ["Revenue", "Salaries"],
+            "Cost Center": ["", "A"],
+            "2020/04": [-100.0, 40.0],
+            "2020/05": [-revenue, 60.0],
+        }
+    )
+
+
+def write_finance_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr("luana_engine.dataset_cache.CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(dashboard_snapshot, "SNAPSHOT_DIR", str(tmp_path / "dashboard"))
+    path = tmp_path / "finance.csv"
+    ledger(200.0).to_csv(path, index=False)
+    return str(path)
+
+
+def test_build_snapshot_stores_dashboard(tmp_path, monkeypatch):
+    path = write_finance_csv(tmp_path, monkeypatch)
+    FakeAgent.gate.set()
+
+    snapshot = build_snapshot(path, agent_factory=FakeAgent)
+
+    assert snapshot["tiles"]["Revenue"] == {"value": "200.00", "delta": "100.00"}
+    assert snapshot["summary"] == "Revenue doubled."
+    assert "Revenue current value is 200.00" in FakeAgent.prompts[-1]
+    assert all(os.path.exists(file) for file in snapshot["files"])
+    assert latest_snapshot(path) == snapshot
+
+
+def test_builder_serves_latest_snapshot_while_rebuilding(tmp_path, monkeypatch):
+    path = write_finance_csv(tmp_path, monkeypatch)
+    builder = SnapshotBuilder(agent_factory=FakeAgent)
+    FakeAgent.gate.clear()
+
+    snapshot, build = builder.get(path)
+    assert snapshot is None
+    FakeAgent.gate.set()
+    first = build.result()
+    assert builder.get(path) == (first, None)
+
+    ledger(300.0).to_csv(path, index=False)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    FakeAgent.gate.clear()
+    snapshot, build = builder.get(path)
+    assert snapshot == first
+    FakeAgent.gate.set()
+    second = build.result()
+    assert second["tiles"]["Revenue"]["value"] == "300.00"
+    assert builder.get(path) == (second, None)
+    # the previous snapshot is kept, older ones are removed
+    assert len(os.listdir(tmp_path / "dashboard" / "finance")) == 3
@@ -0,0 +1,41 @@
+import os
+
+from luana_engine import dataset_cache
+
+
+def write_ledger(path, extra_rows=""):
+    path.write_text(
+        "Profit Center,Item,Cost Center,2020/04,2020/05\n"
+        "Profit Center,Item,Cost Center,2020/04,2020/05\n"
+        'CD9,Revenue,,"-1,000.50","-2,000.00"\n'
+        "CD9,Rent,12,300,\n"
+        "CD9,Rent,12,300,\n" + extra_rows
+    )
+
+
+def test_load_dataset_cleans_and_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    csv_path = tmp_path / "finance.csv"
+    write_ledger(csv_path)
+
+    data = dataset_cache.load_dataset(str(csv_path))
+
+    assert len(data) == 2
+    assert dataset_cache.month_columns(data) == ["2020/04", "2020/05"]
+    assert data["2020/04"].tolist() == [-1000.5, 300.0]
+    assert data["2020/05"].tolist() == [-2000.0, 0.0]
+    assert os.path.exists(dataset_cache.cache_path(str(csv_path)))
+
+
+def test_load_dataset_rebuilds_when_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    csv_path = tmp_path / "finance.csv"
+    write_ledger(csv_path)
+    first_cache = dataset_cache.cache_path(str(csv_path))
+    assert len(dataset_cache.load_dataset(str(csv_path))) == 2
+
+    write_ledger(csv_path, "CF1,Software,7,\"1,234\",5\n")
+
+    assert dataset_cache.cache_path(str(csv_path)) != first_cache
+    data = dataset_cache.load_dataset(str(csv_path))
+    assert data["2020/04"].tolist() == [-1000.5, 300.0, 1234.0]
@@ -0,0 +1,70 @@
+import os
+
+import pandas as pd
+
+from luana_engine import dataset_profile
+from luana_engine.dataset_profile import describe_dataset, get_profile, profile_dataset
+
+
+def ledger():
+    return pd.DataFrame(
+        {
+            "Profit Center": ["CD9", "CD9", "CF1"],
+            "Item": ["Revenue", "Salaries", "Rent"],
+            "Cost Center": [0.0, 2121278732.0, 2121278732.0],
+            "2020/04": [-100000.0, 40.0, 10.0],
+            "2020/05": [-200000.0, 60.0, 20.0],
+        }
+    )
+
+
+def test_profile_dataset_roles():
+    profile = profile_dataset(ledger())
+
+    columns = {column["name"]: column for column in profile["columns"]}
+    assert profile["rows"] == 3
+    assert columns["Profit Center"] == {
+        "name": "Profit Center",
+        "role": "dimension",
+        "distinct": 2,
+        "values": ["CD9", "CF1"],
+    }
+    assert columns["Cost Center"]["role"] == "code"
+    assert columns["Cost Center"]["values"] == ["2121278732", "0"]
+    assert profile["months"]["first"] == "2020/04"
+    assert profile["months"]["count"] == 2
+    assert profile["months"]["min_total"] == -199920.0
+
+
+def test_profile_is_stored_per_dataset_version(tmp_path, monkeypatch):
+    monkeypatch.setattr("luana_engine.dataset_cache.CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(dataset_profile, "PROFILE_DIR", str(tmp_path / "profiles"))
+    path = tmp_path / "finance.csv"
+    ledger().to_csv(path, index=False)
+
+    profile = get_profile(str(path))
+    assert len(os.listdir(tmp_path / "profiles")) == 1
+
+    # a new process reads the stored profile instead of profiling again
+    dataset_profile._profiles.clear()
+    monkeypatch.setattr(dataset_profile, "profile_dataset", None)
+    assert get_profile(str(path)) == profile
+
+    text = describe_dataset(str(path))
+    assert "Month columns 2020/04 to 2020/05 (2 months" in text
+    assert "- Item (text, 3 distinct): Revenue, Salaries, Rent" in text
+
+
+def test_describe_dataset_fits_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr("luana_engine.dataset_cache.CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(dataset_profile, "PROFILE_DIR", str(tmp_path / "profiles"))
+    path = tmp_path / "wide.csv"
+    pd.DataFrame(
+        {"Department": [f"Department {i}" for i in range(200)], "Budget": range(200)}
+    ).to_csv(path, index=False)
+
+    text = describe_dataset(str(path), budget=100, model="test-model")
+
+    assert len(text) <= 400
+    assert "- Department (text, 200 distinct): Department 0" in text
+    assert "- Budget (amount): from 0 to 199, total 19,900" in text
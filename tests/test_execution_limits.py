@@ -0,0 +1,151 @@
+import gc
+import json
+import threading
+import weakref
+
+import pytest
+
+from luana_engine import code_interpreter, interpreter, python_interpreter
+from luana_engine.code_interpreter import CodeInterpreter
+from luana_engine.python_interpreter import PythonInterpreter
+
+from .test_agent_loop import answer, fake_openai, function_call
+
+
+def test_runaway_cell_is_interrupted_and_keeps_variables():
+    kernel = PythonInterpreter()
+    kernel.timeout = 0.5
+    kernel.run("x = 42")
+
+    output = kernel.run("while True:\n    pass")
+
+    assert "KeyboardInterrupt" in output
+    assert "timed out after 0.5 seconds" in output
+    assert "42" in kernel.run("print(x)")
+
+
+def test_cpu_limit_stops_busy_cell():
+    kernel = PythonInterpreter()
+    kernel.cpu_timeout = 0.3
+
+    assert "seconds of CPU time" in kernel.run("while True:\n    pass")
+
+
+def test_stuck_cell_restarts_kernel_with_presets(monkeypatch):
+    monkeypatch.setattr(python_interpreter, "INTERRUPT_GRACE", 0.2)
+    kernel = PythonInterpreter(preset_functions="def preset():\n    return 7\n")
+    kernel.timeout = 0.3
+    kernel.run("x = 1")
+
+    # time.sleep only gets the interrupt after it returns
+    output = kernel.run("import time\ntime.sleep(3)")
+
+    assert "restarted" in output
+    assert "NameError" in kernel.run("print(x)")
+    assert "7" in kernel.run("print(preset())")
+    # the stuck cell can't be killed, it is still counted until it finishes
+    assert len(kernel.stuck_cells) == 1
+    assert kernel.memory_usage() > 0
+    kernel.stuck_cells[0][0].join(5)
+    kernel.memory_usage()
+    assert kernel.stuck_cells == []
+
+
+def test_finished_stuck_cell_frees_its_data(monkeypatch):
+    monkeypatch.setattr(python_interpreter, "INTERRUPT_GRACE", 0.2)
+    kernel = PythonInterpreter()
+    kernel.timeout = 0.3
+
+    kernel.run("import time\nimport numpy as np\nbig = np.zeros(1_000_000)\ntime.sleep(2)")
+    thread, shell = kernel.stuck_cells[0]
+    big = weakref.ref(shell.user_ns["big"])
+    del shell
+    thread.join(5)
+    kernel.memory_usage()
+    gc.collect()
+
+    assert kernel.stuck_cells == []
+    assert big() is None
+
+
+def test_subprocess_timeout_interrupts_child_commands(monkeypatch):
+    monkeypatch.setattr(code_interpreter, "INTERRUPT_GRACE", 0.5)
+    kernel = CodeInterpreter("shell", False)
+    kernel.timeout = 0.5
+
+    assert "timed out" in kernel.run("sleep 30")
+    assert kernel.run("echo still here") == "still here"
+    kernel.close()
+
+
+def test_cancel_stops_the_chat_turn(monkeypatch):
+    fake_openai(monkeypatch, [function_call("while True:\n    pass"), answer("never")])
+    agent = interpreter.Interpreter()
+    threading.Timer(1, agent.cancel).start()
+
+    messages, _ = agent.chat("Loop forever", return_messages=True)
+
+    assert "cancelled by the user" in messages[-2]["content"]
+    assert messages[-1]["content"] == "I stopped working on this question as you asked."
+
+
+def test_cancel_mid_stream_leaves_a_valid_history(monkeypatch):
+    agent = interpreter.Interpreter()
+
+    def cancelled_stream(chunks_before_cancel):
+        arguments = json.dumps({"language": "python", "code": "print(1)"})
+        call = {"index": 0, "id": "call_0", "type": "function", "function": {"name": "run_code"}}
+        deltas = [{"role": "assistant", "content": None, "tool_calls": [call]}] + [
+            {"tool_calls": [{"index": 0, "function": {"arguments": arguments[i : i + 5]}}]}
+            for i in range(0, len(arguments), 5)
+        ]
+
+        async def chunks():
+            for index, delta in enumerate(deltas):
+                if index == chunks_before_cancel:
+                    agent.cancel()
+                yield {"choices": [{"delta": delta, "finish_reason": None}]}
+            yield {"choices": [{"delta": {}, "finish_reason": "tool_calls"}]}
+
+        return chunks()
+
+    requests = fake_openai(
+        monkeypatch,
+        [cancelled_stream(3), cancelled_stream(0), answer("Fine.")],
+    )
+
+    agent.chat("First", return_messages=True)
+    agent.chat("Second", return_messages=True)
+    messages, _ = agent.chat("Third", return_messages=True)
+
+    assert messages[-1]["content"] == "Fine."
+    # the cut off calls were dropped with their messages, the history only has complete turns
+    assert [message["role"] for message in requests[-1]["messages"][1:]] == [
+        "user",
+        "assistant",
+        "user",
+        "assistant",
+        "user",
+    ]
+    assert all(message.get("content") for message in requests[-1]["messages"])
+
+
+def test_interrupted_calls_get_an_output(monkeypatch):
+    fake_openai(monkeypatch, [function_call("print(1)"), answer("Fine.")])
+    agent = interpreter.Interpreter()
+
+    async def interrupted(code_interpreter, arguments):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(agent, "run_code", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        agent.chat("First")
+    messages, _ = agent.chat("Second", return_messages=True)
+
+    assert [message["role"] for message in messages[1:]] == [
+        "assistant",
+        "function",
+        "user",
+        "assistant",
+    ]
+    assert "cancelled" in messages[2]["content"]
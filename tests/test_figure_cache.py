@@ -0,0 +1,42 @@
+import os
+
+import plotly.graph_objects as go
+
+from luana_engine.figure_cache import FigureCache, load_figure, load_table
+
+
+def test_figure_cache_reuses_until_file_changes(tmp_path):
+    path = tmp_path / "plot.json"
+    go.Figure(go.Bar(x=["a", "b"], y=[1, 2])).write_json(path)
+    cache = FigureCache()
+
+    first = cache.get(str(path), load_figure)
+    assert cache.get(str(path), load_figure) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    go.Figure(go.Bar(x=["a", "b"], y=[3, 4])).write_json(path)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    changed = cache.get(str(path), load_figure)
+    assert changed is not first
+    assert list(changed.data[0].y) == [3, 4]
+    assert len(cache.entries) == 1
+
+
+def test_figure_cache_evicts_least_recently_used(tmp_path):
+    paths = []
+    for name in "abc":
+        path = tmp_path / f"{name}.csv"
+        path.write_text("x,y\n1,2\n")
+        paths.append(str(path))
+    cache = FigureCache()
+    (_, csv), nbytes = load_table(paths[0])
+    assert csv == b"x,y\n1,2\n"
+    cache.max_bytes = 2 * nbytes
+
+    cache.get(paths[0], load_table)
+    cache.get(paths[1], load_table)
+    cache.get(paths[0], load_table)
+    cache.get(paths[2], load_table)
+
+    assert list(cache.entries) == [paths[0], paths[2]]
+    assert cache.nbytes == 2 * nbytes
@@ -0,0 +1,68 @@
+import os
+
+from luana_engine.code_interpreter import CodeInterpreter
+from luana_engine.file_tracker import FileTracker
+from luana_engine.python_interpreter import PythonInterpreter
+
+
+def test_file_tracker_reports_created_and_modified_files(tmp_path):
+    output_dir = tmp_path / ".output"
+    output_dir.mkdir()
+    (output_dir / "unchanged.json").write_text("{}")
+    (output_dir / "revenue.json").write_text("{}")
+    tracker = FileTracker(watched_dirs=[str(output_dir)], top_level_dirs=[str(tmp_path)])
+
+    tracker.start()
+    (output_dir / "revenue.json").write_text('{"data": []}')
+    (output_dir / "plots").mkdir()
+    (output_dir / "plots" / "expenses.json").write_text("{}")
+    (tmp_path / "export.csv").write_text("a,b\n")
+    changes = tracker.stop()
+
+    assert sorted(changes) == sorted(
+        [
+            os.path.join(str(output_dir), "revenue.json"),
+            os.path.join(str(output_dir), "plots", "expenses.json"),
+            os.path.join(str(tmp_path), "export.csv"),
+        ]
+    )
+    assert tracker.last_changes == changes
+
+
+def test_file_tracker_ignores_untouched_files(tmp_path):
+    (tmp_path / "data.csv").write_text("a\n")
+    tracker = FileTracker(watched_dirs=[str(tmp_path)], top_level_dirs=[])
+
+    tracker.start()
+    assert tracker.stop() == []
+
+
+def test_kernels_only_report_files_of_their_own_runs():
+    kernel = PythonInterpreter()
+    other = CodeInterpreter("shell", False)
+    kernel.shell.user_ns["OTHER_DIR"] = other.output_dir
+
+    # a concurrent run of another kernel writes next to this run's artifact
+    kernel.run(
+        "import os\n"
+        + "open(os.path.join(OUTPUT_DIR, 'revenue.json'), 'w').write('{}')\n"
+        + "open(os.path.join(OTHER_DIR, 'costs.json'), 'w').write('{}')"
+    )
+    other.run('echo "{}" > "$OUTPUT_DIR/margin.json"')
+
+    assert kernel.file_tracker.last_changes == [os.path.join(kernel.output_dir, "revenue.json")]
+    assert other.file_tracker.last_changes == [os.path.join(other.output_dir, "margin.json")]
+    other.close()
+
+
+def test_closed_kernels_remove_their_output_dirs():
+    kernel = PythonInterpreter()
+    other = CodeInterpreter("shell", False)
+    kernel.run("open(OUTPUT_DIR + '/revenue.json', 'w').write('{}')")
+    other.run('echo "{}" > "$OUTPUT_DIR/margin.json"')
+
+    kernel.close()
+    other.close()
+
+    assert not os.path.exists(kernel.output_dir)
+    assert not os.path.exists(other.output_dir)
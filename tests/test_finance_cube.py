@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from luana_engine import dataset_cache, finance_cube
+from luana_engine.finance_cube import FinanceCube, load_cube
+
+
+def ledger():
+    return pd.DataFrame(
+        {
+            "Profit Center": ["CD9", "CD1", "CF1", "CF1"],
+            "Item": ["Revenue", "Revenue", "Rent", "Software"],
+            "Cost Center": [None, None, "B", "B"],
+            "2020/04": [-100.0, -50.0, 10.0, 5.0],
+            "2020/05": [-200.0, -60.0, 20.0, 6.0],
+        }
+    )
+
+
+def test_rollups_match_groupby():
+    df = ledger()
+    cube = FinanceCube.from_dataset(df)
+
+    by_item = cube.rollup("Item")
+    expected = df.groupby("Item")[["2020/04", "2020/05"]].sum()
+    pd.testing.assert_frame_equal(by_item, expected)
+
+    revenue = cube.slice("Item", "Revenue").rollup("Profit Center Prefix")
+    assert revenue.loc["CD"].tolist() == [-150.0, -260.0]
+    assert cube.total().tolist() == [-135.0, -234.0]
+    assert cube.dice({"Item": ["Rent", "Software"]}).total(months=["2020/05"]).tolist() == [26.0]
+    assert sorted(cube.members("Profit Center Prefix")) == ["CD", "CF"]
+
+    with pytest.raises(ValueError):
+        cube.rollup("Region")
+
+
+def test_updated_patches_changed_months():
+    cube = FinanceCube.from_dataset(ledger())
+    df = ledger()
+    df["2020/05"] = df["2020/05"] * 2
+    df["2020/06"] = [-1.0, -2.0, 3.0, 4.0]
+
+    updated = cube.updated(df)
+
+    rebuilt = FinanceCube.from_dataset(df)
+    for dimensions in [(), ("Item",), ("Profit Center Prefix", "Cost Center")]:
+        left = updated.rollup(*dimensions)
+        right = rebuilt.rollup(*dimensions)
+        assert left.equals(right)
+    assert updated.months == ["2020/04", "2020/05", "2020/06"]
+    # the old cube is left untouched
+    assert cube.total().tolist() == [-135.0, -234.0]
+
+
+def test_load_cube_follows_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(finance_cube, "_cubes", {})
+    path = tmp_path / "finance.csv"
+    ledger().to_csv(path, index=False)
+
+    cube = load_cube(str(path))
+    assert load_cube(str(path)) is cube
+
+    df = ledger()
+    df["2020/05"] = 0.0
+    df.to_csv(path, index=False)
+    assert load_cube(str(path)).total().tolist() == [-135.0, 0.0]
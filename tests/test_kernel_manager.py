@@ -0,0 +1,91 @@
+import pandas as pd
+
+from luana_engine.kernel_manager import KernelManager, namespace_size
+from luana_engine.python_interpreter import PythonInterpreter
+
+
+class FakeKernel:
+    def __init__(self, memory=0):
+        self.memory = memory
+        self.closed = False
+
+    def memory_usage(self):
+        return self.memory
+
+    def close(self):
+        self.closed = True
+
+
+def test_sessions_get_their_own_kernels():
+    manager = KernelManager()
+
+    first, restarted = manager.acquire("a", "python", FakeKernel)
+    manager.release("a", "python")
+    second, _ = manager.acquire("b", "python", FakeKernel)
+    manager.release("b", "python")
+    again, _ = manager.acquire("a", "python", FakeKernel)
+
+    assert first is again
+    assert first is not second
+    assert restarted is False
+
+
+def test_kernel_over_its_limit_is_restarted():
+    manager = KernelManager(kernel_limit=100)
+
+    kernel, _ = manager.acquire("a", "python", lambda: FakeKernel(memory=500))
+    # kernels are measured in the background, the run is not held up by it
+    assert manager.release("a", "python") is None
+    manager.measure()
+
+    assert kernel.closed
+    replacement, restarted = manager.acquire("a", "python", FakeKernel)
+    assert replacement is not kernel
+    assert restarted is True
+
+
+def test_kernel_measured_over_its_limit_while_busy_is_restarted_on_release():
+    manager = KernelManager(kernel_limit=100)
+
+    kernel, _ = manager.acquire("a", "python", lambda: FakeKernel(memory=500))
+    manager.acquire("a", "python", FakeKernel)
+    manager.release("a", "python")
+    manager.measure()
+    assert not kernel.closed
+
+    assert "restarted" in manager.release("a", "python")
+    assert kernel.closed
+
+
+def test_idle_kernels_are_evicted_least_recently_used_first():
+    manager = KernelManager(budget=250, kernel_limit=1000)
+    kernels = {}
+    for session in ["a", "b", "c"]:
+        kernels[session], _ = manager.acquire(session, "python", lambda: FakeKernel(memory=100))
+        manager.release(session, "python")
+    manager.measure()
+
+    assert kernels["a"].closed
+    assert not kernels["b"].closed and not kernels["c"].closed
+    assert manager.memory_usage() == 200
+
+
+def test_busy_kernels_are_not_evicted():
+    manager = KernelManager(budget=50, kernel_limit=1000)
+    busy, _ = manager.acquire("a", "python", lambda: FakeKernel(memory=100))
+    manager.acquire("b", "python", lambda: FakeKernel(memory=100))
+    manager.release("b", "python")
+    manager.measure()
+
+    assert not busy.closed
+
+
+def test_python_interpreter_memory_usage():
+    kernel = PythonInterpreter()
+    before = kernel.memory_usage()
+    kernel.run("import numpy as np\nbig = np.zeros(1_000_000)")
+
+    assert kernel.memory_usage() - before >= 8_000_000
+    kernel.close()
+    assert "big" not in kernel.shell.user_ns
+    assert namespace_size({"df": pd.DataFrame({"x": range(10)})}) > 0
@@ -0,0 +1,53 @@
+import threading
+
+from luana_engine.kernel_pool import KernelPool
+
+
+def wait_for_ready(pool, count):
+    for _ in range(500):
+        with pool.lock:
+            if len(pool.ready) == count and pool.pending == 0:
+                return
+        threading.Event().wait(0.01)
+    raise AssertionError("the pool did not fill up")
+
+
+def test_pool_hands_out_started_kernels_and_replenishes():
+    started = []
+
+    def factory():
+        started.append(threading.current_thread().name)
+        return object()
+
+    pool = KernelPool(factory, size=2)
+    wait_for_ready(pool, 2)
+    assert all(name.startswith("kernel-pool") for name in started)
+
+    kernel = pool.acquire()
+    assert kernel is not None
+    wait_for_ready(pool, 2)
+    assert len(started) == 3
+    pool.close()
+
+
+def test_empty_pool_starts_kernel_on_demand():
+    pool = KernelPool(lambda: "kernel", size=0)
+
+    assert pool.acquire() == "kernel"
+    assert len(pool.ready) == 0
+    pool.close()
+
+
+def test_failed_starts_do_not_block_the_pool():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return "kernel"
+
+    pool = KernelPool(factory, size=1)
+    wait_for_ready(pool, 0)
+    assert pool.acquire() == "kernel"
+    pool.close()
@@ -0,0 +1,73 @@
+import json
+
+import pandas as pd
+import pytest
+
+from luana_engine.kpi_engine import compute_kpis, kpi_dashboard, kpi_tiles
+
+
+def ledger():
+    return pd.DataFrame(
+        {
+            "Profit Center": ["CD9", "CD9", "CF1"],
+            "Item": ["Revenue", "Salaries", "Rent"],
+            "Cost Center": ["", "A", "B"],
+            "2020/04": [-100.0, 40.0, 10.0],
+            "2020/05": [-200.0, 60.0, 20.0],
+        }
+    )
+
+
+def test_compute_kpis():
+    kpis = compute_kpis(ledger())
+
+    assert list(kpis.index) == ["2020/04", "2020/05"]
+    assert list(kpis["Revenue"]) == [100.0, 200.0]
+    assert list(kpis["Expenses"]) == [50.0, 80.0]
+    assert list(kpis["Net Profit"]) == [50.0, 120.0]
+    assert list(kpis["Profit Margin"]) == [50.0, 60.0]
+    assert kpis["Revenue Growth"].iloc[-1] == 100.0
+    assert kpis["Expense Ratio"].iloc[-1] == 40.0
+
+
+def test_kpi_tiles_deltas():
+    tiles = kpi_tiles(compute_kpis(ledger()), ["Revenue", "Net Profit", "Profit Margin"])
+
+    assert tiles["Revenue"] == {"value": "200.00", "delta": "100.00"}
+    assert tiles["Net Profit"] == {"value": "120.00", "delta": "140.00"}
+    # ratios change in percentage points
+    assert tiles["Profit Margin"] == {"value": "60.00", "delta": "10.00"}
+
+
+def test_kpi_tiles_without_previous_month():
+    one_month = ledger().drop(columns=["2020/05"])
+    tiles = kpi_tiles(compute_kpis(one_month), ["Revenue", "Profit Margin"])
+
+    assert tiles["Revenue"] == {"value": "100.00", "delta": "n/a"}
+    assert tiles["Profit Margin"] == {"value": "50.00", "delta": "n/a"}
+
+    no_revenue = ledger().assign(**{"2020/04": [0.0, 40.0, 10.0]})
+    tiles = kpi_tiles(compute_kpis(no_revenue), ["Revenue", "Profit Margin"])
+    assert tiles["Revenue"]["delta"] == "n/a"
+    assert tiles["Profit Margin"]["delta"] == "n/a"
+
+
+def test_kpi_dashboard_writes_plots(tmp_path, monkeypatch):
+    monkeypatch.setattr("luana_engine.dataset_cache.CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "finance.csv"
+    ledger().to_csv(path, index=False)
+
+    dashboard = kpi_dashboard(str(path), output_dir=str(tmp_path / "output"))
+
+    assert dashboard["tiles"]["Revenue"]["value"] == "200.00"
+    assert len(dashboard["files"]) == len(dashboard["tiles"])
+    with open(dashboard["files"][0]) as f:
+        assert json.load(f)["data"][0]["y"] == pytest.approx([100.0, 200.0])
+
+
+def test_kpi_dashboard_skips_other_datasets(tmp_path, monkeypatch):
+    monkeypatch.setattr("luana_engine.dataset_cache.CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "budget.csv"
+    pd.DataFrame({"Fiscal Year": [2021], "Budget": [1.0]}).to_csv(path, index=False)
+
+    assert kpi_dashboard(str(path), output_dir=str(tmp_path / "output")) is None
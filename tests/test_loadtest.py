@@ -0,0 +1,67 @@
+import openai
+
+from luana_engine import interpreter
+from luana_engine.loadtest.driver import percentile, run_load_test
+from luana_engine.loadtest.server import FakeOpenAIServer
+
+from .test_agent_loop import fake_openai
+
+script = [
+    {
+        "match": "revenue",
+        "turns": [
+            {"function_call": {"language": "python", "code": "print(6 * 7)"}},
+            {"content": "The revenue is 42."},
+        ],
+    },
+    {"turns": [{"content": "Hello!"}]},
+]
+
+
+original_acreate = openai.ChatCompletion.acreate
+
+
+def use_server(monkeypatch, server=None):
+    fake_openai(monkeypatch, [])
+    # Talk to the stand-in over HTTP instead of the fake acreate
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", original_acreate)
+    if server:
+        monkeypatch.setattr(openai, "api_base", server.url)
+
+
+def test_fake_server_streams_scripted_function_calls(monkeypatch):
+    with FakeOpenAIServer(script) as server:
+        use_server(monkeypatch, server)
+        agent = interpreter.Interpreter()
+
+        messages, _ = agent.chat("What is the revenue?", return_messages=True)
+        greeting, _ = interpreter.Interpreter().chat("Hi", return_messages=True)
+
+    assert "42" in messages[2]["content"]
+    assert messages[-1]["content"] == "The revenue is 42."
+    assert greeting[-1]["content"] == "Hello!"
+    assert server.requests == 3
+
+
+def test_load_test_reports_latency_and_throughput(monkeypatch):
+    use_server(monkeypatch)
+
+    report = run_load_test(
+        sessions=3,
+        questions=["What is the revenue?"],
+        script=script,
+        ttft=0.01,
+        token_latency=0,
+    )
+
+    assert report["answers"] == 3
+    assert report["errors"] == []
+    assert report["llm_requests"] == 6
+    assert report["latency_p50_seconds"] <= report["latency_p95_seconds"]
+    assert report["throughput_answers_per_second"] > 0
+
+
+def test_percentile():
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([5], 95) == 5
+    assert percentile([], 50) is None
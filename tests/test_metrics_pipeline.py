@@ -0,0 +1,73 @@
+import json
+import threading
+
+from luana_engine.metrics_pipeline import MetricsPipeline, parse_metric_names, read_metric_file
+
+
+class StubAgent:
+    """Answers the plot and value prompts; blocks until every fork has started."""
+
+    def __init__(self, started=None, forks=None):
+        self.started = started
+        self.forks = forks if forks is not None else []
+        self.closed = False
+
+    def fork(self):
+        forked = StubAgent(self.started, self.forks)
+        self.forks.append(forked)
+        return forked
+
+    def reset(self):
+        self.closed = True
+
+    def chat(self, message, return_messages=False, **kwargs):
+        if "plot" in message:
+            self.started.wait()
+            metric = message.split("save the plot as ")[1].split(".json")[0]
+            file = f"{metric}.json"
+            with open(file, "w") as f:
+                json.dump({"data": [{"y": [1.0]}]}, f)
+            return [file]
+        return [{"role": "assistant", "content": 'Here: {"value": "10", "delta": 2.5}'}], []
+
+
+def test_parse_metric_names():
+    assert parse_metric_names("Total Revenue, Net Profit ,Profit Margin.") == [
+        "Total Revenue",
+        "Net Profit",
+        "Profit Margin",
+    ]
+    assert parse_metric_names("") == []
+
+
+def test_metrics_pipeline_runs_metrics_concurrently(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metrics = ["Revenue", "Expenses", "Margin"]
+    # Every plot call waits for all of them, so this only finishes if they run concurrently
+    started = threading.Barrier(len(metrics), timeout=5)
+    agent = StubAgent(started)
+
+    output_dir = tmp_path / "plots"
+    output_dir.mkdir()
+
+    pipeline = MetricsPipeline(agent, metrics, output_dir=str(output_dir))
+    results = dict(pipeline.as_completed())
+
+    assert len(agent.forks) == len(metrics)
+    # the forks are released once their plots are copied
+    assert all(forked.closed for forked in agent.forks)
+    assert results["Margin"] == {
+        "value": "10.00",
+        "delta": "2.50",
+        "files": [str(output_dir / "Margin.json")],
+    }
+    assert pipeline.files == [str(output_dir / f"{metric}.json") for metric in metrics]
+
+
+def test_read_metric_file_without_previous_value(tmp_path):
+    file = tmp_path / "Revenue.json"
+    file.write_text(json.dumps({"data": [{"y": [120.0]}]}))
+    assert read_metric_file(str(file)) == {"value": "120.00", "delta": "n/a"}
+
+    file.write_text(json.dumps({"data": [{"y": [0.0, 120.0]}]}))
+    assert read_metric_file(str(file))["delta"] == "n/a"
@@ -1,3 +1,7 @@
+import gc
+import sys
+import weakref
+
 from luana_engine.python_interpreter import PythonInterpreter
 
 
@@ -25,3 +29,67 @@ def test_python_interpreter():
     )
     print("STDOUT:", stdout)
     print("STDERR:", stderr)
+
+
+def test_python_interpreter_preloads_dataset(tmp_path, monkeypatch):
+    from luana_engine import dataset_cache
+
+    monkeypatch.setattr(dataset_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    csv_path = tmp_path / "finance.csv"
+    csv_path.write_text(
+        'Profit Center,Item,Cost Center,2020/04\nCD9,Revenue,,"-1,000"\n'
+    )
+    interpreter = PythonInterpreter(data_path=str(csv_path))
+
+    output = interpreter.run("print(DATA['2020/04'].sum(), list(MONTH_COLUMNS))")
+    assert "-1000.0 ['2020/04']" in output
+
+    # Reassigned names are restored before the next cell
+    interpreter.run("DATA = None")
+    assert "-1000.0" in interpreter.run("print(DATA['2020/04'].sum())")
+
+    # Edits in place don't reach the next cell
+    interpreter.run("DATA.loc[0, '2020/04'] = 5.0\nDATA.drop(columns=['Item'], inplace=True)")
+    assert "-1000.0 True" in interpreter.run("print(DATA['2020/04'].sum(), 'Item' in DATA)")
+
+    # The dataset is reloaded when the file changes
+    csv_path.write_text(
+        'Profit Center,Item,Cost Center,2020/04\nCD9,Revenue,,"-2,500"\n'
+    )
+    assert "-2500.0" in interpreter.run("print(DATA['2020/04'].sum())")
+    assert "-2500.0" in interpreter.run("print(CUBE.total().sum())")
+
+
+def test_python_interpreter_streams_output():
+    interpreter = PythonInterpreter()
+    events = []
+
+    output = interpreter.run(
+        "x = 1\nprint('first')\nimport sys\nprint('oops', file=sys.stderr, end='')",
+        on_output=lambda kind, value: events.append((kind, value)),
+    )
+
+    assert events == [
+        ("active_line", 1),
+        ("active_line", 2),
+        ("stdout", "first"),
+        ("active_line", 3),
+        ("active_line", 4),
+        ("stderr", "oops"),
+    ]
+    assert "first" in output and "oops" in output
+    # Without a callback the cell runs unchanged
+    assert "STDOUT: 1" in interpreter.run("print(x)")
+
+
+def test_closed_python_interpreter_is_garbage_collected():
+    main = sys.modules["__main__"]
+    kernel = PythonInterpreter()
+    kernel.run("x = 1")
+    shell = weakref.ref(kernel.shell)
+
+    assert sys.modules["__main__"] is main
+    kernel.close()
+    del kernel
+    gc.collect()
+    assert shell() is None
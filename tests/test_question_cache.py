@@ -0,0 +1,98 @@
+import os
+
+import pandas as pd
+
+from luana_engine import interpreter
+from luana_engine.answer_store import AnswerStore
+from luana_engine.dataset_cache import dataset_digest
+from luana_engine.question_cache import QuestionCache, is_follow_up, question_terms
+
+from .test_agent_loop import answer, fake_openai
+
+
+def make_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr("luana_engine.dataset_cache.CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr("luana_engine.dataset_profile.PROFILE_DIR", str(tmp_path / "profiles"))
+    path = tmp_path / "finance.csv"
+    pd.DataFrame(
+        {"Item": ["Revenue", "Consulting fees"], "2020/08": [-100.0, 20.0], "2020/09": [-120.0, 30.0]}
+    ).to_csv(path, index=False)
+    return str(path), QuestionCache(store=AnswerStore(str(tmp_path / "answers")))
+
+
+def test_question_terms():
+    vocabulary = [("consulting", "fee"), ("revenue",)]
+
+    assert question_terms("What is the total revenue in Sept?", vocabulary) == (
+        "revenue september",
+        frozenset({"revenue", "september"}),
+    )
+    assert question_terms("Revenue for 2020/09", vocabulary)[1] == {"revenue", "september", "2020"}
+    assert question_terms("Give me a trend on Consulting Fees", vocabulary) == (
+        "trend consulting_fee",
+        frozenset({"consulting_fee"}),
+    )
+    assert is_follow_up("and in October?")
+    assert is_follow_up("Plot that as a bar chart")
+    assert not is_follow_up("Show me my P&L month over month")
+
+
+def test_lookup_matches_rephrased_questions_about_the_same_data(tmp_path, monkeypatch):
+    path, cache = make_cache(tmp_path, monkeypatch)
+    digest = dataset_digest(path)
+    cache.add(path, digest, "What is the total revenue in September?", "Revenue was 120.")
+    cache.add(path, digest, "Give me a trend on consulting fees", "Fees went up.")
+
+    assert cache.lookup(path, "revenue in Sept")["answer"] == "Revenue was 120."
+    assert cache.lookup(path, "Total September revenue")["answer"] == "Revenue was 120."
+    assert cache.lookup(path, "consulting fee trend")["answer"] == "Fees went up."
+    # other months, items or follow-ups are not served from the cache
+    assert cache.lookup(path, "revenue in August") is None
+    assert cache.lookup(path, "consulting fees in September") is None
+    assert cache.lookup(path, "and in September?") is None
+
+    # opposite directions and other aggregations are different questions, however similar the words
+    cache.add(path, digest, "Which items increased the most in September?", "Revenue did.")
+    cache.add(path, digest, "What are the top 3 items by amount?", "Revenue, fees, rent.")
+    assert cache.lookup(path, "Which items increased most in Sept?")["answer"] == "Revenue did."
+    assert cache.lookup(path, "Which items decreased the most in September?") is None
+    assert cache.lookup(path, "Which items increased the least in September?") is None
+    assert cache.lookup(path, "What are the bottom 3 items by amount?") is None
+    assert cache.lookup(path, "What is the average revenue in September?") is None
+
+    pd.DataFrame({"Item": ["Revenue"], "2020/09": [-200.0]}).to_csv(path, index=False)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert cache.lookup(path, "revenue in Sept") is None
+
+
+def test_chat_stores_answers_and_serves_rephrased_questions(tmp_path, monkeypatch):
+    _, cache = make_cache(tmp_path, monkeypatch)
+    requests = fake_openai(monkeypatch, [answer("Revenue was 1,000."), answer("Salaries were 10."), answer("Rent is flat.")])
+    agent = interpreter.Interpreter()
+    agent.question_cache = cache
+
+    messages, _ = agent.chat("What is the total revenue in September?", return_messages=True)
+    assert messages[-1]["content"] == "Revenue was 1,000."
+    messages, _ = agent.chat("revenue in Sept", return_messages=True)
+    assert messages[-1]["content"] == "Revenue was 1,000."
+    assert len(requests) == 1
+
+    messages, _ = agent.chat("What about salaries in September?", return_messages=True)
+    assert messages[-1]["content"] == "Salaries were 10."
+    messages, _ = agent.chat("Show me the rent trend", return_messages=True)
+    assert messages[-1]["content"] == "Rent is flat."
+    # later questions can depend on the conversation, they are not stored for other sessions
+    assert len(cache.store.answers(".data/finance.csv", agent.data_digest)) == 1
+
+
+def test_chat_answers_and_stores_for_its_own_dataset(tmp_path, monkeypatch):
+    path, cache = make_cache(tmp_path, monkeypatch)
+    monkeypatch.setenv("data", ".data/finance.csv")
+    requests = fake_openai(monkeypatch, [answer("Revenue was 120.")])
+    agent = interpreter.Interpreter(path)
+    agent.question_cache = cache
+
+    agent.chat("What is the total revenue in September?")
+    assert path in requests[0]["messages"][0]["content"]
+    assert cache.lookup(path, "revenue in Sept")["answer"] == "Revenue was 120."
+    assert cache.lookup(".data/finance.csv", "revenue in Sept") is None
@@ -0,0 +1,128 @@
+import os
+import threading
+
+import pandas as pd
+
+from luana_engine import interpreter
+from luana_engine.answer_store import AnswerStore
+from luana_engine.question_prefetch import QuestionPrefetcher
+
+from .test_agent_loop import answer, fake_openai
+
+
+class FakeAgent:
+    asked = []
+    data_paths = []
+    # Holds every answer until set, or until the agent is cancelled
+    gate = threading.Event()
+
+    def __init__(self, output_dir, data_path):
+        self.output_dir = output_dir
+        FakeAgent.data_paths.append(data_path)
+        self.cancelled = threading.Event()
+
+    def chat(self, question, **kwargs):
+        FakeAgent.asked.append(question)
+        for _ in range(500):
+            if FakeAgent.gate.is_set() or self.cancelled.is_set():
+                break
+            self.cancelled.wait(0.01)
+        file = os.path.join(self.output_dir, "answer.json")
+        with open(file, "w") as f:
+            f.write(question)
+        return [{"role": "assistant", "content": f"Answer to {question}"}], [file]
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def make_prefetcher(tmp_path, monkeypatch):
+    monkeypatch.setattr("luana_engine.dataset_cache.CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "finance.csv"
+    pd.DataFrame({"Item": ["Revenue"], "2020/05": [-100.0]}).to_csv(path, index=False)
+    FakeAgent.asked = []
+    FakeAgent.data_paths = []
+    prefetcher = QuestionPrefetcher(
+        store=AnswerStore(str(tmp_path / "answers")),
+        agent_factory=lambda data_path: FakeAgent(str(tmp_path), data_path),
+        idle_seconds=0,
+    )
+    return str(path), prefetcher
+
+
+def wait_for_answer(prefetcher, path, question):
+    for _ in range(500):
+        answer = prefetcher.answer(path, question)
+        if answer is not None:
+            return answer
+        threading.Event().wait(0.01)
+    raise AssertionError(f"{question} was not answered")
+
+
+def test_prefetch_stores_answers_per_dataset_version(tmp_path, monkeypatch):
+    path, prefetcher = make_prefetcher(tmp_path, monkeypatch)
+    FakeAgent.gate.set()
+
+    prefetcher.prefetch(path, ["Revenue in September?", "Show my P&L"])
+    first = wait_for_answer(prefetcher, path, "Revenue in September?")
+    second = wait_for_answer(prefetcher, path, "Show my P&L")
+
+    assert first["answer"] == "Answer to Revenue in September?"
+    assert second["source"] == "prefetch"
+    with open(second["files"][0]) as f:
+        assert f.read() == "Show my P&L"
+    # asked with different case and punctuation it is the same question
+    assert prefetcher.answer(path, "revenue in september") == first
+    # stored answers are not asked again
+    prefetcher.prefetch(path, ["Revenue in September?"])
+    assert FakeAgent.asked == ["Revenue in September?", "Show my P&L"]
+    # the agents answer about the job's dataset, not the one selected in the app
+    assert FakeAgent.data_paths == [path, path]
+
+    pd.DataFrame({"Item": ["Revenue"], "2020/05": [-200.0]}).to_csv(path, index=False)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert prefetcher.answer(path, "Revenue in September?") is None
+
+
+def test_interactive_turn_interrupts_and_requeues_question(tmp_path, monkeypatch):
+    path, prefetcher = make_prefetcher(tmp_path, monkeypatch)
+    FakeAgent.gate.clear()
+
+    prefetcher.prefetch(path, ["Revenue in September?"])
+    for _ in range(500):
+        if prefetcher.running is not None and prefetcher.running.agent is not None:
+            break
+        threading.Event().wait(0.01)
+    with prefetcher.interactive():
+        # the interrupted answer is not stored, and nothing runs during the turn
+        threading.Event().wait(0.2)
+        assert prefetcher.answer(path, "Revenue in September?") is None
+        assert FakeAgent.asked == ["Revenue in September?"]
+    FakeAgent.gate.set()
+
+    assert wait_for_answer(prefetcher, path, "Revenue in September?")
+    assert FakeAgent.asked == ["Revenue in September?", "Revenue in September?"]
+
+
+def test_chat_serves_prefetched_answer(tmp_path, monkeypatch):
+    _, prefetcher = make_prefetcher(tmp_path, monkeypatch)
+    path = ".data/finance.csv"
+    FakeAgent.gate.set()
+    prefetcher.prefetch(path, ["Revenue in September?"])
+    wait_for_answer(prefetcher, path, "Revenue in September?")
+    requests = fake_openai(monkeypatch, [answer("Computed.")])
+    agent = interpreter.Interpreter()
+    agent.prefetcher = prefetcher
+
+    messages, files = agent.chat("Revenue in September?", return_messages=True)
+    assert messages[-1]["content"] == "Answer to Revenue in September?"
+    assert os.path.basename(files[0]) == "answer.json"
+    assert requests == []
+
+    messages, _ = agent.chat("And in October?", return_messages=True)
+    assert messages[-1]["content"] == "Computed."
+    assert [message["role"] for message in requests[0]["messages"][1:]] == [
+        "user",
+        "assistant",
+        "user",
+    ]
@@ -0,0 +1,134 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+import requests
+from sodapy import Socrata
+
+from luana_engine.socrata_ingest import parts_dir, read_state, sync_dataset, sync_in_background
+
+
+class FakeSocrata:
+    """Serves rows with the SODA paging parameters $limit, $offset, $order and $where."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.requests = []
+        self.fail_at_offset = None
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                fake.requests.append(params)
+                offset = int(params.get("$offset", 0))
+                if offset == fake.fail_at_offset:
+                    fake.fail_at_offset = None
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                rows = sorted(fake.rows, key=lambda row: row[params.get("$order", ":id")])
+                match = re.fullmatch(r":updated_at > '(.*)'", params.get("$where", ""))
+                if match:
+                    rows = [row for row in rows if row[":updated_at"].rstrip("Z") > match.group(1)]
+                rows = rows[offset : offset + int(params.get("$limit", 1000))]
+                body = json.dumps(rows).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def client(self):
+        host, port = self.httpd.server_address[:2]
+        return Socrata(
+            f"{host}:{port}",
+            None,
+            session_adapter={"prefix": "http://", "adapter": requests.adapters.HTTPAdapter()},
+        )
+
+
+def row(i, budget, updated_at="2023-01-01T00:00:00.000Z"):
+    record = {":id": f"row-{i:03d}", ":updated_at": updated_at, "Department": f"D{i}"}
+    # null fields are left out of the records
+    if budget is not None:
+        record["Budget"] = str(budget)
+    return record
+
+
+@pytest.fixture
+def server():
+    fake = FakeSocrata([row(i, i * 10 if i % 4 else None) for i in range(23)])
+    yield fake
+    fake.httpd.shutdown()
+
+
+def test_sync_pages_through_whole_dataset(tmp_path, server):
+    target = str(tmp_path / "budget.csv")
+
+    assert sync_dataset(server.client(), "xdgd-c79v", target, page_size=5) == 23
+
+    df = pd.read_csv(target)
+    assert list(df.columns) == ["Department", "Budget"]
+    assert len(df) == 23
+    assert df["Budget"].isna().sum() == 6
+    assert [request["$offset"] for request in server.requests] == ["0", "5", "10", "15", "20"]
+    assert read_state(target)["updated_at"] == "2023-01-01T00:00:00.000Z"
+
+
+def test_sync_resumes_after_failed_page(tmp_path, server):
+    target = str(tmp_path / "budget.csv")
+    server.fail_at_offset = 10
+
+    with pytest.raises(Exception):
+        sync_dataset(server.client(), "xdgd-c79v", target, page_size=5)
+    assert read_state(target)["offset"] == 10
+
+    server.requests.clear()
+    assert sync_dataset(server.client(), "xdgd-c79v", target, page_size=5) == 23
+    assert [request["$offset"] for request in server.requests] == ["10", "15", "20"]
+    assert len(pd.read_csv(target)) == 23
+
+
+def test_refresh_fetches_updated_rows_only(tmp_path, server):
+    target = str(tmp_path / "budget.csv")
+    sync_dataset(server.client(), "xdgd-c79v", target, page_size=5)
+
+    server.rows[3] = row(3, 999, "2023-02-01T00:00:00.000Z")
+    server.rows.append(row(30, 300, "2023-02-02T00:00:00.000Z"))
+    server.requests.clear()
+
+    assert sync_dataset(server.client(), "xdgd-c79v", target, page_size=5) == 2
+    assert server.requests[0]["$where"] == ":updated_at > '2023-01-01T00:00:00.000'"
+
+    df = pd.read_csv(target)
+    assert len(df) == 24
+    assert df.loc[df["Department"] == "D3", "Budget"].tolist() == [999]
+    assert read_state(target)["updated_at"] == "2023-02-02T00:00:00.000Z"
+
+    # nothing changed since
+    assert sync_dataset(server.client(), "xdgd-c79v", target, page_size=5) == 0
+    assert len(list((tmp_path / "budget.parts").glob("part-*.csv"))) == 6
+    assert parts_dir(target) == str(tmp_path / "budget.parts")
+
+
+def test_sync_in_background_runs_once_per_dataset(tmp_path, server):
+    target = tmp_path / "budget.csv"
+
+    thread = sync_in_background(server.client, "xdgd-c79v", str(target), interval=3600)
+    assert sync_in_background(server.client, "xdgd-c79v", str(target)) is thread
+    for _ in range(500):
+        if read_state(str(target)) and read_state(str(target))["complete"]:
+            break
+        threading.Event().wait(0.01)
+
+    assert len(pd.read_csv(target)) == 23
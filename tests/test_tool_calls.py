@@ -0,0 +1,112 @@
+import json
+
+from luana_engine import interpreter
+from luana_engine.python_interpreter import PythonInterpreter
+from luana_engine.tool_calls import code_names, plan_waves, share_variables
+
+from .test_agent_loop import answer, fake_openai, stream
+
+
+def tool_calls(*codes):
+    deltas = [{"role": "assistant", "content": None}]
+    for index, code in enumerate(codes):
+        arguments = json.dumps({"language": "python", "code": code})
+        deltas.append(
+            {
+                "tool_calls": [
+                    {
+                        "index": index,
+                        "id": f"call_{index}",
+                        "type": "function",
+                        "function": {"name": "run_code", "arguments": ""},
+                    }
+                ]
+            }
+        )
+        deltas += [
+            {"tool_calls": [{"index": index, "function": {"arguments": arguments[i : i + 7]}}]}
+            for i in range(0, len(arguments), 7)
+        ]
+    return stream(deltas, "tool_calls")
+
+
+def test_code_names():
+    reads, writes = code_names("import numpy as np\ntotal = np.sum(DATA[MONTH_COLUMNS])\nDATA['x'] = 1\nprint(total)")
+
+    assert reads == {"np", "DATA", "MONTH_COLUMNS", "total"}
+    assert writes == {"np", "total", "DATA"}
+    assert code_names("def broken(:") is None
+
+
+def test_plan_waves_keeps_dependent_calls_apart():
+    calls = [
+        ("python", "revenue = DATA.sum()"),
+        ("python", "costs = DATA.mean()"),
+        ("python", "margin = revenue - costs"),
+        ("python", "headcount = 3"),
+        ("shell", "ls"),
+        ("python", "broken("),
+        ("python", "x = 1"),
+    ]
+
+    assert plan_waves(calls, immutable={"DATA"}) == [[0, 1], [2, 3], [4], [5], [6]]
+
+
+def test_method_calls_count_as_writes():
+    # methods can modify the object in place, the cells would race on the shared object
+    assert plan_waves([("python", "df.dropna(inplace=True)"), ("python", "print(df.shape)")]) == [[0], [1]]
+    assert plan_waves([("python", "totals.append(1)"), ("python", "print(len(totals))")]) == [[0], [1]]
+    # unless the name is a module, or imported by the cell
+    assert plan_waves(
+        [("python", "a = pd.Series([1])"), ("python", "b = pd.Series([2])")], immutable={"pd"}
+    ) == [[0, 1]]
+    assert code_names("import numpy as np\nx = np.zeros(3)")[1] == {"np", "x"}
+    # cells changing the process state run alone
+    assert code_names("import os\nos.chdir('/tmp')") is None
+    assert plan_waves([("python", "x = 1"), ("python", "exec('y = 2')")]) == [[0], [1]]
+
+
+def test_share_variables_removes_deleted_names():
+    session = PythonInterpreter()
+    sibling = PythonInterpreter()
+    session.run("a = 1\nb = 2")
+    share_variables(session, sibling)
+    session.run("del b")
+
+    share_variables(session, sibling)
+
+    assert "1" in sibling.run("print(a)")
+    assert "NameError" in sibling.run("print(b)")
+
+
+def test_independent_tool_calls_run_concurrently(monkeypatch):
+    requests = fake_openai(
+        monkeypatch,
+        [
+            tool_calls(
+                "import time\nstarted = time.monotonic()\ntime.sleep(0.5)\nrevenue = 100\nprint(revenue, started, time.monotonic())",
+                "import time as t\nbegan = t.monotonic()\nt.sleep(0.5)\ncosts = 60\nprint(costs, began, t.monotonic())",
+                "print(revenue - costs)",
+            ),
+            answer("The margin is 40."),
+        ],
+    )
+    agent = interpreter.Interpreter()
+
+    messages, _ = agent.chat("Revenue, costs and margin?", return_messages=True)
+
+    outputs = [message for message in messages if message["role"] == "tool"]
+    assert [output["tool_call_id"] for output in outputs] == ["call_0", "call_1", "call_2"]
+    revenue, first_start, first_end = outputs[0]["content"].split("\n")[0].split()[-3:]
+    costs, second_start, second_end = outputs[1]["content"].split("\n")[0].split()[-3:]
+    assert (revenue, costs) == ("100", "60")
+    # the two independent calls ran at the same time
+    assert float(second_start) < float(first_end) and float(first_start) < float(second_end)
+    # the third call needs both results, it runs after them on the session's kernel
+    assert "40" in outputs[2]["content"]
+    assert messages[-1]["content"] == "The margin is 40."
+    assert requests[0]["tools"][0]["function"]["name"] == "run_code"
+    # the follow-up request sends the calls and their outputs back together
+    sent = requests[1]["messages"]
+    assert [tool_call["id"] for tool_call in sent[-4]["tool_calls"]] == ["call_0", "call_1", "call_2"]
+    assert "parsed_arguments" not in sent[-4]["tool_calls"][0]["function"]
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from luana_engine import interpreter, tracing
+
+from .test_agent_loop import answer, fake_openai, function_call
+
+
+def use_tracing(monkeypatch):
+    monkeypatch.setattr(tracing, "_enabled", True)
+    tracing.clear()
+
+
+def test_spans_nest_across_threads(monkeypatch):
+    use_tracing(monkeypatch)
+
+    def work():
+        with tracing.span("inner"):
+            pass
+
+    async def main():
+        with tracing.span("outer", step=1) as span:
+            await asyncio.to_thread(work)
+            span.set(output_bytes=3)
+
+    asyncio.run(main())
+
+    inner, outer = tracing.spans()
+    assert inner.parent_id == outer.id
+    assert outer.parent_id is None
+    assert outer.attributes == {"step": 1, "output_bytes": 3}
+    assert inner.thread_id != outer.thread_id
+
+
+def test_disabled_tracing_records_nothing(monkeypatch):
+    monkeypatch.setattr(tracing, "_enabled", False)
+    tracing.clear()
+
+    with tracing.span("ignored") as span:
+        span.set(x=1)
+        tracing.annotate(y=2)
+
+    assert tracing.spans() == []
+
+
+def test_chat_turn_trace(monkeypatch, tmp_path):
+    use_tracing(monkeypatch)
+    fake_openai(monkeypatch, [function_call("print(6 * 7)"), answer("42")])
+
+    interpreter.Interpreter().chat("What is 6 * 7?")
+
+    spans = {span.name: span for span in tracing.spans()}
+    assert spans["agent.step"].parent_id == spans["chat.turn"].id
+    assert spans["llm.stream"].attributes["chunks"] > 0
+    assert spans["code.run"].attributes["output_bytes"] > 0
+    assert spans["python_interpreter.run"].parent_id == spans["code.run"].id
+    assert spans["chat.turn"].attributes["steps"] == 2
+
+    tracing.export_chrome_trace(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert {event["ph"] for event in events} == {"X"}
+    assert len(events) == len(tracing.spans())
+
+    tracing.export_jsonl(tmp_path / "trace.jsonl")
+    lines = (tmp_path / "trace.jsonl").read_text().splitlines()
+    assert json.loads(lines[-1])["name"] == "chat.turn"
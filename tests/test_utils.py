@@ -0,0 +1,47 @@
+import json
+
+from luana_engine.utils import PartialJSONParser, parse_partial_json
+
+
+def feed_in_chunks(text, size):
+    parser = PartialJSONParser()
+    for i in range(0, len(text), size):
+        parser.feed(text[i : i + size])
+    return parser
+
+
+def test_partial_json_parser_matches_json_loads():
+    arguments = {
+        "language": "python",
+        "code": "print('a\\nb')\n\"quoted\" \t café \U0001F600 \\ done",
+    }
+    text = json.dumps(arguments)
+    for size in [1, 2, 3, 7, len(text)]:
+        parser = feed_in_chunks(text, size)
+        assert parser.value == arguments
+        assert parser.complete
+        assert parser.text == text
+
+
+def test_partial_json_parser_exposes_partial_fields():
+    parser = PartialJSONParser()
+    assert parser.value is None
+    parser.feed('{"language": "pyt')
+    assert parser.value == {"language": "pyt"}
+    parser.feed('hon", "code": "import pandas as pd\nprint(')
+    assert parser.get("language") == "python"
+    assert parser.get("code") == "import pandas as pd\nprint("
+    assert parser.value == parse_partial_json(parser.text)
+
+
+def test_partial_json_parser_keeps_nested_values():
+    text = '{"code": "x", "options": {"a": [1, "}"]}, "retries": 3, "dry": false}'
+    parser = feed_in_chunks(text, 4)
+    assert parser.value == json.loads(text)
+
+
+def test_partial_json_parser_rejects_non_json():
+    parser = PartialJSONParser()
+    parser.feed("import pandas as pd")
+    assert parser.value is None
+    assert parser.text == "import pandas as pd"